@@ -0,0 +1,519 @@
+import datetime
+import multiprocessing
+import os
+import threading
+from multiprocessing import shared_memory
+import cv2
+import numpy as np
+
+from camera_manager import CameraPool
+from dsp import ChannelProcessor
+from frame_fanout import CaptureFanout, FrameConsumer, get_record_options
+from packet_decoder import PacketDecoder
+from serial_manager import SerialManager
+from signal_logger import MarkerQueue, SignalLogger, format_log_rows
+from trace_profiler import tracer
+from video_recorder import VideoRecorder
+
+
+NOTIFICATIONS = {'set_preview_size'} # commands sent without waiting, so the worker sends no reply
+
+
+class SharedFrameSlot:
+    """The newest preview frame of one camera, in shared memory written by the acquisition process."""
+    """A sequence counter guards the copy: it is odd while a frame is written, so the reader never shows a torn frame."""
+
+    MAX_SIZE = (1920, 1080) # the largest preview (w, h) a slot holds
+    HEADER_WORDS = 4 # sequence, height, width, spare
+
+    def __init__(self, name=None):
+        """Create a new slot, or attach to the slot called name."""
+        num_bytes = 8 * self.HEADER_WORDS + self.MAX_SIZE[0] * self.MAX_SIZE[1] * 3
+        self.is_owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.is_owner, size=num_bytes if self.is_owner else 0)
+        self.name = self.shm.name
+        self.header = np.ndarray((self.HEADER_WORDS,), dtype=np.uint64, buffer=self.shm.buf)
+        self.pixels = np.ndarray((num_bytes - 8 * self.HEADER_WORDS,), dtype=np.uint8, buffer=self.shm.buf, offset=8 * self.HEADER_WORDS)
+        if self.is_owner:
+            self.header[:] = 0
+        self.last_sequence = 0
+
+    @classmethod
+    def fit_size(cls, size):
+        """Return size (w, h) scaled down to fit the slot, keeping the aspect ratio."""
+        scale = min(1.0, cls.MAX_SIZE[0] / size[0], cls.MAX_SIZE[1] / size[1])
+        return max(1, int(size[0] * scale)), max(1, int(size[1] * scale))
+
+    def write(self, frame):
+        """Copy an RGB frame of at most MAX_SIZE into the slot."""
+        height, width = frame.shape[:2]
+        self.header[0] += 1 # odd: writing
+        self.header[1], self.header[2] = height, width
+        np.copyto(self.pixels[:frame.size].reshape(frame.shape), frame)
+        self.header[0] += 1
+
+    def read(self):
+        """Return a copy of the newest frame if it is new and complete, else None."""
+        sequence = int(self.header[0])
+        if sequence % 2 or sequence == self.last_sequence:
+            return None
+        height, width = int(self.header[1]), int(self.header[2])
+        frame = self.pixels[:height * width * 3].reshape(height, width, 3).copy()
+        if int(self.header[0]) != sequence: # overwritten meanwhile, the next frame follows soon
+            return None
+        self.last_sequence = sequence
+        return frame
+
+    def close(self):
+        """Detach from the slot; the owner also frees it."""
+        del self.header, self.pixels # the buffer cannot be released while arrays view it
+        self.shm.close()
+        if self.is_owner:
+            self.shm.unlink()
+
+
+class SharedSampleRing:
+    """Decimated signal samples from the acquisition process, in a shared memory ring of (time, channel, value) rows."""
+    """There is one writer; a reader that falls more than a ring behind skips the oldest rows, the logs stay complete."""
+
+    HEADER_WORDS = 2 # rows written, footprint of the acquisition process
+
+    def __init__(self, capacity=65536, name=None):
+        """Create a new ring of capacity rows, or attach to the ring called name."""
+        self.capacity = capacity
+        num_bytes = 8 * self.HEADER_WORDS + capacity * 3 * 8
+        self.is_owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.is_owner, size=num_bytes if self.is_owner else 0)
+        self.name = self.shm.name
+        self.header = np.ndarray((self.HEADER_WORDS,), dtype=np.uint64, buffer=self.shm.buf)
+        self.rows = np.ndarray((capacity, 3), dtype=np.float64, buffer=self.shm.buf, offset=8 * self.HEADER_WORDS)
+        if self.is_owner:
+            self.header[:] = 0
+        self.read_count = 0
+
+    def write(self, rows):
+        """Append an (n, 3) array of rows."""
+        rows = rows[-self.capacity:]
+        write_count = int(self.header[0])
+        positions = (write_count + np.arange(len(rows))) % self.capacity
+        self.rows[positions] = rows
+        self.header[0] = write_count + len(rows) # published after the rows are in place
+
+    def read(self):
+        """Return the (n, 3) rows written since the last read."""
+        write_count = int(self.header[0])
+        first = max(self.read_count, write_count - self.capacity)
+        rows = self.rows[np.arange(first, write_count) % self.capacity]
+        # rows the writer wrapped over during the copy are dropped
+        overwritten = int(self.header[0]) - self.capacity - first
+        self.read_count = write_count
+        return rows[max(0, overwritten):]
+
+    def set_footprint(self, num_bytes):
+        self.header[1] = num_bytes
+
+    def get_footprint(self):
+        return int(self.header[1])
+
+    def close(self):
+        """Detach from the ring; the owner also frees it."""
+        del self.header, self.rows
+        self.shm.close()
+        if self.is_owner:
+            self.shm.unlink()
+
+
+def decimate_min_max(times, values, bucket):
+    """Reduce a block to the minimum and maximum of every bucket of samples, in time order, so peaks stay visible."""
+    num_buckets = len(values) // bucket
+    if bucket <= 2 or not num_buckets:
+        return times, values
+    bucket_times = times[:num_buckets * bucket].reshape(num_buckets, bucket)
+    bucket_values = values[:num_buckets * bucket].reshape(num_buckets, bucket)
+    low, high = bucket_values.argmin(axis=1), bucket_values.argmax(axis=1)
+    order = np.stack((np.minimum(low, high), np.maximum(low, high)), axis=1)
+    rows = np.arange(num_buckets)[:, None]
+    tail = slice(num_buckets * bucket, None)
+    return (np.concatenate((bucket_times[rows, order].ravel(), times[tail])),
+            np.concatenate((bucket_values[rows, order].ravel(), values[tail])))
+
+
+class AcquisitionWorker:
+    """The acquisition side: owns the cameras, the serial port, the recorders and the loggers."""
+    """It runs in its own process: the main thread serves the control pipe, the capture, serial and writer threads do the work."""
+
+    DISPLAY_POINTS_PER_SECOND = 1000 # per channel, sent to the GUI after min/max decimation
+
+    def __init__(self, conn, ring_name, ring_capacity):
+        """Initialize the worker with its end of the control pipe and the GUI's sample ring."""
+        self.conn = conn
+        self.ring = SharedSampleRing(ring_capacity, name=ring_name)
+        self.caps = {}
+        self.cap_indices = {}
+        self.camera_pool = CameraPool() # the cameras stay open between previews, like in the GUI process
+        self.fanouts = {}
+        self.preview_consumers = {}
+        self.frame_slots = {}
+        self.recorders = {}
+        self.serial_manager = SerialManager(data_received_callback=self.on_serial_data_received)
+        self.packet_decoder = PacketDecoder()
+        self.signal_loggers = {}
+        self.raw_signal_loggers = {}
+        self.dsp_processors = {}
+        self.channels = []
+        self.is_receiving = False
+        self.receive_lock = threading.Lock()
+        self.marker_queue = MarkerQueue()
+        self.raw_marker_queue = MarkerQueue()
+        self.start_receiving_time = None
+        self.last_receive_time = None
+        self.handlers = {
+            'open_cameras': self.open_cameras,
+            'close_cameras': self.close_cameras,
+            'set_preview_size': self.set_preview_size,
+            'start_recording': self.start_recording,
+            'stop_recording': self.stop_recording,
+            'connect': self.connect,
+            'disconnect': self.serial_manager.disconnect,
+            'send': self.serial_manager.send_data,
+            'start_receive': self.start_receive,
+            'stop_receive': self.stop_receive,
+            'marker': self.add_marker,
+        }
+
+    def run(self):
+        """Serve commands until 'quit', publishing the footprint between them."""
+        while True:
+            if self.conn.poll(0.5):
+                try:
+                    command, args = self.conn.recv()
+                except EOFError: # the GUI process is gone
+                    break
+                if command == 'quit':
+                    break
+                try:
+                    reply = self.handlers[command](*args)
+                except Exception as e: # report to the GUI instead of killing acquisition
+                    reply = e
+                if command not in NOTIFICATIONS:
+                    self.conn.send(reply)
+                elif isinstance(reply, Exception):
+                    print(f"warning: the acquisition process failed '{command}': {reply}")
+            self.ring.set_footprint(self.get_footprint())
+        self.shutdown()
+        self.conn.send(None)
+
+    def shutdown(self):
+        """Stop receiving, recording and capturing, and release everything."""
+        self.stop_receive()
+        self.close_cameras()
+        self.camera_pool.close_all()
+        self.serial_manager.disconnect()
+        self.ring.close()
+
+    def get_footprint(self):
+        """Return the bytes queued in the recorders and loggers."""
+        loggers = list(self.signal_loggers.values()) + list(self.raw_signal_loggers.values())
+        return (sum(recorder.get_footprint() for recorder in self.recorders.values())
+                + sum(logger.get_footprint() for logger in loggers) + self.packet_decoder.get_footprint())
+
+    # --- Cameras ---
+    def open_cameras(self, cameras_to_open, slot_names, target_fps, preview_fps):
+        """Open the cameras and start their capture threads; returns ({cam_id: capture size}, [names not opened])."""
+        capture_sizes, failed = {}, []
+        for cam_info in cameras_to_open:
+            cam_id = cam_info['id']
+            cap = self.camera_pool.open(cam_info['index'], cam_info['width'], cam_info['height'], target_fps)
+            if cap is None:
+                failed.append(cam_info['name'])
+                continue
+            self.caps[cam_id] = cap
+            self.cap_indices[cam_id] = cam_info['index']
+            capture_sizes[cam_id] = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+            slot = self.frame_slots[cam_id] = SharedFrameSlot(slot_names[cam_id])
+            self.preview_consumers[cam_id] = FrameConsumer(lambda frame, timestamp, s=slot: s.write(frame), max_fps=preview_fps,
+                                                           size=SharedFrameSlot.fit_size(capture_sizes[cam_id]),
+                                                           conversion=cv2.COLOR_BGR2RGB)
+            fanout = self.fanouts[cam_id] = CaptureFanout(cap, f"CAM{cam_id+1}")
+            fanout.set_consumer('preview', self.preview_consumers[cam_id])
+            fanout.start()
+        return capture_sizes, failed
+
+    def set_preview_size(self, cam_id, size):
+        """Change the size the preview of a camera is written at."""
+        if cam_id in self.preview_consumers:
+            self.preview_consumers[cam_id].set_size(SharedFrameSlot.fit_size(size))
+
+    def close_cameras(self):
+        """Stop recording, then stop every camera and hand it back to the pool."""
+        self.stop_recording()
+        for fanout in self.fanouts.values():
+            fanout.stop()
+        for cam_id in self.caps:
+            self.camera_pool.release(self.cap_indices[cam_id])
+        for slot in self.frame_slots.values():
+            slot.close()
+        self.fanouts, self.caps, self.cap_indices, self.frame_slots, self.preview_consumers = {}, {}, {}, {}, {}
+
+    def start_recording(self, filenames, target_fps, max_buffer_bytes, segment_duration, segment_max_bytes, recording_formats):
+        """Record every open camera to its file in {cam_id: filename}, in its recording format; returns the ids recording."""
+        for cam_id, filename in filenames.items():
+            fanout = self.fanouts.get(cam_id)
+            if fanout is None:
+                continue
+            capture_size = (int(fanout.cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(fanout.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+            consumer_options, resolution, is_color = get_record_options(capture_size, **recording_formats[cam_id])
+            recorder = VideoRecorder(filename, resolution, target_fps, max_buffer_bytes=max_buffer_bytes,
+                                     segment_duration=segment_duration, segment_max_bytes=segment_max_bytes, is_color=is_color)
+            recorder.start()
+            fanout.set_consumer('record', FrameConsumer(recorder.put_frame, **consumer_options))
+            self.recorders[cam_id] = recorder
+        return list(self.recorders)
+
+    def stop_recording(self):
+        """Stop every recorder and wait for its files to be written."""
+        for cam_id, recorder in self.recorders.items():
+            if cam_id in self.fanouts:
+                self.fanouts[cam_id].remove_consumer('record')
+            recorder.stop()
+        self.recorders = {}
+
+    # --- Serial ---
+    def connect(self, port, baudrate):
+        """Connect to the serial port; returns True on success."""
+        self.packet_decoder.forget_protocol()
+        return self.serial_manager.connect(port, baudrate=baudrate)
+
+    def start_receive(self, channels, output_folder, log_settings, dsp_stage_specs, log_raw_signal):
+        """Open the loggers of the channels and start decoding; returns the log filenames."""
+        """log_settings is (compression, level, chunk_duration); raises OSError if a log cannot be created."""
+        compression, level, chunk_duration = log_settings
+        timestamp = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+        filenames = []
+        with self.receive_lock:
+            try:
+                for ch in channels:
+                    header = f"Time(s),CH{ch}_Data(V),Marker\n"
+                    suffixes = ["", "_raw"] if dsp_stage_specs.get(ch) and log_raw_signal else [""]
+                    for suffix in suffixes:
+                        full_filepath = os.path.join(output_folder, f"CH{ch}_{timestamp}{suffix}.csv")
+                        logger = SignalLogger(full_filepath, header, compression=compression, level=level, chunk_duration=chunk_duration)
+                        logger.start()
+                        (self.raw_signal_loggers if suffix else self.signal_loggers)[ch] = logger
+                        filenames.append(full_filepath)
+            except OSError:
+                for logger in list(self.signal_loggers.values()) + list(self.raw_signal_loggers.values()):
+                    logger.close()
+                self.signal_loggers, self.raw_signal_loggers = {}, {}
+                raise
+            self.dsp_processors = {ch: ChannelProcessor(dsp_stage_specs[ch]) for ch in channels if dsp_stage_specs.get(ch)}
+            self.channels = list(channels)
+            self.packet_decoder.reset()
+            self.marker_queue.clear()
+            self.raw_marker_queue.clear()
+            self.start_receiving_time = datetime.datetime.now()
+            self.last_receive_time = None
+            self.is_receiving = True
+        return filenames
+
+    def stop_receive(self):
+        """Stop decoding and close every logger; returns a line per saved log."""
+        with self.receive_lock: # no batch is half logged when the loggers close
+            self.is_receiving = False
+        saved = []
+        for loggers, kind in ((self.signal_loggers, "data"), (self.raw_signal_loggers, "raw data")):
+            for logger in loggers.values():
+                logger.close()
+                where = f"{len(logger.chunks)} chunks, indexed in {logger.get_index_filename()}" if logger.is_chunked else logger.get_chunk_filename(0)
+                saved.append(f"The {kind} is saved in {where}")
+        self.signal_loggers, self.raw_signal_loggers = {}, {}
+        return saved
+
+    def add_marker(self):
+        """Mark the current time in the log, at the logged sample nearest it."""
+        if self.start_receiving_time is not None:
+            marker_time = (datetime.datetime.now() - self.start_receiving_time).total_seconds()
+            self.marker_queue.add(marker_time)
+            self.raw_marker_queue.add(marker_time)
+
+    def on_serial_data_received(self, data_bytes):
+        """Decode a batch on the serial thread, log it and publish a decimated copy to the GUI."""
+        with self.receive_lock:
+            if not self.is_receiving:
+                return
+            current_time = datetime.datetime.now()
+            with tracer.span("decode"):
+                channels, values = self.packet_decoder.feed(data_bytes)
+            if not len(channels):
+                return
+            # the same time stamps as a receive in the GUI process
+            num_points = len(channels)
+            start_time = self.last_receive_time or self.start_receiving_time
+            time_step = (current_time - start_time).total_seconds() / num_points
+            first_time = (start_time - self.start_receiving_time).total_seconds()
+            times = first_time + (np.arange(num_points) + 1) * time_step
+            marker_channel = self.channels[0] if self.channels else None
+            display_rows = []
+            for ch in self.channels:
+                in_channel = channels == ch
+                ch_times, ch_values = times[in_channel], values[in_channel]
+                if not len(ch_times):
+                    continue
+                if ch in self.raw_signal_loggers:
+                    marked_rows = self.raw_marker_queue.take_rows(ch_times) if ch == marker_channel else ()
+                    self._write_log_rows(self.raw_signal_loggers[ch], ch_times, ch_values, marked_rows)
+                processor = self.dsp_processors.get(ch)
+                if processor:
+                    with tracer.span("dsp"):
+                        ch_times, ch_values = processor.process(ch_times, ch_values)
+                    if not len(ch_times):
+                        continue
+                if ch in self.signal_loggers:
+                    marked_rows = self.marker_queue.take_rows(ch_times) if ch == marker_channel else ()
+                    self._write_log_rows(self.signal_loggers[ch], ch_times, ch_values, marked_rows)
+                duration = max(ch_times[-1] - ch_times[0], time_step)
+                bucket = int(len(ch_times) / (self.DISPLAY_POINTS_PER_SECOND / 2 * duration))
+                ch_times, ch_values = decimate_min_max(ch_times, ch_values, bucket)
+                display_rows.append(np.column_stack((ch_times, np.full(len(ch_times), ch), ch_values)))
+            if display_rows:
+                self.ring.write(np.concatenate(display_rows))
+            self.last_receive_time = current_time
+
+    @staticmethod
+    def _write_log_rows(logger, times, values, marked_rows):
+        """Queue a channel's batch on a logger as CSV rows, with the given rows marked."""
+        text, markers = format_log_rows(times, values, marked_rows)
+        logger.write_rows(times[0], times[-1], text, markers)
+
+
+def run_acquisition(conn, ring_name, ring_capacity):
+    """The entry point of the acquisition process."""
+    AcquisitionWorker(conn, ring_name, ring_capacity).run()
+
+
+class AcquisitionClient:
+    """The GUI side of the acquisition process: starts it, sends it commands and reads its shared memory."""
+    """It has the SerialManager interface, so the controller's serial commands go through it unchanged."""
+
+    REPLY_TIMEOUT = 10.0 # seconds; stopping a recorder waits for its queue to be written
+
+    def __init__(self, ring_capacity=65536):
+        """Create the shared sample ring and start the acquisition process."""
+        self.ring = SharedSampleRing(ring_capacity)
+        self.frame_slots = {}
+        self.preview_sizes = {}
+        self.serial_port = None # the port lives in the acquisition process
+        self.is_connected = False
+        self.lock = threading.Lock()
+        context = multiprocessing.get_context('spawn') # a fork would copy the Tk and capture state
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=run_acquisition, args=(child_conn, self.ring.name, ring_capacity),
+                                       name="acquisition", daemon=True)
+        self.process.start()
+
+    def request(self, command, *args):
+        """Send a command and return its reply; raises the exception the command raised, or TimeoutError."""
+        with self.lock:
+            self.conn.send((command, args))
+            if not self.conn.poll(self.REPLY_TIMEOUT):
+                raise TimeoutError(f"the acquisition process did not answer '{command}'")
+            reply = self.conn.recv()
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    def notify(self, command, *args):
+        """Send a command in NOTIFICATIONS without waiting for it; returns False, sending nothing, while a request is running."""
+        if not self.lock.acquire(blocking=False):
+            return False
+        try:
+            self.conn.send((command, args))
+        finally:
+            self.lock.release()
+        return True
+
+    def close(self):
+        """Stop the acquisition process and free the shared memory."""
+        try:
+            self.request('quit')
+        except (TimeoutError, OSError, EOFError) as e:
+            print(f"warning: the acquisition process did not stop cleanly: {e}")
+        self.process.join(timeout=self.REPLY_TIMEOUT)
+        if self.process.is_alive():
+            self.process.terminate()
+        self._close_frame_slots()
+        self.ring.close()
+
+    def get_footprint(self):
+        """Return the bytes queued in the acquisition process, as it last published them."""
+        return self.ring.get_footprint()
+
+    # --- Cameras ---
+    def open_cameras(self, cameras_to_open, target_fps, preview_fps):
+        """Open the cameras in the acquisition process; returns ({cam_id: capture size}, [names not opened])."""
+        self._close_frame_slots()
+        self.frame_slots = {cam_info['id']: SharedFrameSlot() for cam_info in cameras_to_open}
+        slot_names = {cam_id: slot.name for cam_id, slot in self.frame_slots.items()}
+        capture_sizes, failed = self.request('open_cameras', cameras_to_open, slot_names, target_fps, preview_fps)
+        for cam_id in set(self.frame_slots) - set(capture_sizes):
+            self.frame_slots.pop(cam_id).close()
+        return capture_sizes, failed
+
+    def close_cameras(self):
+        self.request('close_cameras')
+        self._close_frame_slots()
+
+    def _close_frame_slots(self):
+        for slot in self.frame_slots.values():
+            slot.close()
+        self.frame_slots = {}
+        self.preview_sizes = {}
+
+    def take_preview(self, cam_id, size):
+        """Return the newest preview frame of a camera, or None; size is the canvas (w, h) it is wanted at."""
+        # a resize must not wait on the pipe; while another command runs it is sent on a later frame
+        if self.preview_sizes.get(cam_id) != size and self.notify('set_preview_size', cam_id, size):
+            self.preview_sizes[cam_id] = size
+        slot = self.frame_slots.get(cam_id)
+        return slot.read() if slot else None
+
+    def start_recording(self, filenames, target_fps, max_buffer_bytes, segment_duration, segment_max_bytes, recording_formats):
+        return self.request('start_recording', filenames, target_fps, max_buffer_bytes, segment_duration, segment_max_bytes, recording_formats)
+
+    def stop_recording(self):
+        self.request('stop_recording')
+
+    # --- Serial, as SerialManager ---
+    @staticmethod
+    def find_serial_ports():
+        return SerialManager.find_serial_ports()
+
+    def connect(self, ports, baudrate=9600):
+        """Connect the acquisition process to the first of ports; it reads a single device."""
+        self.is_connected = self.request('connect', ports[0], baudrate)
+        return self.is_connected
+
+    def disconnect(self):
+        self.request('disconnect')
+        self.is_connected = False
+
+    def send_data(self, data):
+        self.request('send', data)
+
+    def start_receive(self, channels, output_folder, log_settings, dsp_stage_specs, log_raw_signal):
+        return self.request('start_receive', channels, output_folder, log_settings, dsp_stage_specs, log_raw_signal)
+
+    def stop_receive(self):
+        return self.request('stop_receive')
+
+    def add_marker(self):
+        self.request('marker')
+
+    def read_samples(self):
+        """Return {channel: (times, values)} of the decimated samples received since the last call."""
+        rows = self.ring.read()
+        samples = {}
+        for ch in np.unique(rows[:, 1]).astype(int).tolist():
+            in_channel = rows[:, 1] == ch
+            samples[ch] = (rows[in_channel, 0], rows[in_channel, 2])
+        return samples
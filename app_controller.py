@@ -1,18 +1,28 @@
-import cv2
 import tkinter as tk
-from PIL import Image, ImageTk
+from tkinter import filedialog
 import datetime
+import json
 import threading
 import numpy as np
 import os
 import sys
+import time
 
 # Project imports
+# cv2, PIL, Matplotlib and the modules built on them are imported where first needed, so the window opens
+# without waiting for them (see startup_benchmark.py)
 from gui_view import AppGUI
-from camera_manager import CameraManager
-from video_recorder import VideoRecorder
-from serial_manager import SerialManager
-from plot_manager import PlotManager
+from serial_manager import SerialDeviceGroup, SerialDevice
+from trace_profiler import tracer
+from load_governor import LoadGovernor
+from memory_budget import MemoryBudget
+from signal_logger import MarkerQueue, SignalLogger, format_log_rows
+from dsp import BITS_PER_BYTE, ChannelProcessor, get_max_sample_rate, measure_throughput
+from disk_preflight import (check_disk, estimate_log_bandwidth, estimate_video_bandwidth, get_cached_throughput,
+                            is_on_same_disk, measure_write_throughput)
+from trigger_engine import ChannelTrigger, TriggerEngine, SampleRingBuffer, FrameRingBuffer
+from live_publisher import LivePublisher
+from session_manifest import SESSION_FILENAME, SessionIndex, SessionManifest
 
 
 # ============================================
@@ -41,35 +51,177 @@ class AppController:
             panel.selected_camera_var.trace_add("write", lambda *args, p=panel: self.on_camera_select(p.camera_id))
         # --- Multi-camera state variables ---
         self.caps = {}
+        self.cap_indices = {} # {cam_id: device index} of the captures borrowed from the camera pool
+        self.camera_pool = None # warm capture handles, created by the first scan
+        self.camera_pool_lock = threading.Lock()
+        self.CAMERA_IDLE_TIMEOUT = 300.0 # seconds an unused camera stays open
+        self.fanouts = {} # one capture thread per camera, feeding preview, recorder and analysis
+        self.capture_sizes = {}
+        self.preview_consumers = {}
+        self.preview_frames = {}
+        self.analysis_consumers = {} # {name: (camera id, FrameConsumer)}, kept across previews
+        self.PREVIEW_FPS = 15.0
         self.recorders = {}
         self.is_previewing = False
         self.is_recording = False
         self.available_cameras = {}
         self.resolution_cache = {}
         self.TARGET_FPS = 30.0
+        self.segment_duration = None # seconds per video segment, None for no rotation by duration
+        self.segment_max_bytes = None # bytes per video segment, None for no rotation by size
+        self.refuse_slow_disk = True # refuse to start writing to a disk slower than the estimated bandwidth, else only warn
+        self.is_disk_checked = False # set while record & receive starts, which tests the disk once for both
+        self.disk_probe_thread = None # the write test running on a worker thread
+        self.disk_probe_retry = None # the start to retry on the GUI thread once the test is done
+        # per camera region of interest (fractions of the frame), grayscale and integer downscale of the recording
+        self.recording_formats = {cam_id: {'roi': None, 'grayscale': False, 'step': 1} for cam_id in range(2)}
         # --- Serial communication state variables ---
         self.available_serial_ports = {}
         self.is_serial_connected = False
-        self.serial_data_buffer = b''
+        self.serial_ports = [] # the connected ports, the selected one first
         self.is_led_on = False
         self.is_serial_receiving = False
-        self.log_files = {}
+        self.signal_loggers = {}
+        self.log_compression = None # None, 'gzip', 'zlib' or 'lzma'
+        self.log_compression_level = 6
+        self.log_chunk_duration = None # seconds per log chunk, None for a single file
+        self.dsp_stage_specs = {1: [], 2: []} # (kind, parameter) stages per channel
+        self.dsp_processors = {}
+        self.DSP_THROUGHPUT_MARGIN = 10.0 # the filters must run this many times faster than real time
+        self.dsp_throughputs = {} # {(stage specs, sample rate): measured samples per second}
+        self.log_raw_signal = False # also log the unfiltered stream when a channel is filtered
+        self.capture_serial = False # tee the raw serial bytes into SERIAL_[Timestamp].scap while receiving
+        self.raw_signal_loggers = {}
+        self.spectrum_panel = None # created the first time it is shown
+        self.is_spectrum_visible = False
+        # --- Trigger state variables ---
+        self.trigger_specs = {} # {channel: (kind, level, direction)}
+        self.trigger_pre_seconds = 2.0
+        self.trigger_hold_seconds = 2.0
+        self.TRIGGER_START_MARGIN = 1.0 # seconds the pre-trigger buffers keep beyond the pre-trigger time, until the GUI takes them
+        self.is_trigger_armed = False
+        self.trigger_engine = None # only while receiving armed
+        self.sample_rings = {}
+        self.frame_rings = {}
+        self.is_trigger_recording = False
+        self.log_time_origin = 0.0 # subtracted from the logged times, the pre-trigger start of a triggered log
+        self.triggered_log_time = None # the trigger time of the event being logged, set on the reader thread
+        self.trigger_log_lock = threading.Lock() # hands the triggered logs over between two batches
+        self.signal_output_folder = None
+        # --- Acquisition process state variables ---
+        self.acquisition = None # the AcquisitionClient while cameras, serial port and writers run in their own process
+        self.SAMPLE_POLL_MS = 50
+        # --- Live publishing state variables ---
+        self.publisher = None # the LivePublisher while publishing is on
+        self.PUBLISH_ADDRESS = ('127.0.0.1', 50007)
+        self.PUBLISH_FRAME_FPS = 5.0
+        self.PUBLISH_FRAME_WIDTH = 320
+        self.PUBLISH_JPEG_QUALITY = 70
+        # --- Camera activity state variables ---
+        self.frame_activity = None # the FrameActivity while camera activity is logged
+        self.activity_channels = {} # {channel: label} of the activity signals being received
+        self.ACTIVITY_FPS = 15.0
+        self.ACTIVITY_WIDTH = 160
+        self.ACTIVITY_POLL_MS = 100
         self.selected_channels_for_log = []
-        self.marker_pending = False
+        self.marker_queue = MarkerQueue() # markers waiting for the logged sample nearest them
+        self.raw_marker_queue = MarkerQueue() # the same markers, for the raw log
+        self.stream_time_origin = None # perf_counter value of sample time 0 while receiving
         self.start_receiving_time = None
-        self.last_receive_time = None
         self.is_record_receive = False
+        self.session = None # the SessionManifest of the running record-and-receive session
+        self.batch_export = None # the BatchExport while one runs
+        # --- Diagnostics state variables ---
+        self.PROFILE_WINDOW_SECONDS = 10.0
+        self.is_profiling = False
+        self.MEMORY_REPORT_INTERVAL_MS = 1000
+        # --- Load shedding state variables ---
+        self.PLOT_INTERVAL_MS = 100 # plot refresh after new samples, raised while shedding
+        self.plot_interval_ms = self.PLOT_INTERVAL_MS
+        self.is_plot_update_scheduled = False
+        self.plot_seconds = 0.0 # GUI time spent in plot updates since the last load check
+        self.preview_fps_scale = 1.0 # of PREVIEW_FPS
+        self.preview_size_scale = 1.0 # of the canvas size, the preview is scaled back up for display
+        self.analysis_fps_scale = 1.0 # of each analysis consumer's own rate
+        self.plot_decimation = 1 # every n-th sample is drawn
+        self.analysis_max_fps = {} # {name: requested rate} of the analysis consumers
+        self.LOAD_CHECK_INTERVAL_MS = 500
+        self.GUI_LAG_LIMIT = 0.1 # seconds a GUI callback may run late
+        self.PLOT_CPU_LIMIT = 0.3 # fraction of the GUI thread the plot may use
+        self.RECORDER_QUEUE_LIMIT = 0.5 # fill of a recorder's frame queue
+        self.LOG_BACKLOG_LIMIT = 8 * 1024 * 1024 # bytes queued in the signal loggers
+        self.load_governor = None # the LoadGovernor while load shedding is on
+        self.gui_lag = 0.0 # seconds the last load check ran late
+        self.load_check_time = None
          # --- Base path for use ---
         self.base_path = get_base_path()
         # --- Service components ---
-        self.camera_manager = CameraManager()
-        self.serial_manager = SerialManager(data_received_callback=self.on_serial_data_received)
-        self.plot_manager = PlotManager(self.view.serial_plot_frame)
+        self.memory_budget = MemoryBudget()
+        self.serial_devices = SerialDeviceGroup(samples_received_callback=self.on_serial_samples_received,
+                                                max_buffer_bytes=self.memory_budget.get_parser_buffer_cap(),
+                                                connection_lost_callback=self.on_serial_connection_lost)
+        self.serial_manager = self.serial_devices # or the acquisition process, see set_acquisition_process
+        self.plot_manager = None # created with its Matplotlib figure when receiving first starts
+        self.memory_budget.register("serial parser", self.serial_devices.get_footprint)
+        self.set_load_shedding(True)
         # --- Final setup ---
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
-        self.refresh_cameras()
-        self.refresh_serial_ports()
+        self.device_cache_filename = os.path.join(self.base_path, "data", "devices.json")
+        self._show_cached_devices()
+        # both scans run in the background, side by side, and replace the cached lists when they finish
+        threading.Thread(target=self._scan_and_update_cameras, daemon=True).start()
+        threading.Thread(target=self._scan_and_update_serial_ports, daemon=True).start()
         self.view.set_serial_controls_state("disabled")
+        self._update_memory_report()
+
+    def _ensure_plot_manager(self):
+        """Create the signal plot the first time it is needed; importing Matplotlib is the slowest part of startup."""
+        if self.plot_manager is not None:
+            return
+        from plot_manager import PlotManager
+        self.view.remove_plot_placeholder()
+        self.plot_manager = PlotManager(self.view.serial_plot_frame,
+                                        max_points=self.memory_budget.get_plot_sample_cap(2),
+                                        max_markers=self.memory_budget.MAX_MARKERS, show_readouts=True)
+        self.plot_manager.set_decimation(self.plot_decimation)
+        self.memory_budget.register("plot samples", lambda: self.plot_manager.get_num_samples() * self.memory_budget.BYTES_PER_PLOT_SAMPLE)
+        self.memory_budget.register("markers", lambda: self.plot_manager.get_num_markers() * self.memory_budget.BYTES_PER_MARKER)
+
+    # ============================================
+    # ------------- Device Cache -----------------
+    # ============================================
+    def _show_cached_devices(self):
+        """Fill the camera and serial port menus with what the previous run found, until the scans finish."""
+        try:
+            with open(self.device_cache_filename) as f:
+                cache = json.load(f)
+            self.available_cameras = dict(cache['cameras'])
+            self.resolution_cache = {int(index): resolutions for index, resolutions in cache['resolutions'].items()}
+            self.available_serial_ports = list(cache['serial_ports'])
+        except (OSError, ValueError, KeyError, TypeError):
+            self.available_cameras, self.resolution_cache, self.available_serial_ports = {}, {}, []
+        if self.available_cameras:
+            for camera_id in range(2):
+                self.view.update_camera_menu(camera_id, list(self.available_cameras))
+            self.view.update_camera_state("State: Cameras of the last run, rescanning...")
+        else:
+            self.view.update_camera_state("State: Scanning cameras...")
+        if self.available_serial_ports:
+            self.view.update_serial_port_menu(self.available_serial_ports)
+            self.view.update_serial_state("State: Serial ports of the last run, rescanning...")
+        else:
+            self.view.update_serial_state("State: Scanning serial ports...")
+
+    def _save_device_cache(self):
+        """Keep the found cameras, resolutions and serial ports for the next start."""
+        cache = {'cameras': self.available_cameras, 'resolutions': self.resolution_cache, 'serial_ports': self.available_serial_ports}
+        try:
+            os.makedirs(os.path.dirname(self.device_cache_filename), exist_ok=True)
+            with open(self.device_cache_filename + ".tmp", "w") as f:
+                json.dump(cache, f, indent=2)
+            os.replace(self.device_cache_filename + ".tmp", self.device_cache_filename)
+        except OSError as e:
+            print(f"warning: cannot cache the device lists: {e}")
 
 
     # ============================================
@@ -91,14 +243,38 @@ class AppController:
         # start a thread to scan for cameras
         threading.Thread(target=self._scan_and_update_cameras, daemon=True).start()
 
+    def _get_camera_pool(self):
+        """Return the pool of warm camera handles, or None while the cameras belong to the acquisition process."""
+        if self.acquisition is not None:
+            return None
+        with self.camera_pool_lock:
+            if self.camera_pool is None:
+                from camera_manager import CameraPool
+                self.camera_pool = CameraPool(idle_timeout=self.CAMERA_IDLE_TIMEOUT)
+            return self.camera_pool
+
+    def _close_camera_pool(self):
+        """Release every warm camera handle, e.g. before another process opens the cameras."""
+        with self.camera_pool_lock:
+            if self.camera_pool is not None:
+                self.camera_pool.close_all()
+                self.camera_pool = None
+
     def _scan_and_update_cameras(self):
-        """Scan for available cameras in a background thread and update the UI."""
-        self.available_cameras = self.camera_manager.find_available_cameras()
-        camera_names = list(self.available_cameras.keys())
+        """Scan for available cameras in a background thread and update the UI; the cameras found stay open in the pool."""
+        from camera_manager import CameraManager
+        shown_cameras = self.available_cameras
+        available_cameras = CameraManager.find_available_cameras(self._get_camera_pool())
+        camera_names = list(available_cameras.keys())
         # update the UI when the scan is complete
         def update_ui():
-            self.view.update_camera_menu(0, camera_names)
-            self.view.update_camera_menu(1, camera_names)
+            if available_cameras != shown_cameras or not camera_names: # the cached menus keep their selection if nothing changed
+                if available_cameras != shown_cameras:
+                    self.resolution_cache = {}
+                self.available_cameras = available_cameras
+                self.view.update_camera_menu(0, camera_names)
+                self.view.update_camera_menu(1, camera_names)
+            self._save_device_cache()
             if camera_names:
                 self.view.update_camera_state("State: Cameras refreshed.")
             else:
@@ -127,9 +303,11 @@ class AppController:
 
     def _scan_camera_resolutions(self, camera_id, cam_index):
         """Scan for available resolutions for the chosen camera."""
-        resolutions = self.camera_manager.find_available_resolutions(cam_index)
+        from camera_manager import CameraManager
+        resolutions = CameraManager.find_available_resolutions(cam_index, self._get_camera_pool())
         self.resolution_cache[cam_index] = resolutions
         self.root.after(0, self.view.update_camera_resolution_menu, camera_id, resolutions)
+        self.root.after(0, self._save_device_cache)
 
     def toggle_preview(self):
         """Toggle the camera preview start or stop."""
@@ -162,22 +340,40 @@ class AppController:
                 'id': cam_id, 'index': cam_index, 'name': cam_name,
                 'width': width, 'height': height
             })
-        # 2. open the validated cameras
+        if self.acquisition is not None:
+            self._start_process_preview(cameras_to_open)
+            return
+        # 2. borrow the validated cameras from the pool, opened and configured only if they are not already
+        import cv2
+        from frame_fanout import CaptureFanout, FrameConsumer, LatestFrame
         self.caps = {}
+        self.cap_indices = {}
+        camera_pool = self._get_camera_pool()
         for cam_info in cameras_to_open:
-            cap = cv2.VideoCapture(cam_info['index'])
-            cap.set(cv2.CAP_PROP_FRAME_WIDTH, cam_info['width'])
-            cap.set(cv2.CAP_PROP_FRAME_HEIGHT, cam_info['height'])
-            cap.set(cv2.CAP_PROP_FPS, self.TARGET_FPS)
-            if cap.isOpened():
+            cap = camera_pool.open(cam_info['index'], cam_info['width'], cam_info['height'], self.TARGET_FPS)
+            if cap is not None:
                 self.caps[cam_info['id']] = cap
+                self.cap_indices[cam_info['id']] = cam_info['index']
             else:
                 self.view.update_camera_state(f"Error: Cannot open camera '{cam_info['name']}'.", color="red")
         if not self.caps: # if no cameras were opened, show error
             if not selected_indices:
                  self.view.update_camera_state("Error: No valid camera selected for preview.", color="red")
             return
-        # 3. start the preview
+        # 3. start a capture thread per camera, fanning out to the preview and the analysis consumers
+        for cam_id, cap in self.caps.items():
+            self.capture_sizes[cam_id] = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+            fanout = CaptureFanout(cap, f"CAM{cam_id+1}")
+            self.preview_frames[cam_id] = LatestFrame()
+            self.preview_consumers[cam_id] = FrameConsumer(self.preview_frames[cam_id].put, max_fps=self.PREVIEW_FPS * self.preview_fps_scale,
+                                                           conversion=cv2.COLOR_BGR2RGB)
+            fanout.set_consumer('preview', self.preview_consumers[cam_id])
+            for name, (consumer_cam_id, consumer) in self.analysis_consumers.items():
+                if consumer_cam_id == cam_id:
+                    fanout.set_consumer(name, consumer)
+            fanout.start()
+            self.fanouts[cam_id] = fanout
+        # 4. start the preview
         self.is_previewing = True
         self.view.set_camera_preview_state(True)
         self._update_camera_frames()
@@ -189,9 +385,16 @@ class AppController:
         if self.is_recording:
             self.toggle_recording()
         self.is_previewing = False
-        for cap in self.caps.values():
-            cap.release()
+        if self.acquisition is not None:
+            self.acquisition.close_cameras()
+        for fanout in self.fanouts.values():
+            fanout.stop()
+        self.fanouts = {}
+        # the cameras stay open, idle, so the next preview starts at once
+        for cam_id in self.caps:
+            self.camera_pool.release(self.cap_indices[cam_id])
         self.caps = {}
+        self.cap_indices = {}
         self.view.set_camera_preview_state(False)
         self.view.record_receive_button.config(state="disabled")
 
@@ -199,28 +402,36 @@ class AppController:
         """The main preview loop for camera feeds."""
         if not self.is_previewing:
             return
+        tracer.profile_checkpoint()
         # 1. get the active camera IDs
-        active_cam_ids = list(self.caps.keys())
+        active_cam_ids = list(self.acquisition.frame_slots if self.acquisition is not None else self.caps)
         for cam_id in active_cam_ids:
-            cap = self.caps.get(cam_id)
-            if not cap:
-                continue
-            ret, frame = cap.read()
-            if ret:
-                # 2. if recording, put the frame into the corresponding recorder
-                if self.is_recording and cam_id in self.recorders:
-                    self.recorders[cam_id].put_frame(frame)
-                # 3. prepare and display the frame on its dedicated canvas
-                canvas_to_draw = self.view.get_camera_canvas(cam_id) 
-                canvas_width = canvas_to_draw.winfo_width()
-                canvas_height = canvas_to_draw.winfo_height()
-                if canvas_width > 1 and canvas_height > 1:
-                    # resize the frame to fit the canvas
-                    resized_frame = cv2.resize(frame, (canvas_width, canvas_height))
-                    cv_image = cv2.cvtColor(resized_frame, cv2.COLOR_BGR2RGB)
-                    photo = ImageTk.PhotoImage(image=Image.fromarray(cv_image))
-                    # display the image on the canvas
-                    self.view.display_camera_image(cam_id, photo)
+            canvas_to_draw = self.view.get_camera_canvas(cam_id) 
+            canvas_size = (canvas_to_draw.winfo_width(), canvas_to_draw.winfo_height())
+            # while shedding load the preview is converted smaller and scaled back up on display
+            preview_size = (max(1, int(canvas_size[0] * self.preview_size_scale)), max(1, int(canvas_size[1] * self.preview_size_scale)))
+            if self.acquisition is not None:
+                # 2. the acquisition process writes the preview at the canvas size into shared memory
+                preview_frame = self.acquisition.take_preview(cam_id, preview_size) if min(canvas_size) > 1 else None
+            else:
+                fanout = self.fanouts.get(cam_id)
+                if not fanout:
+                    continue
+                # 2. while armed and not recording, keep the pre-trigger frames
+                self._sync_pretrigger_consumer(cam_id, fanout)
+                # 3. the capture thread downscales the preview to the canvas size, only display it here
+                if min(canvas_size) > 1:
+                    self.preview_consumers[cam_id].set_size(preview_size)
+                preview_frame, _ = self.preview_frames[cam_id].take()
+            if preview_frame is not None:
+                from PIL import Image, ImageTk
+                with tracer.span("frame display"):
+                    image = Image.fromarray(preview_frame)
+                    if self.preview_size_scale < 1.0 and min(canvas_size) > 1:
+                        image = image.resize(canvas_size, Image.NEAREST)
+                    photo = ImageTk.PhotoImage(image=image)
+                # display the image on the canvas
+                self.view.display_camera_image(cam_id, photo)
         # if only one camera is active, clear the other canvas
         if len(active_cam_ids) == 1:
             other_canvas_index = 1 - active_cam_ids[0]
@@ -230,6 +441,53 @@ class AppController:
         # 4. schedule the next frame update
         self.root.after(int(1000/60), self._update_camera_frames)
 
+    def _start_process_preview(self, cameras_to_open):
+        """Open the cameras in the acquisition process and start showing their shared memory previews."""
+        try:
+            capture_sizes, failed = self.acquisition.open_cameras(cameras_to_open, self.TARGET_FPS, self.PREVIEW_FPS)
+        except (OSError, TimeoutError) as e:
+            print(f"warning: the acquisition process cannot open the cameras: {e}")
+            capture_sizes, failed = {}, [cam_info['name'] for cam_info in cameras_to_open]
+        for cam_name in failed:
+            self.view.update_camera_state(f"Error: Cannot open camera '{cam_name}'.", color="red")
+        if not capture_sizes:
+            if not cameras_to_open:
+                self.view.update_camera_state("Error: No valid camera selected for preview.", color="red")
+            return
+        self.capture_sizes.update(capture_sizes)
+        self.is_previewing = True
+        self.view.set_camera_preview_state(True)
+        self._update_camera_frames()
+        if self.is_serial_connected:
+            self.view.record_receive_button.config(state="normal")
+
+    def _sync_pretrigger_consumer(self, cam_id, fanout):
+        """Feed every full resolution frame to the pre-trigger buffer while armed and not recording."""
+        from frame_fanout import FrameConsumer
+        wants_frames = self.trigger_engine is not None and not self.is_recording
+        if wants_frames and not fanout.has_consumer('pre-trigger'):
+            fanout.set_consumer('pre-trigger', FrameConsumer(lambda frame, timestamp, c=cam_id: self._get_frame_ring(c, frame).push(frame, timestamp)))
+        elif not wants_frames and fanout.has_consumer('pre-trigger'):
+            fanout.remove_consumer('pre-trigger')
+
+    def set_analysis_consumer(self, cam_id, name, callback, max_fps=10.0, width=160, grayscale=True):
+        """Feed a camera's frames to callback(thumbnail, timestamp) as thumbnails (grayscale, else BGR), on its capture thread."""
+        import cv2
+        from frame_fanout import FrameConsumer
+        consumer = FrameConsumer(callback, max_fps=max_fps * self.analysis_fps_scale, width=width,
+                                 conversion=cv2.COLOR_BGR2GRAY if grayscale else None)
+        self.analysis_consumers[name] = (cam_id, consumer)
+        self.analysis_max_fps[name] = max_fps
+        if cam_id in self.fanouts:
+            self.fanouts[cam_id].set_consumer(name, consumer)
+
+    def remove_analysis_consumer(self, name):
+        """Stop feeding an analysis consumer."""
+        cam_id, _ = self.analysis_consumers.pop(name, (None, None))
+        self.analysis_max_fps.pop(name, None)
+        if cam_id in self.fanouts:
+            self.fanouts[cam_id].remove_consumer(name)
+
     def toggle_recording(self):
         """Toggle the video record start or stop."""
         if self.is_recording:
@@ -237,29 +495,54 @@ class AppController:
         else:
             self._start_recording()
 
-    def _start_recording(self):
+    def _start_recording(self, preroll_start=None):
         """Start a separate VideoRecorder for each active camera stream."""
+        """With preroll_start (a perf_counter value) the frames each camera buffered since then are recorded first."""
         if not self.is_previewing or self.is_recording:
             return
         # create the output folder if it does not exist
-        output_folder = os.path.join(self.base_path, "data", "video")
+        output_folder = self.session.folder if self.session else os.path.join(self.base_path, "data", "video")
         try:
             os.makedirs(output_folder, exist_ok=True)
         except OSError as e:
             self.view.update_camera_state(f"Error: Cannot creating directory: {e}", color="red")
             return
+        # a triggered recording must start at once, the disk was tested when the trigger was armed
+        if preroll_start is None and not self._check_disk_bandwidth(output_folder, include_video=True, include_logs=self.is_serial_receiving,
+                                                              retry=self._start_recording, show_state=self.view.update_camera_state):
+            return
         self.is_recording = True
         self.recorders = {}
         timestamp = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
-        for cam_id, cap in self.caps.items():
+        if self.acquisition is not None:
+            self._start_process_recording(output_folder, timestamp)
+            return
+        from frame_fanout import FrameConsumer, get_record_options
+        from video_recorder import VideoRecorder
+        frame_buffer_bytes = self.memory_budget.get_frame_buffer_bytes(len(self.caps))
+        if self.trigger_engine is not None:
+            frame_buffer_bytes //= 2 # the other half belongs to the pre-trigger buffers
+        for cam_id, fanout in self.fanouts.items():
             filename = f"CAM{cam_id+1}_{timestamp}.avi"
             full_filepath = os.path.join(output_folder, filename)
-            width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-            height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            consumer_options, resolution, is_color = get_record_options(self.capture_sizes[cam_id], **self.recording_formats[cam_id])
+            record_consumer = FrameConsumer(None, **consumer_options) # every frame, in the camera's recording format
+            fanout.remove_consumer('pre-trigger') # no frame may reach the buffer while it is drained
             # create the VideoRecorder instance
-            recorder = VideoRecorder(full_filepath, (width, height), self.TARGET_FPS)
+            ring = self.frame_rings.get(cam_id)
+            preroll = None
+            if preroll_start is not None and ring:
+                preroll = [(np.ascontiguousarray(record_consumer.convert(frame)), frame_time) for frame, frame_time in ring.drain(preroll_start)]
+            recorder = VideoRecorder(full_filepath, resolution, self.TARGET_FPS, max_buffer_bytes=frame_buffer_bytes,
+                                     segment_duration=self.segment_duration, segment_max_bytes=self.segment_max_bytes,
+                                     preroll_frames=preroll, is_color=is_color)
             recorder.start()
+            record_consumer.callback = recorder.put_frame
+            fanout.set_consumer('record', record_consumer)
             self.recorders[cam_id] = recorder
+            self.memory_budget.register(f"CAM{cam_id+1} frames", recorder.get_footprint)
+            if self.session:
+                self.session.add_video(cam_id, recorder)
         # if no cameras are effectively opened, stop the recording and show an error
         if not self.recorders:
             self.is_recording = False
@@ -268,12 +551,52 @@ class AppController:
         self.view.set_camera_recording_state(True, self.is_previewing)
         self.view.record_receive_button.config(state="disabled")
 
+    def _start_process_recording(self, output_folder, timestamp):
+        """Record every camera of the acquisition process, which writes the files itself."""
+        filenames = {cam_id: os.path.join(output_folder, f"CAM{cam_id+1}_{timestamp}.avi") for cam_id in self.acquisition.frame_slots}
+        frame_buffer_bytes = self.memory_budget.get_frame_buffer_bytes(len(filenames))
+        try:
+            recording_ids = self.acquisition.start_recording(filenames, self.TARGET_FPS, frame_buffer_bytes,
+                                                             self.segment_duration, self.segment_max_bytes, self.recording_formats)
+        except (OSError, TimeoutError) as e:
+            print(f"warning: the acquisition process cannot start recording: {e}")
+            recording_ids = []
+        self.recorders = {cam_id: filenames[cam_id] for cam_id in recording_ids}
+        if not self.recorders:
+            self.is_recording = False
+            self.view.update_camera_state("Error: No active streams to record.", color="red")
+            return
+        self.view.set_camera_recording_state(True, self.is_previewing)
+        self.view.record_receive_button.config(state="disabled")
+
+    def set_recording_roi(self, cam_id, roi):
+        """Record only the region (x0, y0, x1, y1), in fractions of the frame, of a camera (None for all); takes effect at the next recording."""
+        """The camera activity brightness is measured over the same region, at once."""
+        self.recording_formats[cam_id]['roi'] = roi
+        if self.frame_activity is not None:
+            self.frame_activity.set_roi(cam_id, roi)
+
+    def set_recording_format(self, cam_id, grayscale, step):
+        """Record a camera in grayscale and/or keeping every step-th pixel; takes effect at the next recording."""
+        self.recording_formats[cam_id].update(grayscale=grayscale, step=step)
+
+    def set_video_segmentation(self, segment_duration=None, segment_max_bytes=None):
+        """Set how recordings are split into segments; takes effect at the next recording."""
+        self.segment_duration = segment_duration
+        self.segment_max_bytes = segment_max_bytes
+
     def _stop_recording(self):
         """Stop all active recorders and wait for them to finish writing files."""
         if not self.is_recording:
             return
-        for recorder in self.recorders.values():
+        if self.acquisition is not None:
+            self.acquisition.stop_recording()
+            self.recorders = {}
+        for cam_id, recorder in self.recorders.items():
+            if cam_id in self.fanouts:
+                self.fanouts[cam_id].remove_consumer('record')
             recorder.stop()
+            self.memory_budget.unregister(f"CAM{cam_id+1} frames")
         # clear the recorders and reset the state
         self.recorders = {}
         self.is_recording = False
@@ -299,11 +622,15 @@ class AppController:
 
     def _scan_and_update_serial_ports(self):
         """Scan for available serial ports in a background thread and update the UI."""
-        self.available_serial_ports = self.serial_manager.find_serial_ports()
-        ports = list(self.available_serial_ports)
+        shown_ports = self.available_serial_ports
+        available_serial_ports = self.serial_manager.find_serial_ports()
+        ports = list(available_serial_ports)
         # update the UI when the scan is complete
         def update_serial_ui():
-            self.view.update_serial_port_menu(ports)
+            if available_serial_ports != shown_ports or not ports:
+                self.available_serial_ports = available_serial_ports
+                self.view.update_serial_port_menu(ports)
+            self._save_device_cache()
             if ports:
                 self.view.update_serial_state("State: Serial ports refreshed.")
             else:
@@ -327,15 +654,64 @@ class AppController:
             selected_baudrate = int(self.view.serial_baudrate_var.get())
         except (ValueError, tk.TclError):
             selected_baudrate = 115200  # Fallback to a common default
+        # the additional ports checked in the Tools menu are acquired together with the selected one
+        ports = [selected_port] + [port for port in self.view.get_additional_serial_ports() if port != selected_port]
+        if self.acquisition is not None and len(ports) > 1:
+            print("warning: the acquisition process reads a single serial port, the additional ports are ignored")
+            ports = ports[:1]
         # Attempt to connect using the SerialManager.
-        if self.serial_manager.connect(selected_port, baudrate=selected_baudrate):
+        if self.serial_manager.connect(ports, baudrate=selected_baudrate):
             self.is_serial_connected = True
-            self.view.set_serial_connected_state(True, selected_port)
+            self.serial_ports = ports
+            self.view.set_serial_connected_state(True, ", ".join(ports))
             if not self.is_previewing:
                 self.view.record_receive_button.config(state="disabled")
         else:
             self.view.update_serial_state(f"Error: Failed to connect to {selected_port}", color="red")
 
+    def set_serial_capture(self, enabled):
+        """Choose whether receiving also tees the raw serial bytes into a capture file; takes effect at the next receive."""
+        if enabled and self.acquisition is not None:
+            print("warning: raw serial bytes are not captured while acquisition runs in its own process")
+        self.capture_serial = enabled
+
+    def open_serial_replay(self, is_fast=False):
+        """Ask for a serial capture and connect to it instead of the ports; each receive replays it from the start."""
+        if self.is_serial_connected or self.acquisition is not None:
+            print("warning: disconnect the serial port and acquire in the GUI process to replay a capture")
+            return
+        signal_folder = os.path.join(self.base_path, "data", "signal")
+        filename = filedialog.askopenfilename(parent=self.root, title="Replay Serial Capture",
+                                              initialdir=signal_folder if os.path.isdir(signal_folder) else self.base_path,
+                                              filetypes=[("Serial captures", "*.scap"), ("All files", "*.*")])
+        if not filename:
+            return
+        # as fast as possible feeds the parser and plot at full speed, e.g. to benchmark them on real data
+        if self.serial_devices.connect_replay(filename, speed=None if is_fast else 1.0):
+            self.is_serial_connected = True
+            self.serial_ports = [filename]
+            self.view.set_serial_connected_state(True, f"replay of {os.path.basename(filename)}")
+            if not self.is_previewing:
+                self.view.record_receive_button.config(state="disabled")
+        else:
+            self.view.update_serial_state(f"Error: Cannot replay {os.path.basename(filename)}", color="red")
+
+    def on_serial_connection_lost(self, port, error, is_connected):
+        """Called on the reader thread of a failed port; the GUI thread reports it."""
+        self.root.after(0, self._on_serial_connection_lost, port, is_connected)
+
+    def _on_serial_connection_lost(self, port, is_connected):
+        """Show a failed port; once none is left, stop receiving and disconnect."""
+        if is_connected:
+            self.view.update_serial_state(f"Error: {port} failed, the other ports go on.", color="red")
+            return
+        if self.is_record_receive:
+            self._stop_record_receive()
+        elif self.is_serial_receiving:
+            self._stop_serial_receive()
+        self._disconnect_serial()
+        self.view.update_serial_state(f"Error: {port} failed, disconnected.", color="red")
+
     def _disconnect_serial(self):
         """Disconnect the serial connection if it is active."""
         if not self.is_serial_connected:
@@ -443,30 +819,55 @@ class AppController:
         if not channels_to_receive:
             self.view.update_receive_data_state("No channel selected.", color="red")
             return
-        self.selected_channels_for_log = channels_to_receive
+        # each device has its own channels, the selection applies to all of them
+        self.selected_channels_for_log = channels_to_receive if self.acquisition is not None else self.serial_devices.get_channels(channels_to_receive)
         # 2. Create the output folder and file for logging.
-        output_folder = os.path.join(self.base_path, "data", "signal")
+        output_folder = self.session.folder if self.session else os.path.join(self.base_path, "data", "signal")
         try:
             os.makedirs(output_folder, exist_ok=True)
         except OSError as e:
             self.view.update_receive_data_state(f"Cannot creating directory.", color="red")
             return
-        timestamp = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
-        self.log_files = {}
-        try:
-            for ch in self.selected_channels_for_log:
-                filename = f"CH{ch}_{timestamp}.csv"
-                full_filepath = os.path.join(output_folder, filename)
-                file_handle = open(full_filepath, "w", newline='') # Use newline='' for proper CSV handling
-                self.log_files[ch] = file_handle
-                header = f"Time(s),CH{ch}_Data(V),Marker\n"
-                file_handle.write(header)
-            self.start_receiving_time = datetime.datetime.now()
-            self.last_receive_time = None
-        except IOError as e:
-            self.view.update_receive_data_state(f"Create log file failed.", color="red")
-            self._close_all_log_files()
+        is_video_expected = self.is_recording or (self.is_trigger_armed and self.is_previewing)
+        if not self._check_disk_bandwidth(output_folder, include_video=is_video_expected, include_logs=True,
+                                          retry=lambda: self.is_serial_receiving or self._start_serial_receive(),
+                                          show_state=self.view.update_receive_data_state):
             return
+        # the plot must exist before the stream starts: the first batch reaches it on the reader thread
+        self._ensure_plot_manager()
+        self.plot_manager.clear_plot()
+        self.signal_output_folder = output_folder
+        self.signal_loggers = {}
+        self.log_time_origin = 0.0
+        if self.acquisition is not None:
+            if not self._start_process_receive():
+                return
+        else:
+            if self.frame_activity is not None:
+                self.activity_channels = {ch: label for cam_id in self.fanouts for ch, label in self.frame_activity.get_channels(cam_id).items()}
+            try:
+                if not self.is_trigger_armed: # armed, the logs are opened by the trigger
+                    self.signal_loggers, self.raw_signal_loggers = self._open_log_files()
+                self.dsp_processors = {ch: ChannelProcessor(self._get_dsp_stages(ch))
+                                       for ch in self.selected_channels_for_log if self._get_dsp_stages(ch)}
+                self.start_receiving_time = datetime.datetime.now()
+                self.marker_queue.clear()
+                self.raw_marker_queue.clear()
+                time_origin = self.stream_time_origin = self.serial_devices.start_stream()
+                if self.capture_serial and self.serial_devices.replay is None:
+                    timestamp = self.start_receiving_time.strftime('%Y-%m-%d_%H-%M-%S')
+                    self.serial_devices.start_capture(os.path.join(output_folder, f"SERIAL_{timestamp}.scap"), time_origin)
+            except IOError as e:
+                self.view.update_receive_data_state(f"Create log file failed.", color="red")
+                self._close_all_log_files()
+                self.activity_channels = {}
+                return
+            self._arm_trigger_engine()
+            if self.session:
+                self.session.set_time_origin(time_origin)
+            if self.activity_channels:
+                self.frame_activity.start(time_origin)
+                self.root.after(self.ACTIVITY_POLL_MS, self._poll_camera_activity)
         # 3. Update UI and send "start" command to the hardware.
         self.is_serial_receiving = True
         self.view.serial_connect_button.config(state="disabled")
@@ -478,14 +879,71 @@ class AppController:
         for ch in self._get_selected_receive_channels():
             command = f"0{ch}00000000CC{command_char}\r\n"
             self.serial_manager.send_data(command)
-        self.plot_manager.clear_plot()  # Clear the plot before starting to receive data
-        self.view.update_receive_data_state("Receiving...")
+        for ch, label in self.activity_channels.items():
+            self.plot_manager.set_channel_label(ch, label)
+        if self.spectrum_panel:
+            self.spectrum_panel.reset()
+        self.view.update_receive_data_state("Armed, waiting for trigger..." if self.trigger_engine else "Receiving...")
         self.view.record_receive_button.config(state="disabled")
+        self._check_dsp_throughput()
+
+    def _start_process_receive(self):
+        """Start decoding and logging in the acquisition process and poll its decimated samples; returns True on success."""
+        log_settings = (self.log_compression, self.log_compression_level, self.log_chunk_duration)
+        try:
+            self.acquisition.start_receive(self.selected_channels_for_log, self.signal_output_folder, log_settings,
+                                           self.dsp_stage_specs, self.log_raw_signal)
+        except (OSError, TimeoutError) as e:
+            print(f"warning: the acquisition process cannot start logging: {e}")
+            self.view.update_receive_data_state(f"Create log file failed.", color="red")
+            return False
+        if self.is_trigger_armed:
+            print("warning: triggers are not evaluated while acquisition runs in its own process")
+        self.acquisition.read_samples() # skip what is left of an earlier receive
+        self.start_receiving_time = datetime.datetime.now()
+        self.root.after(self.SAMPLE_POLL_MS, self._poll_process_samples)
+        return True
+
+    def _poll_process_samples(self):
+        """Plot the decimated samples published by the acquisition process since the last poll."""
+        if self.acquisition is None or not self.is_serial_receiving:
+            return
+        samples = self.acquisition.read_samples()
+        for ch, (times, values) in samples.items():
+            self.plot_manager.add_data_points(ch, times, values)
+            if self.publisher:
+                self.publisher.publish_samples(ch, times, values)
+        if samples:
+            self._schedule_plot_update()
+        self.root.after(self.SAMPLE_POLL_MS, self._poll_process_samples)
+
+    def _poll_camera_activity(self):
+        """Plot, publish and log the camera activity measured since the last poll."""
+        if self.frame_activity is None or not self.is_serial_receiving:
+            return
+        times, channels, values = self.frame_activity.take()
+        for ch in self.activity_channels:
+            in_channel = channels == ch
+            ch_times, ch_values = times[in_channel], values[in_channel]
+            if not len(ch_times):
+                continue
+            self.plot_manager.add_data_points(ch, ch_times, ch_values)
+            if self.publisher:
+                self.publisher.publish_samples(ch, ch_times, ch_values)
+            logger = self.signal_loggers.get(ch)
+            if logger:
+                self._write_log_rows(logger, ch_times, ch_values)
+        self.root.after(self.ACTIVITY_POLL_MS, self._poll_camera_activity)
 
     def _stop_serial_receive(self):
         """Stop receiving data from the selected serial port."""
+        self.serial_devices.stop_stream() # the samples the merger still holds are logged before the files close
         self.is_serial_receiving = False
+        if self.frame_activity is not None:
+            self.frame_activity.stop()
         self._close_all_log_files()
+        self.activity_channels = {}
+        self._disarm_trigger_engine()
         # update the UI and send "stop" command to the hardware.
         if not self.is_led_on:
             self.view.serial_connect_button.config(state="normal")
@@ -498,6 +956,10 @@ class AppController:
             command = f"0{ch}00000000CC{command_char}\r\n"
             self.serial_manager.send_data(command)
         self.view.update_receive_data_state("Receiving stopped.")
+        self.serial_devices.stop_capture()
+        lost_frames, crc_errors = self.serial_devices.get_decoder_errors()
+        if lost_frames or crc_errors:
+            print(f"warning: {lost_frames} binary frames lost, {crc_errors} failed the CRC check")
         if self.is_previewing and not self.is_recording:
             self.view.record_receive_button.config(state="normal")
 
@@ -511,9 +973,33 @@ class AppController:
             self._start_record_receive()
 
     def _start_record_receive(self):
-        """Start camera recording and serial receiving at the same time."""
+        """Start camera recording and serial receiving at the same time, into a session directory with a manifest."""
+        timestamp = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+        session_folder = os.path.join(self.base_path, "data", "session", timestamp)
+        try:
+            os.makedirs(session_folder, exist_ok=True)
+            self.session = SessionManifest(session_folder)
+        except OSError as e:
+            print(f"warning: cannot create the session directory {session_folder}: {e}")
+        if self.session and self.acquisition is not None:
+            print("warning: the session seek index needs acquisition in the GUI process, only the files are listed")
+        if self.session:
+            if not self._check_disk_bandwidth(session_folder, include_video=True, include_logs=True,
+                                              retry=lambda: self.is_record_receive or not self.is_previewing or self._start_record_receive(),
+                                              show_state=self.view.update_camera_state):
+                self.session = None
+                try:
+                    os.rmdir(session_folder)
+                except OSError:
+                    pass
+                return
+            self.is_disk_checked = True # the combined bandwidth is tested, not each half again
         self._start_recording()
         self._start_serial_receive()
+        self.is_disk_checked = False
+        if self.session:
+            self.session.devices, self.session.settings = self._get_session_description()
+            self.session.write()
         self.view.record_receive_button.config(state="normal")
         self.view.record_receive_button.config(text="Stop Record & Receive")
         self.view.camera_record_button.config(state="disabled")
@@ -526,108 +1012,791 @@ class AppController:
         self.view.serial_receive_button.config(state="normal")
         self._stop_recording()
         self._stop_serial_receive()
+        if self.session:
+            self.session.write(is_complete=True)
+            print(f"The session is saved in {self.session.folder}")
+            self.session = None
         self.view.record_receive_button.config(state="normal")
         self.view.record_receive_button.config(text="Start Record & Receive")
         self.is_record_receive = False
 
-    def on_serial_data_received(self, data_bytes):
-        """Callback for processing raw bytes from serial, updating plot, and logging data."""
-        # 1. Prepare the buffer and check if receiving is active.
+    def _get_session_description(self):
+        """Return the (devices, settings) of the running session for its manifest."""
+        cameras = {}
+        for cam_id in sorted(self.recorders):
+            cameras[str(cam_id + 1)] = {
+                'name': self.view.get_camera_panel(cam_id).selected_camera_var.get(),
+                'capture_size': list(self.capture_sizes.get(cam_id, ())),
+                'recording_format': self.recording_formats[cam_id]
+            }
+        devices = {
+            'cameras': cameras,
+            'serial': {
+                'ports': self.serial_ports,
+                'baudrate': self.serial_devices.baudrate,
+                'protocols': [device.packet_decoder.protocol for device in self.serial_devices.devices]
+            },
+            'channels': list(self.selected_channels_for_log) + list(self.activity_channels)
+        }
+        settings = {
+            'fps': self.TARGET_FPS,
+            'segment_duration': self.segment_duration,
+            'segment_max_bytes': self.segment_max_bytes,
+            'log_compression': self.log_compression,
+            'log_chunk_duration': self.log_chunk_duration,
+            'dsp_stages': {str(ch): self._get_dsp_stages(ch) for ch in self.selected_channels_for_log},
+            'triggered': self.trigger_engine is not None,
+            'acquisition_process': self.acquisition is not None,
+            'serial_capture': self.capture_serial and self.acquisition is None
+        }
+        return devices, settings
+
+    def on_serial_samples_received(self, times, channels, values):
+        """Callback for the merged, time-ordered samples of all devices, updating plot, and logging data."""
+        # 1. Check if receiving is active.
         if not self.is_serial_receiving:
             return
-        current_time = datetime.datetime.now()
-        self.serial_data_buffer += data_bytes
-        all_points_from_batch = []
-        # 2. Process the serial data buffer to extract valid packets.
-        while True:
-            # find the start of a packet
-            start_pos, channel = -1, 0
-            h_pos = self.serial_data_buffer.find(b'H')
-            i_pos = self.serial_data_buffer.find(b'I')
-            if h_pos != -1 and (i_pos == -1 or h_pos < i_pos):
-                start_pos, channel = h_pos, 1
-            elif i_pos != -1:
-                start_pos, channel = i_pos, 2
-            if start_pos == -1:
-                break
-            next_h_pos = self.serial_data_buffer.find(b'H', start_pos + 1)
-            next_i_pos = self.serial_data_buffer.find(b'I', start_pos + 1)
-            # find the end of a packet
-            end_pos = -1
-            if next_h_pos != -1 and (next_i_pos == -1 or next_h_pos < next_i_pos):
-                end_pos = next_h_pos
-            elif next_i_pos != -1:
-                end_pos = next_i_pos
-            
-            if end_pos == -1:
-                break
-            # extract the packet payload
-            packet_payload_bytes = self.serial_data_buffer[start_pos + 1 : end_pos]
-            try:
-                packet_payload_str = packet_payload_bytes.decode('ascii')
-            except UnicodeDecodeError:
-                self.serial_data_buffer = self.serial_data_buffer[end_pos:]
-                continue
-            self.serial_data_buffer = self.serial_data_buffer[end_pos:]
-            parts = packet_payload_str.rstrip('-').split('-') # split by '-'
-            if not parts or (len(parts) == 1 and parts[0] == ''): # check if parts is empty
+        # 2. The devices decoded and time stamped the batch; markers go to the first channel's samples nearest them
+        marker_channel = self.selected_channels_for_log[0] if self.selected_channels_for_log else None
+        # 3. Filter each channel, then update the plot and log files.
+        trigger_engine = self.trigger_engine # may be dropped by the GUI thread meanwhile
+        plot_manager = self.plot_manager
+        for ch in self.selected_channels_for_log:
+            in_channel = channels == ch
+            ch_times, ch_values = times[in_channel], values[in_channel]
+            if not len(ch_times):
                 continue
-            if len(parts) % 2 != 0: # if parts length is odd, skip this packet
-                continue
-            # decode the hex values and calculate the processed value
-            for i in range(0, len(parts), 2):
-                hex_str = parts[i] + parts[i+1]
-                try:
-                    value_raw = int(hex_str, 16)
-                    value_processed = (value_raw - 32767) * 3.6 / 1024
-                    all_points_from_batch.append((channel, value_processed))
-                except (ValueError, IndexError):
-                    continue
-        if not all_points_from_batch:
-            return
-        # 3. Calculate the time step.
-        num_points = len(all_points_from_batch)
-        start_time = self.last_receive_time or self.start_receiving_time
-        time_diff = current_time - start_time
-        time_step = time_diff / num_points if num_points > 0 else datetime.timedelta(0)
-        # 4. Update the plot and log files.
-        apply_marker_to_first = self.marker_pending # if True, apply marker to the first point
-        if self.marker_pending:
-            self.marker_pending = False
-        for i, (ch, value) in enumerate(all_points_from_batch):
-            if ch not in self.selected_channels_for_log:
-                continue
-            interpolated_time = start_time + (i + 1) * time_step
-            relative_time = (interpolated_time - self.start_receiving_time).total_seconds()
-            self.plot_manager.add_data_point(ch, relative_time, value)
-            # write to the log file
-            log_file = self.log_files.get(ch)
-            if log_file:
-                marker = '1' if i == 0 and apply_marker_to_first else '0'
-                row = [f"{relative_time:.4f}", f"{value:.6f}", marker]
-                line_to_write = ",".join(row) + "\n"
-                log_file.write(line_to_write)
-        self.last_receive_time = current_time
-        self.root.after(100, self.plot_manager.update_plot) # update the plot after processing data
+            if self.is_spectrum_visible:
+                self.spectrum_panel.feed(ch, ch_times, ch_values) # unfiltered, so all LED modulation modes show
+            raw_logger = self.raw_signal_loggers.get(ch)
+            if raw_logger:
+                marked_rows = self.raw_marker_queue.take_rows(ch_times) if ch == marker_channel else ()
+                self._write_log_rows(raw_logger, ch_times, ch_values, marked_rows)
+            processor = self.dsp_processors.get(ch)
+            if processor:
+                with tracer.span("dsp"):
+                    ch_times, ch_values = processor.process(ch_times, ch_values)
+                if not len(ch_times):
+                    continue # the markers wait for the next filtered samples
+            if plot_manager is not None:
+                plot_manager.add_data_points(ch, ch_times, ch_values)
+            publisher = self.publisher
+            if publisher:
+                publisher.publish_samples(ch, ch_times, ch_values)
+            # the GUI thread hands over the logs of a trigger between two batches, never inside one
+            with self.trigger_log_lock:
+                trigger_event = self._process_trigger(trigger_engine, ch, ch_times, ch_values) if trigger_engine else None
+                # hand the whole batch to the logger at once, the disk write happens on its thread
+                logger = self.signal_loggers.get(ch)
+                if logger and trigger_event != 'start': # a starting trigger logs the block with the pre-trigger data
+                    # markers are only taken by a batch that is written, the others keep them for the log that gets it
+                    marked_rows = self.marker_queue.take_rows(ch_times) if ch == marker_channel else ()
+                    self._write_log_rows(logger, ch_times, ch_values, marked_rows)
+                if trigger_event == 'stop':
+                    self._stop_triggered_logging()
+        if plot_manager is not None:
+            self._schedule_plot_update() # update the plot after processing data
+
+    def _schedule_plot_update(self):
+        """Refresh the plot once after plot_interval_ms, however many batches arrive until then."""
+        if self.is_plot_update_scheduled:
+            return
+        self.is_plot_update_scheduled = True
+        self.root.after(self.plot_interval_ms, self._update_plot)
+
+    def _update_plot(self):
+        self.is_plot_update_scheduled = False
+        start = time.perf_counter()
+        self.plot_manager.update_plot()
+        self.plot_seconds += time.perf_counter() - start
+
+    def _open_log_files(self):
+        """Create and return the (signal loggers, raw loggers) of the selected channels, the raw ones for filtered channels."""
+        """Raises OSError, after closing the loggers already opened."""
+        signal_loggers, raw_signal_loggers = {}, {}
+        try:
+            self._create_loggers(signal_loggers, raw_signal_loggers)
+        except OSError:
+            self._close_loggers(signal_loggers, raw_signal_loggers)
+            raise
+        return signal_loggers, raw_signal_loggers
+
+    def _create_loggers(self, signal_loggers, raw_signal_loggers):
+        """Fill the given dicts with started loggers of every logged channel; raises OSError."""
+        timestamp = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+        num_raw_logs = sum(1 for ch in self.selected_channels_for_log if self._get_dsp_stages(ch)) if self.log_raw_signal else 0
+        max_pending_bytes = self.memory_budget.get_log_queue_cap(len(self.selected_channels_for_log) + num_raw_logs + len(self.activity_channels))
+        for ch in self.selected_channels_for_log:
+            filename = f"CH{ch}_{timestamp}.csv"
+            full_filepath = os.path.join(self.signal_output_folder, filename)
+            header = f"Time(s),CH{ch}_Data(V),Marker\n"
+            logger = SignalLogger(full_filepath, header, compression=self.log_compression, level=self.log_compression_level,
+                                  chunk_duration=self.log_chunk_duration, max_pending_bytes=max_pending_bytes)
+            logger.start()
+            signal_loggers[ch] = logger
+            self.memory_budget.register(f"CH{ch} log queue", logger.get_footprint)
+            if self.session:
+                self.session.add_log(ch, logger, self.log_time_origin)
+            if self._get_dsp_stages(ch) and self.log_raw_signal:
+                raw_logger = SignalLogger(os.path.join(self.signal_output_folder, f"CH{ch}_{timestamp}_raw.csv"), header,
+                                          compression=self.log_compression, level=self.log_compression_level,
+                                          chunk_duration=self.log_chunk_duration, max_pending_bytes=max_pending_bytes)
+                raw_logger.start()
+                raw_signal_loggers[ch] = raw_logger
+                self.memory_budget.register(f"CH{ch} raw log queue", raw_logger.get_footprint)
+        for ch, label in self.activity_channels.items():
+            filename = f"CH{ch}_{timestamp}.csv"
+            logger = SignalLogger(os.path.join(self.signal_output_folder, filename), f"Time(s),CH{ch}_Data({label}),Marker\n",
+                                  compression=self.log_compression, level=self.log_compression_level,
+                                  chunk_duration=self.log_chunk_duration, max_pending_bytes=max_pending_bytes)
+            logger.start()
+            signal_loggers[ch] = logger
+            self.memory_budget.register(f"CH{ch} log queue", logger.get_footprint)
+            if self.session:
+                self.session.add_log(ch, logger, self.log_time_origin)
+
+    def _write_log_rows(self, logger, times, values, marked_rows=()):
+        """Queue a channel's batch on a logger, with times relative to the start of the log and the given rows marked."""
+        times = times - self.log_time_origin
+        text, markers = format_log_rows(times, values, marked_rows)
+        logger.write_rows(times[0], times[-1], text, markers)
 
     def _close_all_log_files(self):
-        """Safely close all open log files."""
-        for file_handle in self.log_files.values():
-            if file_handle and not file_handle.closed:
-                file_handle.close()
-                print(f"The data is saved in {file_handle.name}")
-        self.log_files = {}
+        """Flush and close all signal loggers."""
+        if self.acquisition is not None:
+            try:
+                for line in self.acquisition.stop_receive():
+                    print(line)
+            except (OSError, TimeoutError) as e:
+                print(f"warning: the acquisition process cannot close the logs: {e}")
+        signal_loggers, raw_signal_loggers = self.signal_loggers, self.raw_signal_loggers
+        self.signal_loggers, self.raw_signal_loggers = {}, {}
+        self._close_loggers(signal_loggers, raw_signal_loggers)
+
+    def _close_loggers(self, signal_loggers, raw_signal_loggers):
+        """Flush and close the given loggers, waiting for their writer threads."""
+        for ch, logger in signal_loggers.items():
+            logger.close()
+            self.memory_budget.unregister(f"CH{ch} log queue")
+            if logger.is_chunked:
+                print(f"The data is saved in {len(logger.chunks)} chunks, indexed in {logger.get_index_filename()}")
+            else:
+                print(f"The data is saved in {logger.get_chunk_filename(0)}")
+        for ch, logger in raw_signal_loggers.items():
+            logger.close()
+            self.memory_budget.unregister(f"CH{ch} raw log queue")
+            print(f"The raw data is saved in {logger.get_index_filename() if logger.is_chunked else logger.get_chunk_filename(0)}")
+
+    def set_log_compression(self, compression=None, level=6):
+        """Set how signal logs are compressed; takes effect at the next receive."""
+        self.log_compression = compression
+        self.log_compression_level = level
+
+    def set_log_chunking(self, chunk_duration=None):
+        """Set the duration of each log chunk in seconds (None for a single file); takes effect at the next receive."""
+        self.log_chunk_duration = chunk_duration
+
+    # ============================================
+    # --------------- DSP Methods ----------------
+    # ============================================
+    def set_dsp_stages(self, channel, stage_specs):
+        """Set the (kind, parameter) DSP stages of a channel; takes effect at the next receive."""
+        self.dsp_stage_specs[channel] = list(stage_specs)
+
+    def _get_dsp_stages(self, channel):
+        """Return the DSP stages of a global channel; every device uses the stages of its local CH 1 and CH 2."""
+        return self.dsp_stage_specs.get((channel - 1) % SerialDevice.CHANNELS_PER_DEVICE + 1)
+
+    def set_log_raw_signal(self, enabled):
+        """Choose whether filtered channels also log their raw stream (as CH[ID]_[Timestamp]_raw.csv)."""
+        self.log_raw_signal = enabled
+
+    # ============================================
+    # -------------- Trigger Methods -------------
+    # ============================================
+    def set_trigger_settings(self, trigger_specs, pre_seconds, hold_seconds):
+        """Set the trigger conditions {channel: (kind, level, direction)} and timing; takes effect at the next receive."""
+        self.trigger_specs = dict(trigger_specs)
+        self.trigger_pre_seconds = pre_seconds
+        self.trigger_hold_seconds = hold_seconds
+
+    def set_trigger_armed(self, is_armed):
+        """Arm or disarm triggered recording; takes effect at the next receive."""
+        self.is_trigger_armed = is_armed
+
+    def _arm_trigger_engine(self):
+        """Create the trigger engine and the pre-trigger sample buffers when receiving starts armed."""
+        triggers = {ch: ChannelTrigger(kind, level, direction) for ch, (kind, level, direction) in self.trigger_specs.items()
+                    if ch in self.selected_channels_for_log}
+        if not self.is_trigger_armed or not triggers:
+            return
+        self.trigger_engine = TriggerEngine(triggers, hold_seconds=self.trigger_hold_seconds)
+        self.sample_rings = {ch: SampleRingBuffer(self.trigger_pre_seconds + self.TRIGGER_START_MARGIN) for ch in self.selected_channels_for_log}
+        for ch, ring in self.sample_rings.items():
+            self.memory_budget.register(f"CH{ch} pre-trigger", ring.get_footprint)
+
+    def _disarm_trigger_engine(self):
+        """Drop the trigger engine and its buffers, stopping a triggered recording."""
+        if self.trigger_engine is None:
+            return
+        self.trigger_engine = None
+        self.triggered_log_time = None
+        for fanout in self.fanouts.values():
+            fanout.remove_consumer('pre-trigger')
+        for ch in self.sample_rings:
+            self.memory_budget.unregister(f"CH{ch} pre-trigger")
+        for cam_id in self.frame_rings:
+            self.memory_budget.unregister(f"CAM{cam_id+1} pre-trigger")
+        self.sample_rings = {}
+        self.frame_rings = {}
+        self._stop_triggered_recording()
+
+    def _get_frame_ring(self, cam_id, frame):
+        """Return the pre-trigger frame buffer of a camera, sized from the memory budget on first use."""
+        ring = self.frame_rings.get(cam_id)
+        if ring is None:
+            ring_bytes = self.memory_budget.get_frame_buffer_bytes(len(self.caps)) // 2
+            max_frames = int(min((self.trigger_pre_seconds + self.TRIGGER_START_MARGIN) * self.TARGET_FPS, ring_bytes // frame.nbytes))
+            ring = self.frame_rings[cam_id] = FrameRingBuffer(max_frames)
+            self.memory_budget.register(f"CAM{cam_id+1} pre-trigger", ring.get_footprint)
+        return ring
+
+    def _process_trigger(self, trigger_engine, ch, times, values):
+        """Feed a channel's block to the trigger engine, opening the triggered logs on a start; returns 'start', 'stop' or None."""
+        ring = self.sample_rings.get(ch)
+        if ring and not self.signal_loggers:
+            ring.append(times, values)
+        event = trigger_engine.process(ch, times, values)
+        if event is None:
+            return None
+        kind, event_time = event
+        if kind == 'start':
+            self._start_triggered_logging(event_time)
+        return kind
+
+    def _start_triggered_logging(self, trigger_time):
+        """On the reader thread: have the GUI thread open the logs of a trigger event, so no file is opened on the receive path."""
+        """Until they are open the samples keep going to the pre-trigger buffers, and from there into the logs."""
+        self.triggered_log_time = trigger_time
+        print(f"Triggered at {trigger_time:.3f} s")
+        self.root.after(0, self._open_triggered_logs, trigger_time)
+
+    def _open_triggered_logs(self, trigger_time):
+        """Open the logs of a trigger event, write the samples buffered since the pre-trigger start and start the recording."""
+        if self.triggered_log_time != trigger_time: # the event ended, or the receive stopped, before the GUI got here
+            return
+        self.log_time_origin = trigger_time - self.trigger_pre_seconds
+        try:
+            signal_loggers, raw_signal_loggers = self._open_log_files()
+        except OSError as e:
+            print(f"warning: cannot create the triggered logs: {e}")
+            return
+        with self.trigger_log_lock:
+            is_current = self.triggered_log_time == trigger_time
+            if is_current:
+                # the markers set while waiting fall into the pre-trigger data, or before the log starts
+                self.marker_queue.discard_before(self.log_time_origin)
+                self.raw_marker_queue.discard_before(trigger_time)
+                marker_channel = self.selected_channels_for_log[0] if self.selected_channels_for_log else None
+                for ch, ring in self.sample_rings.items():
+                    times, values = ring.get_since(self.log_time_origin)
+                    if len(times) and ch in signal_loggers:
+                        marked_rows = self.marker_queue.take_rows(times) if ch == marker_channel else ()
+                        self._write_log_rows(signal_loggers[ch], times, values, marked_rows)
+                self.signal_loggers, self.raw_signal_loggers = signal_loggers, raw_signal_loggers
+        if not is_current:
+            self._close_loggers(signal_loggers, raw_signal_loggers)
+            return
+        self._start_triggered_recording(trigger_time)
+        self.view.update_receive_data_state("Triggered, logging...")
+
+    def _stop_triggered_logging(self):
+        """On the reader thread: detach the logs of a trigger event and have the GUI thread close them and stop its recording."""
+        """Closing waits for the writer threads to flush, which must not hold up the receive path."""
+        signal_loggers, raw_signal_loggers = self.signal_loggers, self.raw_signal_loggers
+        self.signal_loggers, self.raw_signal_loggers = {}, {}
+        self.triggered_log_time = None
+        self.root.after(0, self._close_triggered_logs, signal_loggers, raw_signal_loggers)
+
+    def _close_triggered_logs(self, signal_loggers, raw_signal_loggers):
+        """Close the logs of a finished trigger event and its recording, then wait for the next trigger."""
+        self._close_loggers(signal_loggers, raw_signal_loggers)
+        self._stop_triggered_recording()
+        if self.trigger_engine is not None:
+            self.view.update_receive_data_state("Armed, waiting for trigger...")
+
+    def _start_triggered_recording(self, trigger_time):
+        """Start recording with the frames from the pre-trigger time before trigger_time on, unless a recording is already running."""
+        if not self.is_previewing or self.is_recording or self.trigger_engine is None:
+            return
+        # the same start as the triggered logs, however long the GUI took to get here
+        self._start_recording(preroll_start=self.stream_time_origin + trigger_time - self.trigger_pre_seconds)
+        self.is_trigger_recording = self.is_recording
+
+    def _stop_triggered_recording(self):
+        """Stop the recording started by a trigger."""
+        if self.is_trigger_recording:
+            self.is_trigger_recording = False
+            self._stop_recording()
+
+    # ============================================
+    # --------- Acquisition Process Methods ------
+    # ============================================
+    def set_acquisition_process(self, enabled):
+        """Run the cameras, serial port and writers in their own process (or back in this one); only while all are idle."""
+        if enabled == (self.acquisition is not None):
+            return
+        if self.is_previewing or self.is_serial_connected:
+            print("warning: stop the preview and disconnect the serial port before moving acquisition")
+            self.view.acquisition_process_var.set(not enabled)
+            return
+        if enabled:
+            from acquisition_process import AcquisitionClient
+            # the trigger, spectrum and camera activity work on the samples and frames of this process, which it no longer has
+            if self.is_spectrum_visible:
+                self.set_spectrum_visible(False)
+                self.view.spectrum_var.set(False)
+            self.set_trigger_armed(False)
+            self.view.trigger_armed_var.set(False)
+            if self.frame_activity is not None:
+                self.set_camera_activity(False)
+                self.view.camera_activity_var.set(False)
+            self._close_camera_pool() # the acquisition process opens the cameras itself
+            self.acquisition = AcquisitionClient()
+            self.serial_manager = self.acquisition # the LED and receive commands go to the process unchanged
+            self.memory_budget.register("acquisition process", self.acquisition.get_footprint)
+            self.view.update_receive_data_state("Separate process: no trigger, spectrum or camera activity.", color="gray")
+        else:
+            self.memory_budget.unregister("acquisition process")
+            self.acquisition.close()
+            self.acquisition = None
+            self.serial_manager = self.serial_devices
+            self.view.update_receive_data_state("")
+        self.view.set_acquisition_process_state(enabled)
+
+    # ============================================
+    # ----------- Live Publishing Methods --------
+    # ============================================
+    def set_camera_activity(self, enabled):
+        """Measure each camera's frame difference and region brightness as extra channels; takes effect at the next receive."""
+        if enabled == (self.frame_activity is not None):
+            return
+        if enabled:
+            if self.acquisition is not None:
+                print("warning: camera activity is not measured while acquisition runs in its own process")
+            from frame_metrics import FrameActivity
+            activity = self.frame_activity = FrameActivity()
+            for cam_id in range(2):
+                activity.set_roi(cam_id, self.recording_formats[cam_id]['roi'])
+                self.set_analysis_consumer(cam_id, f"activity CAM{cam_id+1}",
+                                           lambda frame, timestamp, c=cam_id: activity.feed(c, frame, timestamp),
+                                           max_fps=self.ACTIVITY_FPS, width=self.ACTIVITY_WIDTH)
+        else:
+            for cam_id in range(2):
+                self.remove_analysis_consumer(f"activity CAM{cam_id+1}")
+            self.frame_activity.close()
+            self.frame_activity = None
+
+    def set_live_publishing(self, enabled):
+        """Start or stop broadcasting the live samples, markers and preview frames to local subscribers."""
+        if enabled == (self.publisher is not None):
+            return
+        if enabled:
+            publisher = LivePublisher(self.PUBLISH_ADDRESS)
+            try:
+                publisher.start()
+            except OSError as e:
+                print(f"warning: cannot publish on {self.PUBLISH_ADDRESS}: {e}")
+                self.view.live_publishing_var.set(False)
+                return
+            self.publisher = publisher
+            for cam_id in range(2):
+                self.set_analysis_consumer(cam_id, f"publish CAM{cam_id+1}",
+                                           lambda frame, timestamp, c=cam_id: self._publish_frame(c, frame, timestamp),
+                                           max_fps=self.PUBLISH_FRAME_FPS, width=self.PUBLISH_FRAME_WIDTH, grayscale=False)
+            self.memory_budget.register("publish queues", publisher.get_footprint)
+            print(f"Publishing live data on {self.PUBLISH_ADDRESS[0]}:{self.PUBLISH_ADDRESS[1]}")
+        else:
+            for cam_id in range(2):
+                self.remove_analysis_consumer(f"publish CAM{cam_id+1}")
+            self.memory_budget.unregister("publish queues")
+            self.publisher.stop()
+            self.publisher = None
+
+    def _publish_frame(self, cam_id, frame, timestamp):
+        """JPEG encode a preview thumbnail on the capture thread, only while someone subscribes."""
+        """It is stamped on the samples' clock while receiving, so subscribers can line it up with the signal; NaN otherwise."""
+        publisher = self.publisher
+        if publisher is None or not publisher.has_subscribers():
+            return
+        time_origin = self.stream_time_origin
+        frame_time = timestamp - time_origin if self.is_serial_receiving and time_origin is not None else float('nan')
+        import cv2
+        is_encoded, jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.PUBLISH_JPEG_QUALITY])
+        if is_encoded:
+            publisher.publish_frame(cam_id, frame_time, jpeg.tobytes())
+
+    def set_spectrum_visible(self, is_visible):
+        """Show or hide the live spectrum panel; it only analyzes data while shown."""
+        if is_visible and self.spectrum_panel is None:
+            from spectrum_view import SpectrumPanel
+            self.spectrum_panel = SpectrumPanel(self.view.spectrum_frame, self.root)
+        self.view.set_spectrum_visible(is_visible)
+        if is_visible:
+            self.spectrum_panel.reset()
+            self.spectrum_panel.start()
+        elif self.spectrum_panel:
+            self.spectrum_panel.stop()
+        self.is_spectrum_visible = is_visible
+
+    def _check_dsp_throughput(self):
+        """Warn if the DSP stages of the receiving channels cannot keep up with the link's maximum sample rate."""
+        """Each filter configuration is measured once, on a worker thread; a repeated one is checked from the cache."""
+        if not self.dsp_processors or not self.serial_devices.is_connected:
+            return
+        required_rate = get_max_sample_rate(self.serial_devices.baudrate, self.serial_devices.get_bytes_per_sample())
+        channel_keys = {ch: (tuple(processor.stage_specs), required_rate) for ch, processor in self.dsp_processors.items()}
+        missing = set(channel_keys.values()) - set(self.dsp_throughputs)
+        if not missing:
+            self._report_dsp_throughput(channel_keys)
+            return
+        def measure():
+            # measured at the worst case: every sample of the link on this channel, in small batches
+            throughputs = {key: measure_throughput(list(key[0]), key[1], num_samples=20000) for key in missing}
+            self.root.after(0, self._on_dsp_throughput_measured, throughputs, channel_keys)
+        threading.Thread(target=measure, daemon=True).start()
+
+    def _on_dsp_throughput_measured(self, throughputs, channel_keys):
+        self.dsp_throughputs.update(throughputs)
+        if self.is_serial_receiving:
+            self._report_dsp_throughput(channel_keys)
+
+    def _report_dsp_throughput(self, channel_keys):
+        for ch, key in channel_keys.items():
+            throughput, required_rate = self.dsp_throughputs[key], key[1]
+            if throughput < self.DSP_THROUGHPUT_MARGIN * required_rate:
+                print(f"warning: CH{ch} filters process {throughput:.0f} samples/s, the link can deliver {required_rate:.0f}")
+                self.view.update_receive_data_state(f"CH{ch} filters may fall behind.", color="red")
+
+    # ============================================
+    # -------------- Disk Preflight --------------
+    # ============================================
+    def set_slow_disk_refusal(self, enabled):
+        """Choose whether a disk too slow for the estimated bandwidth refuses the start, or is only warned about."""
+        self.refuse_slow_disk = enabled
+
+    def _check_disk_bandwidth(self, folder, include_video=False, include_logs=False, retry=None, show_state=None):
+        """Estimate the write bandwidth of the videos and logs about to start in folder and compare it with what the disk sustains."""
+        """Returns True to start now; False if the disk is too slow, or while it is being tested on a worker thread, after which
+        retry() is called on the GUI thread. A disk only just fast enough, or filling up soon, is warned about."""
+        if self.is_disk_checked:
+            return True
+        required = 0.0
+        if include_video:
+            from frame_fanout import get_record_options
+            cam_ids = self.acquisition.frame_slots if self.acquisition is not None else self.fanouts
+            for cam_id in cam_ids:
+                _, resolution, is_color = get_record_options(self.capture_sizes[cam_id], **self.recording_formats[cam_id])
+                required += estimate_video_bandwidth(resolution, self.TARGET_FPS, is_color)
+        if include_logs:
+            required += self._estimate_log_bandwidth()
+        if required <= 0:
+            return True
+        throughput = get_cached_throughput(folder)
+        if throughput is None:
+            if is_on_same_disk(folder, self._get_active_output_folders()):
+                # the test would slow the recording or logs already writing there, and measure what they leave over
+                print("warning: the disk is not tested while other files are written to it")
+                return True
+            if self.disk_probe_thread is None:
+                self.disk_probe_thread = threading.Thread(target=self._run_disk_probe, args=(folder,), daemon=True)
+                self.disk_probe_thread.start()
+            self.disk_probe_retry = retry
+            if show_state:
+                show_state("Testing the disk speed...")
+            return False
+        verdict, message = check_disk(folder, required, throughput, self.refuse_slow_disk)
+        if verdict != 'ok':
+            print(f"warning: {message}")
+        if verdict == 'refuse' and show_state:
+            show_state("Error: The disk is too slow to write to.", color="red")
+        return verdict != 'refuse'
+
+    def _run_disk_probe(self, folder):
+        """Worker thread: measure the disk of folder, then retry the waiting start on the GUI thread."""
+        is_measured = True
+        with tracer.span("disk preflight"):
+            try:
+                measure_write_throughput(folder)
+            except OSError as e:
+                print(f"warning: cannot test the disk of {folder}: {e}")
+                is_measured = False
+        self.root.after(0, self._on_disk_probe_done, is_measured)
+
+    def _on_disk_probe_done(self, is_measured):
+        self.disk_probe_thread = None
+        retry, self.disk_probe_retry = self.disk_probe_retry, None
+        if retry is None:
+            return
+        # a disk that cannot be tested is not refused, the warning is printed
+        self.is_disk_checked = not is_measured
+        try:
+            retry()
+        finally:
+            self.is_disk_checked = False
+
+    def _get_active_output_folders(self):
+        """Return the folders the running recordings and logs write to."""
+        folders = []
+        if self.is_recording:
+            folders += [os.path.dirname(recorder if isinstance(recorder, str) else recorder.filename) for recorder in self.recorders.values()]
+        if self.is_serial_receiving and self.signal_output_folder:
+            folders.append(self.signal_output_folder)
+        return folders
+
+    def _estimate_log_bandwidth(self):
+        """Return the estimated bytes per second of the logs (and serial capture) of a receive at the link's maximum sample rate."""
+        baudrate = self.serial_devices.baudrate if self.acquisition is None else None
+        if baudrate is None:
+            try:
+                baudrate = int(self.view.serial_baudrate_var.get())
+            except (ValueError, tk.TclError):
+                return 0.0
+        num_devices = max(1, len(self.serial_ports))
+        if self.acquisition is None:
+            rows_per_second = get_max_sample_rate(baudrate, self.serial_devices.get_bytes_per_sample()) * num_devices
+        else:
+            rows_per_second = get_max_sample_rate(baudrate) * num_devices
+        # the raw logs of the filtered channels take their share of the samples again
+        channels = self._get_selected_receive_channels()
+        if self.log_raw_signal and channels:
+            rows_per_second *= 1 + sum(1 for ch in channels if self._get_dsp_stages(ch)) / len(channels)
+        if self.frame_activity is not None:
+            rows_per_second += self.ACTIVITY_FPS * sum(len(self.frame_activity.get_channels(cam_id)) for cam_id in self.fanouts)
+        required = estimate_log_bandwidth(rows_per_second, self.log_compression)
+        if self.capture_serial and self.acquisition is None and self.serial_devices.replay is None:
+            required += baudrate / BITS_PER_BYTE * num_devices
+        return required
             
     def add_marker(self):
-        """Set a flag to add a marker to the next logged data point."""
-        if not self.is_serial_receiving:
+        """Mark the current time on the plot and in the log, at the logged sample nearest it."""
+        if not self.is_serial_receiving or not self.start_receiving_time:
             return
-        # set the flag for write to the file
-        self.marker_pending = True
-        # use plotmanager to add a marker to the plot
-        if self.start_receiving_time:
+        if self.acquisition is not None:
+            self.acquisition.add_marker()
             current_relative_time = (datetime.datetime.now() - self.start_receiving_time).total_seconds()
-            self.plot_manager.add_marker(current_relative_time)
+        else:
+            # on the samples' clock, so the plotted and the logged marker are the same instant
+            current_relative_time = time.perf_counter() - self.stream_time_origin
+            self.marker_queue.add(current_relative_time)
+            self.raw_marker_queue.add(current_relative_time)
+        self.plot_manager.add_marker(current_relative_time)
+        if self.publisher:
+            self.publisher.publish_marker(current_relative_time)
+
+    # ============================================
+    # ------------- Review Methods ---------------
+    # ============================================
+    def open_session_viewer(self):
+        """Ask for a recorded signal log and open it (with its sibling channels) in a review window."""
+        initial_folder = os.path.join(self.base_path, "data", "signal")
+        filename = filedialog.askopenfilename(parent=self.root, title="Open Signal Log",
+                                              initialdir=initial_folder if os.path.isdir(initial_folder) else self.base_path,
+                                              filetypes=[("Signal logs", "CH*.csv CH*.csv.gz CH*.csv.zlib CH*.csv.xz CH*.index.json"), ("All files", "*.*")])
+        if not filename:
+            return
+        from session_viewer import SessionViewer
+        try:
+            SessionViewer(self.root, filename)
+        except (OSError, ValueError) as e:
+            print(f"warning: cannot open {filename}: {e}")
+
+    def open_session_playback(self):
+        """Ask for any file of a recorded session and play its videos and signals back together."""
+        video_folder = os.path.join(self.base_path, "data", "video")
+        signal_folder = os.path.join(self.base_path, "data", "signal")
+        filename = filedialog.askopenfilename(parent=self.root, title="Open Session",
+                                              initialdir=video_folder if os.path.isdir(video_folder) else self.base_path,
+                                              filetypes=[("Session files", f"{SESSION_FILENAME} CAM*.avi CH*.csv CH*.csv.gz CH*.csv.zlib CH*.csv.xz"), ("All files", "*.*")])
+        if not filename:
+            return
+        from session_playback import SessionPlayback, find_session_files, get_video_offsets
+        video_offsets = {}
+        manifest_filename = os.path.join(os.path.dirname(filename), SESSION_FILENAME)
+        if os.path.exists(manifest_filename):
+            # a session directory: the manifest lists the files and anchors the videos to the signal timeline
+            try:
+                session_index = SessionIndex(manifest_filename)
+                videos, logs, video_offsets = session_index.get_videos(), session_index.get_logs(), session_index.get_video_offsets()
+            except (OSError, ValueError, KeyError) as e:
+                print(f"warning: cannot read the session manifest {manifest_filename}: {e}")
+                return
+        else:
+            videos, logs = find_session_files(filename, video_folder, signal_folder)
+            video_offsets = get_video_offsets(videos, logs)
+        if not videos and not logs:
+            print(f"warning: no session files found for {filename}")
+            return
+        try:
+            SessionPlayback(self.root, videos, logs, video_offsets)
+        except (OSError, ValueError) as e:
+            print(f"warning: cannot play back the session of {filename}: {e}")
+
+    def start_batch_export(self):
+        """Export all recorded sessions to data/export on a process pool, in the background."""
+        if self.batch_export is not None:
+            print("warning: a batch export is already running")
+            return
+        from batch_export import BatchExport, format_result
+        def report_progress(done, total, result):
+            print(f"[{done}/{total}] {format_result(result)}")
+            self.root.after(0, lambda: self.view.update_export_state(f"Export: {done}/{total} files"))
+        self.batch_export = BatchExport(self.base_path, progress=report_progress)
+        threading.Thread(target=self._run_batch_export, daemon=True).start()
+        self.view.update_export_state("Export: scanning...")
+
+    def _run_batch_export(self):
+        """Run the batch export on a background thread and report the total throughput."""
+        start = time.perf_counter()
+        try:
+            results = self.batch_export.run()
+        except Exception as e: # whatever stops the run, the status must not be left at its last progress
+            print(f"warning: the batch export failed: {type(e).__name__}: {e}")
+            self.root.after(0, lambda: self.view.update_export_state("Export failed.", color="red"))
+            return
+        finally:
+            self.batch_export = None
+        seconds = time.perf_counter() - start
+        megabytes = sum(result['input_bytes'] for result in results) / 1e6
+        num_failed = sum('error' in result for result in results)
+        if num_failed:
+            print(f"warning: {num_failed} of {len(results)} files failed to export")
+        print(f"Exported {len(results)} files ({megabytes:.1f} MB) in {seconds:.1f} s to {os.path.join(self.base_path, 'data', 'export')}")
+        self.root.after(0, lambda: self.view.update_export_state(f"Export: {len(results) - num_failed} files in {seconds:.1f} s" +
+                                                                 (f", {num_failed} failed" if num_failed else ""),
+                                                                 color="red" if num_failed else "black"))
+
+    # ============================================
+    # ------------ Diagnostics Methods -----------
+    # ============================================
+    def _get_profile_folder(self):
+        """Create (if needed) and return the folder for trace and profile outputs."""
+        output_folder = os.path.join(self.base_path, "data", "profile")
+        os.makedirs(output_folder, exist_ok=True)
+        return output_folder
+
+    def toggle_tracing(self):
+        """Start recording hot-path spans, or stop and export them as a Chrome trace file."""
+        if not tracer.is_tracing:
+            tracer.start_tracing()
+            self.view.set_tracing_state(True)
+            return
+        tracer.stop_tracing()
+        self.view.set_tracing_state(False)
+        timestamp = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+        try:
+            full_filepath = os.path.join(self._get_profile_folder(), f"TRACE_{timestamp}.json")
+            num_spans = tracer.export_trace(full_filepath)
+        except OSError as e:
+            print(f"warning: cannot export the trace: {e}")
+            return
+        print(f"The trace ({num_spans} spans) is saved in {full_filepath}")
+
+    def start_profile_window(self):
+        """Run cProfile on the GUI, serial and recorder threads for a fixed window."""
+        if self.is_profiling:
+            return
+        self.is_profiling = True
+        self.view.set_profiling_state(True)
+        tracer.start_profile_window(self.PROFILE_WINDOW_SECONDS)
+        # leave a short grace period so worker threads can retire their own profilers
+        self.root.after(int(self.PROFILE_WINDOW_SECONDS * 1000) + 500, self._finish_profile_window)
+
+    def _finish_profile_window(self):
+        """Dump the merged cProfile statistics of the finished window."""
+        self.is_profiling = False
+        self.view.set_profiling_state(False)
+        timestamp = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+        try:
+            full_filepath = os.path.join(self._get_profile_folder(), f"PROFILE_{timestamp}.prof")
+            if tracer.finish_profile_window(full_filepath):
+                print(f"The profile is saved in {full_filepath}")
+        except OSError as e:
+            print(f"warning: cannot save the profile: {e}")
+
+    def set_memory_budget(self, budget_mb):
+        """Apply a new global memory budget; recorders pick it up at the next recording."""
+        self.memory_budget.total_bytes = budget_mb * 1024 * 1024
+        self.serial_devices.set_max_buffer_bytes(self.memory_budget.get_parser_buffer_cap())
+        if self.plot_manager is not None:
+            self.plot_manager.set_max_points(self.memory_budget.get_plot_sample_cap(2))
+
+    def _update_memory_report(self):
+        """Periodically show the footprint of every bounded component."""
+        report = self.memory_budget.format_report()
+        if self.load_governor is not None:
+            report = f"{report} | {self.load_governor.format_state()}"
+        self.view.update_memory_state(report)
+        self.root.after(self.MEMORY_REPORT_INTERVAL_MS, self._update_memory_report)
+
+    # ============================================
+    # ------------- Load Shedding ----------------
+    # ============================================
+    def set_load_shedding(self, enabled):
+        """Let the load governor shed preview, plot and analysis work while the application falls behind."""
+        if enabled == (self.load_governor is not None):
+            return
+        if not enabled:
+            self.load_governor.restore_all()
+            self.load_governor = None
+            return
+        governor = self.load_governor = LoadGovernor()
+        # the shedding order, cheapest to lose first; recorders and loggers are never slowed
+        governor.add_step("preview at half rate", lambda: self._set_preview_fps_scale(0.5), lambda: self._set_preview_fps_scale(1.0))
+        governor.add_step("preview at half size", lambda: setattr(self, 'preview_size_scale', 0.5),
+                          lambda: setattr(self, 'preview_size_scale', 1.0))
+        governor.add_step("plot refreshed every 0.5 s", lambda: setattr(self, 'plot_interval_ms', 5 * self.PLOT_INTERVAL_MS),
+                          lambda: setattr(self, 'plot_interval_ms', self.PLOT_INTERVAL_MS))
+        governor.add_step("plot drawn from every 4th sample", lambda: self._set_plot_decimation(4), lambda: self._set_plot_decimation(1))
+        governor.add_step("analysis consumers at half rate", lambda: self._set_analysis_fps_scale(0.5), lambda: self._set_analysis_fps_scale(1.0))
+        governor.register_probe("GUI lag", lambda: self.gui_lag / self.GUI_LAG_LIMIT)
+        governor.register_probe("plot", self._get_plot_load)
+        governor.register_probe("recorder queue", lambda: max((recorder.get_queue_fill() for recorder in list(self.recorders.values())), default=0.0)
+                                / self.RECORDER_QUEUE_LIMIT)
+        governor.register_probe("log backlog", lambda: sum(logger.get_footprint() for logger in list(self.signal_loggers.values()) + list(self.raw_signal_loggers.values()))
+                                / self.LOG_BACKLOG_LIMIT)
+        self.load_check_time = time.perf_counter()
+        self.root.after(self.LOAD_CHECK_INTERVAL_MS, self._check_load, governor)
+
+    def _check_load(self, governor):
+        """Measure how late this callback runs, as the GUI lag, and let the governor adjust."""
+        if governor is not self.load_governor:
+            return # turned off, or off and on again
+        now = time.perf_counter()
+        self.gui_lag = max(0.0, now - self.load_check_time - self.LOAD_CHECK_INTERVAL_MS / 1000)
+        governor.check()
+        self.load_check_time = time.perf_counter()
+        self.root.after(self.LOAD_CHECK_INTERVAL_MS, self._check_load, governor)
+
+    def _get_plot_load(self):
+        """Return the share of the GUI thread spent updating the plot since the last check, over its limit."""
+        plot_seconds, self.plot_seconds = self.plot_seconds, 0.0
+        return plot_seconds / (self.LOAD_CHECK_INTERVAL_MS / 1000) / self.PLOT_CPU_LIMIT
+
+    def _set_preview_fps_scale(self, scale):
+        self.preview_fps_scale = scale
+        for consumer in self.preview_consumers.values():
+            consumer.set_max_fps(self.PREVIEW_FPS * scale)
+
+    def _set_plot_decimation(self, step):
+        self.plot_decimation = step
+        if self.plot_manager is not None:
+            self.plot_manager.set_decimation(step)
+
+    def _set_analysis_fps_scale(self, scale):
+        self.analysis_fps_scale = scale
+        for name, (_, consumer) in self.analysis_consumers.items():
+            consumer.set_max_fps(self.analysis_max_fps[name] * scale)
 
     # ============================================
     # -------- General Application Method --------
@@ -640,4 +1809,13 @@ class AppController:
             self.serial_manager.disconnect()
         if self.is_serial_receiving:
             self._close_all_log_files()
+        if self.acquisition is not None:
+            self.acquisition.close()
+        if self.publisher is not None:
+            self.publisher.stop()
+        if self.frame_activity is not None:
+            self.frame_activity.close()
+        if self.batch_export is not None:
+            self.batch_export.cancel()
+        self._close_camera_pool()
         self.root.destroy()
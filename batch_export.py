@@ -0,0 +1,290 @@
+import multiprocessing
+import os
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import cv2
+import numpy as np
+
+from session_manifest import SESSION_FILENAME, SessionIndex
+from session_playback import find_session_files, get_video_offsets
+from session_viewer import parse_log_header, parse_log_rows
+from signal_logger import get_log_key, open_log_chunk
+
+
+READ_CHUNK_BYTES = 4 * 1024 * 1024
+NPY_HEADER_BYTES = 128 # fixed, so the row count can be filled in after streaming
+SUMMARY_SECONDS = 1.0 # bucket of the decimated summary
+CLIP_SECONDS = 5.0 # video kept before and after every marker
+
+
+# ============================================
+# --------------- Session Discovery ----------
+# ============================================
+def find_sessions(base_path):
+    """Return [{'name', 'logs': {channel: [chunks]}, 'videos': {camera: [segments]}, 'video_offsets': {camera: time}}] of all recorded sessions."""
+    sessions = []
+    session_root = os.path.join(base_path, "data", "session")
+    if os.path.isdir(session_root):
+        for name in sorted(os.listdir(session_root)):
+            manifest_filename = os.path.join(session_root, name, SESSION_FILENAME)
+            try:
+                session_index = SessionIndex(manifest_filename)
+            except (OSError, ValueError, KeyError):
+                continue
+            sessions.append({'name': name, 'logs': session_index.get_logs(), 'videos': session_index.get_videos(),
+                             'video_offsets': session_index.get_video_offsets()})
+    # the flat folders: a session per log timestamp, with the videos recorded at (about) the same time
+    video_folder = os.path.join(base_path, "data", "video")
+    signal_folder = os.path.join(base_path, "data", "signal")
+    seen = set()
+    for name in sorted(os.listdir(signal_folder)) if os.path.isdir(signal_folder) else []:
+        key = get_log_key(name)
+        if key is None or key[1] in seen or key[1].endswith("_raw"):
+            continue
+        seen.add(key[1])
+        videos, logs = find_session_files(os.path.join(signal_folder, name), video_folder, signal_folder)
+        logs = {ch: chunks for ch, chunks in logs.items() if not any(chunk.endswith(("_raw.csv", "_raw.csv.gz", "_raw.csv.zlib", "_raw.csv.xz")) for chunk in chunks)}
+        sessions.append({'name': key[1], 'logs': logs, 'videos': videos, 'video_offsets': get_video_offsets(videos, logs)})
+    return sessions
+
+
+# ============================================
+# ---------------- Worker Tasks --------------
+# ============================================
+def _npy_header(num_rows, num_columns):
+    """Return a version 1.0 .npy header of a float64 (num_rows, num_columns) array, always NPY_HEADER_BYTES long."""
+    header = f"{{'descr': '<f8', 'fortran_order': False, 'shape': ({num_rows}, {num_columns}), }}"
+    return b'\x93NUMPY\x01\x00' + struct.pack('<H', NPY_HEADER_BYTES - 10) + header.ljust(NPY_HEADER_BYTES - 11).encode('latin1') + b'\n'
+
+
+def _read_log_blocks(chunks):
+    """Yield the (time, value, marker) rows of a log's chunks as float arrays, a read chunk at a time."""
+    for filename in chunks:
+        with open_log_chunk(filename) as f:
+            header_line = f.readline().decode('ascii', errors='replace')
+            time_col, value_col, marker_col = parse_log_header(header_line)
+            num_columns = len(header_line.strip().split(','))
+            pending = b''
+            while True:
+                chunk = f.read(READ_CHUNK_BYTES)
+                data = pending + chunk
+                # only parse complete lines, the rest is kept for the next read
+                end = data.rfind(b'\n') + 1 if chunk else len(data)
+                block, pending = data[:end], data[end:]
+                if block:
+                    rows = parse_log_rows(block, num_columns)
+                    markers = rows[:, marker_col] if marker_col is not None else np.zeros(len(rows))
+                    yield np.column_stack((rows[:, time_col], rows[:, value_col], markers))
+                if not chunk:
+                    break
+
+
+def export_log(channel, chunks, output_folder, session_name):
+    """Stream a signal log into CH[ID]_[session].npy (time, value, marker rows) and a per-second min/max/mean summary .npz."""
+    start = time.perf_counter()
+    npy_filename = os.path.join(output_folder, f"CH{channel}_{session_name}.npy")
+    summary_filename = os.path.join(output_folder, f"CH{channel}_{session_name}_summary.npz")
+    num_rows = 0
+    marker_times = []
+    # per-bucket partial results, merged where a bucket spans two blocks
+    buckets, mins, maxs, sums, counts = [], [], [], [], []
+    with open(npy_filename, "wb") as f:
+        f.write(_npy_header(0, 3))
+        for rows in _read_log_blocks(chunks):
+            if not len(rows):
+                continue
+            f.write(rows.astype('<f8').tobytes())
+            num_rows += len(rows)
+            marker_times.append(rows[rows[:, 2] != 0, 0])
+            bucket_of_row = np.floor(rows[:, 0] / SUMMARY_SECONDS).astype(np.int64)
+            starts = np.concatenate(([0], np.flatnonzero(np.diff(bucket_of_row)) + 1))
+            buckets.append(bucket_of_row[starts])
+            mins.append(np.minimum.reduceat(rows[:, 1], starts))
+            maxs.append(np.maximum.reduceat(rows[:, 1], starts))
+            sums.append(np.add.reduceat(rows[:, 1], starts))
+            counts.append(np.diff(np.append(starts, len(rows))))
+        f.seek(0)
+        f.write(_npy_header(num_rows, 3))
+    if buckets:
+        bucket, low, high, total, count = (np.concatenate(parts) for parts in (buckets, mins, maxs, sums, counts))
+        # merge the partial buckets of equal index (at block boundaries)
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(bucket)) + 1))
+        total, count = np.add.reduceat(total, starts), np.add.reduceat(count, starts)
+        np.savez(summary_filename, time=bucket[starts] * SUMMARY_SECONDS, min=np.minimum.reduceat(low, starts),
+                 max=np.maximum.reduceat(high, starts), mean=total / count)
+    else:
+        np.savez(summary_filename, time=np.empty(0), min=np.empty(0), max=np.empty(0), mean=np.empty(0))
+    marker_times = np.concatenate(marker_times) if marker_times else np.empty(0)
+    return {
+        'name': os.path.basename(chunks[0]),
+        'input_bytes': sum(os.path.getsize(chunk) for chunk in chunks),
+        'seconds': time.perf_counter() - start,
+        'outputs': [npy_filename, summary_filename],
+        'marker_times': marker_times.tolist()
+    }
+
+
+def _read_frames(segments, first_frame, last_frame):
+    """Yield (frame number, frame) of a segmented video from first_frame up to last_frame, opening only the segments needed."""
+    segment_start = 0
+    for filename in segments:
+        cap = cv2.VideoCapture(filename)
+        try:
+            num_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            if segment_start + num_frames > first_frame and segment_start <= last_frame:
+                frame_no = max(first_frame, segment_start)
+                cap.set(cv2.CAP_PROP_POS_FRAMES, frame_no - segment_start)
+                while frame_no <= min(last_frame, segment_start + num_frames - 1):
+                    ok, frame = cap.read()
+                    if not ok:
+                        break
+                    yield frame_no, frame
+                    frame_no += 1
+        finally:
+            cap.release()
+        segment_start += num_frames
+        if segment_start > last_frame:
+            return
+
+
+def export_clips(cam, segments, marker_times, video_offset, output_folder, session_name):
+    """Cut CAM[ID]_[session]_marker[N].avi clips of CLIP_SECONDS around every marker, one frame in memory at a time."""
+    start = time.perf_counter()
+    cap = cv2.VideoCapture(segments[0])
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    cap.release()
+    outputs = []
+    input_bytes = 0
+    for marker_number, marker_time in enumerate(marker_times, start=1):
+        center = int((marker_time - video_offset) * fps)
+        first_frame, last_frame = max(0, center - int(CLIP_SECONDS * fps)), center + int(CLIP_SECONDS * fps)
+        clip_filename = os.path.join(output_folder, f"CAM{cam}_{session_name}_marker{marker_number}.avi")
+        writer = None
+        for _, frame in _read_frames(segments, first_frame, last_frame):
+            if writer is None:
+                height, width = frame.shape[:2]
+                writer = cv2.VideoWriter(clip_filename, cv2.VideoWriter_fourcc(*'XVID'), fps, (width, height))
+            writer.write(frame)
+            input_bytes += frame.nbytes
+        if writer is not None:
+            writer.release()
+            outputs.append(clip_filename)
+    return {
+        'name': f"{os.path.basename(segments[0])} ({len(outputs)} clips)",
+        'input_bytes': input_bytes, # decoded bytes, the compressed size says little about the work
+        'seconds': time.perf_counter() - start,
+        'outputs': outputs,
+        'marker_times': []
+    }
+
+
+# ============================================
+# ----------------- Batch Run ----------------
+# ============================================
+class BatchExport:
+    """Export every recorded session for analysis, one file per task on a pool of processes."""
+    """Logs are exported first; the clips of a session's videos are cut once its logs have given up their markers."""
+
+    def __init__(self, base_path, output_folder=None, workers=None, progress=None):
+        """Initialize the export; progress(done, total, result) is called in the calling process after every file."""
+        self.base_path = base_path
+        self.output_folder = output_folder or os.path.join(base_path, "data", "export")
+        self.workers = workers or os.cpu_count()
+        self.progress = progress
+        self.is_cancelled = False
+        self.futures = {} # {future: session} of the tasks submitted and not yet reported
+        self.futures_lock = threading.Lock() # cancel() runs on another thread than run()
+
+    def cancel(self):
+        """Cancel the files not started and stop submitting more; the ones running are finished."""
+        with self.futures_lock:
+            self.is_cancelled = True
+            for future in self.futures:
+                future.cancel()
+
+    def _submit(self, pool, session, task, *args):
+        """Submit a task unless cancelled; returns an error result if the pool cannot take it."""
+        with self.futures_lock:
+            if self.is_cancelled:
+                return None
+            try:
+                self.futures[pool.submit(task, *args)] = session
+            except Exception as e: # a broken pool refuses new tasks
+                return _error_result(session['name'], e)
+        return None
+
+    def run(self):
+        """Export all sessions; returns the list of task results."""
+        sessions = find_sessions(self.base_path)
+        results = []
+        context = multiprocessing.get_context('spawn') # workers do not inherit the GUI state
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=context) as pool:
+            futures = self.futures
+            pending_logs = {} # {session name: log tasks still running}
+            marker_times = {} # {session name: [marker times]}
+            for session in sessions:
+                session_folder = os.path.join(self.output_folder, session['name'])
+                os.makedirs(session_folder, exist_ok=True)
+                pending_logs[session['name']] = len(session['logs'])
+                marker_times[session['name']] = []
+                for channel, chunks in session['logs'].items():
+                    error = self._submit(pool, session, export_log, channel, chunks, session_folder, session['name'])
+                    if error is not None:
+                        results.append(error)
+                        pending_logs[session['name']] -= 1
+            total = len(futures) + len(results) + sum(len(session['videos']) for session in sessions if session['logs'])
+            while futures:
+                future = next(as_completed(list(futures)))
+                with self.futures_lock:
+                    session = futures.pop(future)
+                if future.cancelled():
+                    continue
+                try:
+                    result = future.result()
+                except Exception as e: # a failed task, or a worker that died (BrokenProcessPool), fails only its file
+                    result = _error_result(session['name'], e)
+                results.append(result)
+                if self.progress:
+                    self.progress(len(results), total, result)
+                name = session['name']
+                if name not in pending_logs:
+                    continue # a clip task
+                marker_times[name] += result['marker_times']
+                pending_logs[name] -= 1
+                if pending_logs[name] == 0:
+                    del pending_logs[name]
+                    if self.is_cancelled:
+                        continue
+                    # markers are shared by all channels of a session, so clip each marker once
+                    times = np.unique(np.round(marker_times[name], 4)).tolist()
+                    session_folder = os.path.join(self.output_folder, name)
+                    for cam, segments in session['videos'].items():
+                        error = self._submit(pool, session, export_clips, cam, segments, times, session['video_offsets'].get(cam, 0.0), session_folder, name)
+                        if error is not None:
+                            results.append(error)
+        return results
+
+
+def _error_result(name, error):
+    """Return the result of a task that failed with error."""
+    return {'name': name, 'input_bytes': 0, 'seconds': 0.0, 'outputs': [], 'marker_times': [], 'error': f"{type(error).__name__}: {error}"}
+
+
+def format_result(result):
+    """Return a one-line report of a task result, with its throughput."""
+    if 'error' in result:
+        return f"{result['name']}: failed, {result['error']}"
+    megabytes = result['input_bytes'] / 1e6
+    return f"{result['name']}: {megabytes:.1f} MB in {result['seconds']:.2f} s ({megabytes / max(result['seconds'], 1e-6):.1f} MB/s)"
+
+
+if __name__ == '__main__':
+    def print_progress(done, total, result):
+        print(f"[{done}/{total}] {format_result(result)}")
+    base_path = sys.argv[1] if len(sys.argv) > 1 else os.path.dirname(os.path.abspath(__file__))
+    export_start = time.perf_counter()
+    BatchExport(base_path, progress=print_progress).run()
+    print(f"Exported in {time.perf_counter() - export_start:.1f} s")
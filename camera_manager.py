@@ -1,29 +1,122 @@
+import threading
+import time
 import cv2
 
 
+class CameraPool:
+    """Opened camera handles kept alive between previews, recordings and resolution scans."""
+    """Opening a camera and negotiating its format can take a second or more; a handle that is handed back stays
+    open, idle (no frames are grabbed), and is reused as is unless the size or frame rate asked for differ."""
+
+    def __init__(self, idle_timeout=300.0):
+        """Initialize the pool; handles idle for idle_timeout seconds are released (None to keep them until close_all)."""
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()
+        self.handles = {} # {cam_index: {'cap', 'settings': (width, height, fps) or None, 'in_use', 'idle_since'}}
+
+    def open(self, cam_index, width=None, height=None, fps=None):
+        """Return the capture of a camera configured to width x height at fps, or None if it cannot be opened."""
+        """The handle is in use until it is handed back with release(); settings left None are not changed."""
+        with self.lock:
+            handle = self.handles.get(cam_index)
+            if handle is not None and handle['in_use']:
+                return None
+            if handle is None:
+                cap = cv2.VideoCapture(cam_index)
+                if not cap.isOpened():
+                    cap.release()
+                    return None
+                handle = self.handles[cam_index] = {'cap': cap, 'settings': None, 'in_use': False, 'idle_since': None}
+            handle['in_use'] = True
+        cap = handle['cap']
+        settings = (width, height, fps)
+        if settings != handle['settings'] and any(value is not None for value in settings):
+            # only a change of format makes the driver renegotiate
+            if width is not None and height is not None:
+                cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+                cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+            if fps is not None:
+                cap.set(cv2.CAP_PROP_FPS, fps)
+            handle['settings'] = settings
+        elif handle['idle_since'] is not None:
+            cap.grab() # drop the frame left in the driver's buffer while idle
+        handle['idle_since'] = None
+        return cap
+
+    def release(self, cam_index):
+        """Hand a capture back; it stays open and idle for the next open() of the camera."""
+        with self.lock:
+            handle = self.handles.get(cam_index)
+            if handle is None or not handle['in_use']:
+                return
+            handle['in_use'] = False
+            handle['idle_since'] = idle_since = time.monotonic()
+        if self.idle_timeout is not None:
+            timer = threading.Timer(self.idle_timeout, self._close_if_idle, args=(cam_index, idle_since))
+            timer.daemon = True
+            timer.start()
+
+    def forget_settings(self, cam_index):
+        """Mark a camera's format as unknown, e.g. after probing, so the next open() sets it again."""
+        with self.lock:
+            if cam_index in self.handles:
+                self.handles[cam_index]['settings'] = None
+
+    def has_camera(self, cam_index):
+        with self.lock:
+            return cam_index in self.handles
+
+    def _close_if_idle(self, cam_index, idle_since):
+        """Release a capture that has stayed idle since idle_since."""
+        with self.lock:
+            handle = self.handles.get(cam_index)
+            if handle is None or handle['in_use'] or handle['idle_since'] != idle_since:
+                return
+            del self.handles[cam_index]
+        handle['cap'].release()
+
+    def close_all(self):
+        """Release every idle capture; the ones in use are released when handed back."""
+        with self.lock:
+            idle = [cam_index for cam_index, handle in self.handles.items() if not handle['in_use']]
+            handles = [self.handles.pop(cam_index) for cam_index in idle]
+            self.idle_timeout = 0.0
+        for handle in handles:
+            handle['cap'].release()
+
+
 class CameraManager:
     """Including scanning available cameras and resolutions."""
     
     @staticmethod
-    def find_available_cameras():
-        """Scan and return a dictionary of available cameras."""
+    def find_available_cameras(pool=None):
+        """Scan and return a dictionary of available cameras; with a pool, the opened cameras are kept in it."""
         available_cameras = {}
         index = 0
         while True:
-            cap = cv2.VideoCapture(index)
-            if cap.isOpened():
-                available_cameras[f"CAM {index}"] = index
-                cap.release()
-                index += 1
+            if pool is not None:
+                # a camera already in the pool (even in use) need not be opened again
+                is_opened = pool.has_camera(index)
+                if not is_opened and pool.open(index) is not None:
+                    pool.release(index)
+                    is_opened = True
             else:
+                cap = cv2.VideoCapture(index)
+                is_opened = cap.isOpened()
                 cap.release()
+            if not is_opened:
                 break
+            available_cameras[f"CAM {index}"] = index
+            index += 1
         return available_cameras
 
     @staticmethod
-    def find_available_resolutions(cam_index):
-        """Scan and return a list of available resolutions for the chosen camera."""
-        temp_cap = cv2.VideoCapture(cam_index)
+    def find_available_resolutions(cam_index, pool=None):
+        """Scan and return a list of available resolutions for the chosen camera, on its pooled capture if idle."""
+        temp_cap = pool.open(cam_index) if pool is not None else None
+        if temp_cap is None:
+            pool = None
+            temp_cap = cv2.VideoCapture(cam_index)
         if not temp_cap.isOpened():
             return []
         resolutions = set()
@@ -41,7 +134,11 @@ class CameraManager:
             actual_height = temp_cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
             if abs(actual_width - width) < 2 and abs(actual_height - height) < 2:
                 resolutions.add((int(actual_width), int(actual_height)))
-        temp_cap.release()
+        if pool is not None:
+            pool.forget_settings(cam_index) # probing left the camera at the last resolution tried
+            pool.release(cam_index)
+        else:
+            temp_cap.release()
         # sort resolutions by width and height
         sorted_resolutions = sorted(list(resolutions), key=lambda r: (r[0], r[1]))
         return [f"{w}x{h}" for w, h in sorted_resolutions]
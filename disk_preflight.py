@@ -0,0 +1,180 @@
+import ctypes
+import ctypes.util
+import os
+import shutil
+import sys
+import threading
+import time
+
+
+# estimates of the bytes written per second; an XVID frame is a fraction of the raw frame, noisy scenes compress worse
+VIDEO_CODEC_RATIO = 0.1
+LOG_ROW_BYTES = 20 # "123.4567,1.234567,0\n"
+LOG_COMPRESSION_RATIOS = {None: 1.0, 'gzip': 0.4, 'zlib': 0.4, 'lzma': 0.3}
+THROUGHPUT_MARGIN = 2.0 # a disk sustaining less than this multiple of the estimate is only warned about
+MIN_FREE_SECONDS = 600 # warn if the free space fills up sooner at the estimated rate
+
+# the write test: large blocks, stopped at PROBE_MAX_BYTES or PROBE_MAX_SECONDS, then synced to the disk
+PROBE_BLOCK_BYTES = 4 * 1024 * 1024
+PROBE_MAX_BYTES = 64 * 1024 * 1024
+PROBE_MAX_SECONDS = 0.5
+PROBE_CACHE_SECONDS = 600.0
+PROBE_FILENAME = ".disk_preflight.tmp"
+
+# output files are reserved ahead of their end in extents of this size
+VIDEO_EXTENT_BYTES = 64 * 1024 * 1024
+LOG_EXTENT_BYTES = 8 * 1024 * 1024
+FALLOC_FL_KEEP_SIZE = 0x01 # reserve the blocks without changing the file size
+
+_measurements = {} # {st_dev: (monotonic time, bytes per second)}
+_measurements_lock = threading.Lock()
+_fallocate = None
+_is_fallocate_loaded = False
+
+
+# ============================================
+# ------------ Bandwidth Estimate ------------
+# ============================================
+def estimate_video_bandwidth(resolution, fps, is_color=True):
+    """Return the estimated bytes per second of an XVID recording."""
+    width, height = resolution
+    return width * height * (3 if is_color else 1) * fps * VIDEO_CODEC_RATIO
+
+
+def estimate_log_bandwidth(rows_per_second, compression=None):
+    """Return the estimated bytes per second of a signal log."""
+    return rows_per_second * LOG_ROW_BYTES * LOG_COMPRESSION_RATIOS.get(compression, 1.0)
+
+
+def format_rate(bytes_per_second):
+    return f"{bytes_per_second / 1e6:.1f} MB/s"
+
+
+# ============================================
+# ------------ Throughput Measure ------------
+# ============================================
+def get_cached_throughput(folder, max_age=PROBE_CACHE_SECONDS):
+    """Return the throughput measured on the disk holding folder within max_age seconds, or None."""
+    try:
+        device = os.stat(folder).st_dev
+    except OSError:
+        return None
+    with _measurements_lock:
+        measured = _measurements.get(device)
+    if measured is not None and time.monotonic() - measured[0] < max_age:
+        return measured[1]
+    return None
+
+
+def is_on_same_disk(folder, other_folders):
+    """Return True if folder is on the same device as any of other_folders."""
+    try:
+        device = os.stat(folder).st_dev
+        return any(os.stat(other).st_dev == device for other in other_folders)
+    except OSError:
+        return False
+
+
+def measure_write_throughput(folder):
+    """Return the bytes per second the disk holding folder sustains, synced to the disk; raises OSError."""
+    """A short write test of up to a second or two on a slow disk, so run it off the GUI thread; the result is remembered per device."""
+    device = os.stat(folder).st_dev
+    filename = os.path.join(folder, PROBE_FILENAME)
+    block = os.urandom(PROBE_BLOCK_BYTES) # incompressible, in case the file system compresses
+    fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        start = time.perf_counter()
+        written = 0
+        while written < PROBE_MAX_BYTES and time.perf_counter() - start < PROBE_MAX_SECONDS:
+            written += os.write(fd, block)
+        os.fsync(fd)
+        throughput = written / max(time.perf_counter() - start, 1e-6)
+    finally:
+        os.close(fd)
+        os.remove(filename)
+    with _measurements_lock:
+        _measurements[device] = (time.monotonic(), throughput)
+    return throughput
+
+
+def check_disk(folder, required, throughput, is_refusing=True):
+    """Return (verdict, message) of writing required bytes per second into folder, whose disk sustains throughput: 'ok', 'warn' or 'refuse'."""
+    """It refuses when the throughput is below the estimate (only warns if is_refusing is False)."""
+    if required <= 0:
+        return 'ok', ""
+    try:
+        free_bytes = shutil.disk_usage(folder).free
+    except OSError as e:
+        return 'warn', f"cannot read the free space of {folder}: {e}"
+    if throughput < required:
+        message = f"the disk writes {format_rate(throughput)}, the recording needs about {format_rate(required)}"
+        return ('refuse' if is_refusing else 'warn'), message
+    if throughput < THROUGHPUT_MARGIN * required:
+        return 'warn', f"the disk writes {format_rate(throughput)}, barely above the {format_rate(required)} the recording needs"
+    if free_bytes < MIN_FREE_SECONDS * required:
+        return 'warn', f"{free_bytes / 1e9:.1f} GB free, full in {free_bytes / required / 60:.0f} min at {format_rate(required)}"
+    return 'ok', ""
+
+
+# ============================================
+# -------------- Preallocation ---------------
+# ============================================
+def _get_fallocate():
+    """Return libc's fallocate, or None where there is none (it is Linux only)."""
+    global _fallocate, _is_fallocate_loaded
+    if not _is_fallocate_loaded:
+        _is_fallocate_loaded = True
+        if sys.platform.startswith('linux'):
+            try:
+                libc = ctypes.CDLL(ctypes.util.find_library('c') or "libc.so.6", use_errno=True)
+                _fallocate = getattr(libc, 'fallocate64', None) or libc.fallocate
+                _fallocate.argtypes = (ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64)
+                _fallocate.restype = ctypes.c_int
+            except (OSError, AttributeError):
+                _fallocate = None
+    return _fallocate
+
+
+class FilePreallocator:
+    """Reserve the blocks of a file being written in large extents ahead of its end, so it is laid out in few fragments."""
+    """Linux only; elsewhere, or on a file system without fallocate, it does nothing and the file grows as usual."""
+
+    def __init__(self, filename, extent_bytes):
+        """Reserve the first extent of an existing file, written through another handle."""
+        self.filename = filename
+        self.extent_bytes = extent_bytes
+        self.reserved_end = 0
+        self.fd = None
+        if _get_fallocate() is None:
+            return
+        try:
+            self.fd = os.open(filename, os.O_RDWR)
+        except OSError:
+            return
+        self.reserve(0)
+
+    def reserve(self, size=None):
+        """Reserve another extent once the written size (the file size if None) is within half an extent of the reserved end."""
+        if self.fd is None:
+            return
+        if size is None:
+            size = os.fstat(self.fd).st_size
+        if size + self.extent_bytes // 2 < self.reserved_end:
+            return
+        end = size + self.extent_bytes
+        if _fallocate(self.fd, FALLOC_FL_KEEP_SIZE, self.reserved_end, end - self.reserved_end) != 0:
+            # not supported here, or the disk is full: the writes report that themselves
+            self.close()
+            return
+        self.reserved_end = end
+
+    def close(self):
+        """Release the blocks reserved past the end of the file; call it once the file is complete."""
+        if self.fd is None:
+            return
+        try:
+            os.ftruncate(self.fd, os.fstat(self.fd).st_size)
+        except OSError as e:
+            print(f"warning: cannot release the space reserved for {self.filename}: {e}")
+        os.close(self.fd)
+        self.fd = None
@@ -0,0 +1,219 @@
+import time
+import numpy as np
+
+
+# stage kinds in the order they are applied, with the parameter each takes
+STAGE_KINDS = ('highpass', 'notch', 'lowpass', 'moving_average', 'downsample')
+# an ASCII packet carries each sample as 'XX-XX-' (6 bytes), a byte costs 10 bits on the wire
+BYTES_PER_SAMPLE = 6
+BITS_PER_BYTE = 10
+
+
+def get_max_sample_rate(baudrate, bytes_per_sample=BYTES_PER_SAMPLE):
+    """Return the highest total sample rate (all channels) the serial link can deliver at a baudrate."""
+    return baudrate / BITS_PER_BYTE / bytes_per_sample
+
+
+def design_biquad(kind, frequency, sample_rate, q=0.7071):
+    """Return the (b, a) coefficients of a 'lowpass', 'highpass' or 'notch' biquad, normalized so a0 == 1."""
+    """Uses the bilinear-transform designs of the RBJ audio EQ cookbook."""
+    if not 0 < frequency < sample_rate / 2:
+        raise ValueError(f"{kind} at {frequency} Hz needs a sample rate above {2 * frequency} Hz (have {sample_rate:.1f} Hz)")
+    w0 = 2 * np.pi * frequency / sample_rate
+    cos_w0 = np.cos(w0)
+    alpha = np.sin(w0) / (2 * q)
+    if kind == 'lowpass':
+        b = [(1 - cos_w0) / 2, 1 - cos_w0, (1 - cos_w0) / 2]
+    elif kind == 'highpass':
+        b = [(1 + cos_w0) / 2, -(1 + cos_w0), (1 + cos_w0) / 2]
+    elif kind == 'notch':
+        b = [1.0, -2 * cos_w0, 1.0]
+    else:
+        raise ValueError(f"unknown biquad kind: {kind}")
+    a0 = 1 + alpha
+    return np.array(b) / a0, np.array([-2 * cos_w0, 1 - alpha]) / a0
+
+
+class BiquadStage:
+    """A second order IIR section applied block-wise, with its state carried across batches."""
+    """The recursion is solved per block as a convolution with the all-pole impulse response, so no Python loop runs per sample."""
+
+    BLOCK_SIZE = 256 # bounds the cost of the direct convolution per block
+    DECAY = 1e-12 # the impulse response is cut where it has decayed below this
+
+    def __init__(self, b, a):
+        """Initialize the section from normalized coefficients b = (b0, b1, b2), a = (a1, a2)."""
+        self.b = np.asarray(b, dtype=float)
+        self.a = np.asarray(a, dtype=float)
+        self.x_state = None # the last two inputs, oldest first
+        self.y_state = None # the last two outputs, oldest first
+        self.impulse = self._get_impulse_response(self.BLOCK_SIZE)
+
+    def _get_impulse_response(self, length):
+        """Return the impulse response of 1 / (1 + a1 z^-1 + a2 z^-2), cut once it has decayed."""
+        a1, a2 = self.a
+        h = np.zeros(length)
+        h[0] = 1.0
+        for n in range(1, length): # once per filter, not per sample
+            h[n] = -a1 * h[n - 1] - (a2 * h[n - 2] if n > 1 else 0.0)
+        significant = np.flatnonzero(np.abs(h) > self.DECAY * np.abs(h).max())
+        return h[:significant[-1] + 1] if len(significant) else h[:1]
+
+    def reset(self, first_value):
+        """Start the filter in steady state at first_value, so it does not ring at the start."""
+        dc_gain = self.b.sum() / (1 + self.a.sum())
+        self.x_state = np.full(2, first_value)
+        self.y_state = np.full(2, first_value * dc_gain)
+
+    def process(self, times, values):
+        """Filter a batch of samples; times pass through unchanged."""
+        if not len(values):
+            return times, values
+        if self.x_state is None:
+            self.reset(values[0])
+        output = np.empty(len(values))
+        for start in range(0, len(values), self.BLOCK_SIZE):
+            output[start:start + self.BLOCK_SIZE] = self._process_block(values[start:start + self.BLOCK_SIZE])
+        return times, output
+
+    def _process_block(self, x):
+        """Filter one block of at most BLOCK_SIZE samples."""
+        b0, b1, b2 = self.b
+        a1, a2 = self.a
+        x_ext = np.concatenate((self.x_state, x))
+        w = b0 * x_ext[2:] + b1 * x_ext[1:-1] + b2 * x_ext[:-2]
+        # fold the previous outputs into the first two inputs of the all-pole recursion
+        y_prev2, y_prev1 = self.y_state
+        w[0] -= a1 * y_prev1 + a2 * y_prev2
+        if len(w) > 1:
+            w[1] -= a2 * y_prev1
+        y = np.convolve(w, self.impulse[:len(w)])[:len(w)]
+        self.x_state = x_ext[-2:]
+        self.y_state = np.concatenate((self.y_state, y))[-2:]
+        return y
+
+
+class MovingAverageStage:
+    """A moving average over a fixed number of samples, computed with a cumulative sum per batch."""
+
+    def __init__(self, window):
+        """Initialize the stage with its window length in samples."""
+        self.window = max(1, int(window))
+        self.tail = None # the last window - 1 inputs
+
+    def process(self, times, values):
+        """Average a batch of samples; times pass through unchanged."""
+        if not len(values):
+            return times, values
+        if self.tail is None:
+            self.tail = np.full(self.window - 1, values[0])
+        extended = np.concatenate((self.tail, values))
+        sums = np.cumsum(np.concatenate(([0.0], extended)))
+        output = (sums[self.window:] - sums[:-self.window]) / self.window
+        self.tail = extended[len(extended) - (self.window - 1):]
+        return times, output
+
+
+class DownsampleStage:
+    """Keep every factor-th sample after a 4th order Butterworth anti-aliasing low-pass."""
+
+    BUTTERWORTH_Q = (0.5412, 1.3066) # the two sections of a 4th order Butterworth
+    CUTOFF_RATIO = 0.8 # of the output Nyquist frequency
+
+    def __init__(self, factor, sample_rate):
+        """Initialize the stage with its integer factor and input sample rate."""
+        self.factor = max(1, int(factor))
+        cutoff = self.CUTOFF_RATIO * sample_rate / self.factor / 2
+        self.anti_alias = [BiquadStage(*design_biquad('lowpass', cutoff, sample_rate, q)) for q in self.BUTTERWORTH_Q]
+        self.phase = 0 # samples to skip before the next kept one
+
+    def get_output_rate(self, sample_rate):
+        return sample_rate / self.factor
+
+    def process(self, times, values):
+        """Filter and decimate a batch of samples, keeping the decimation phase across batches."""
+        for section in self.anti_alias:
+            times, values = section.process(times, values)
+        kept = np.arange(self.phase, len(values), self.factor)
+        self.phase = (self.phase - len(values)) % self.factor
+        return times[kept], values[kept]
+
+
+def create_stage(kind, parameter, sample_rate):
+    """Create one stage from its spec; parameter is a frequency in Hz, a window or a factor."""
+    if kind in ('lowpass', 'highpass'):
+        return BiquadStage(*design_biquad(kind, parameter, sample_rate))
+    if kind == 'notch':
+        return BiquadStage(*design_biquad(kind, parameter, sample_rate, q=30.0))
+    if kind == 'moving_average':
+        return MovingAverageStage(parameter)
+    if kind == 'downsample':
+        return DownsampleStage(parameter, sample_rate)
+    raise ValueError(f"unknown DSP stage: {kind}")
+
+
+class DspChain:
+    """A chain of DSP stages for one channel, built for a known sample rate."""
+
+    def __init__(self, stage_specs, sample_rate):
+        """Build the stages from a list of (kind, parameter) specs; stages that do not fit the sample rate are skipped."""
+        self.stages = []
+        self.input_rate = sample_rate
+        self.output_rate = sample_rate
+        for kind, parameter in sorted(stage_specs, key=lambda spec: STAGE_KINDS.index(spec[0])):
+            try:
+                stage = create_stage(kind, parameter, self.output_rate)
+            except ValueError as e:
+                print(f"warning: DSP stage skipped: {e}")
+                continue
+            self.stages.append(stage)
+            if isinstance(stage, DownsampleStage):
+                self.output_rate = stage.get_output_rate(self.output_rate)
+
+    def process(self, times, values):
+        """Run a batch of (times, values) arrays through every stage."""
+        for stage in self.stages:
+            times, values = stage.process(times, values)
+        return times, values
+
+
+class ChannelProcessor:
+    """The DSP stage of one live channel."""
+    """Unless a sample rate is given, the first PRIME_SECONDS of samples are held back to measure it before the chain is built."""
+
+    PRIME_SECONDS = 1.0
+
+    def __init__(self, stage_specs, sample_rate=None):
+        """Initialize the processor with its (kind, parameter) stage specs."""
+        self.stage_specs = list(stage_specs)
+        self.chain = DspChain(self.stage_specs, sample_rate) if sample_rate else None
+        self.held_times = []
+        self.held_values = []
+
+    def get_sample_rate(self):
+        """Return the input sample rate, or None while it is still being measured."""
+        return self.chain.input_rate if self.chain else None
+
+    def process(self, times, values):
+        """Filter a batch of samples, returning the (times, values) ready to plot and log."""
+        if self.chain is None:
+            self.held_times.append(times)
+            self.held_values.append(values)
+            times, values = np.concatenate(self.held_times), np.concatenate(self.held_values)
+            duration = times[-1] - times[0] if len(times) else 0.0
+            if duration < self.PRIME_SECONDS:
+                return times[:0], values[:0]
+            self.chain = DspChain(self.stage_specs, (len(times) - 1) / duration)
+            self.held_times, self.held_values = [], []
+        return self.chain.process(times, values)
+
+
+def measure_throughput(stage_specs, sample_rate, batch_size=64, num_samples=200000):
+    """Return the number of samples per second a chain processes in batches of batch_size."""
+    chain = DspChain(stage_specs, sample_rate)
+    times = np.arange(num_samples) / sample_rate
+    values = np.sin(2 * np.pi * 50 * times) + np.random.default_rng(0).normal(0, 0.1, num_samples)
+    start = time.perf_counter()
+    for i in range(0, num_samples, batch_size):
+        chain.process(times[i:i + batch_size], values[i:i + batch_size])
+    return num_samples / (time.perf_counter() - start)
@@ -0,0 +1,162 @@
+import threading
+import time
+import cv2
+
+from trace_profiler import tracer
+
+
+class FrameConsumer:
+    """A consumer of one camera's frames with its own policy: rate cap, crop, output size and color conversion."""
+    """The callback runs on the capture thread as callback(frame, timestamp) and must not block."""
+
+    def __init__(self, callback, max_fps=None, size=None, width=None, conversion=None, crop=None, step=1):
+        """Initialize the consumer; max_fps None takes every frame, size (w, h) or width downscales it."""
+        """conversion is an optional cv2.cvtColor code, e.g. cv2.COLOR_BGR2GRAY; crop (x, y, w, h) and every step-th pixel are taken as views."""
+        self.callback = callback
+        self.min_interval = 1.0 / max_fps if max_fps else 0.0
+        self.max_fps = max_fps
+        self.size = size
+        self.width = width # keeps the aspect ratio, used when size is None
+        self.conversion = conversion
+        self.crop = crop
+        self.step = step
+        self.next_time = 0.0
+
+    def set_max_fps(self, max_fps):
+        """Change the rate cap, e.g. while the load governor sheds work."""
+        self.max_fps = max_fps
+        self.min_interval = 1.0 / max_fps if max_fps else 0.0
+
+    def set_size(self, size):
+        """Change the output size, e.g. when the preview canvas is resized."""
+        self.size = size
+
+    def is_due(self, timestamp):
+        """Return True if the consumer wants the frame captured at timestamp."""
+        # a quarter interval of slack, so capture jitter does not skip a whole frame
+        return timestamp >= self.next_time - self.min_interval / 4
+
+    def deliver(self, frame, timestamp):
+        """Convert a full resolution frame to the consumer's format and pass it on."""
+        # keep the schedule on a fixed grid so the rate cap holds on average, without bursts after a stall
+        self.next_time = max(self.next_time + self.min_interval, timestamp + self.min_interval / 2)
+        self.callback(self.convert(frame), timestamp)
+
+    def convert(self, frame):
+        """Return a full resolution frame in the consumer's format."""
+        # cropping and integer downscaling are slices, no pixel is copied until the consumer copies the view
+        if self.crop is not None:
+            x, y, w, h = self.crop
+            frame = frame[y:y + h, x:x + w]
+        if self.step > 1:
+            frame = frame[::self.step, ::self.step]
+        size = self.size
+        if size is None and self.width and frame.shape[1] > self.width:
+            size = (self.width, max(1, frame.shape[0] * self.width // frame.shape[1]))
+        if size is not None and (size[0] != frame.shape[1] or size[1] != frame.shape[0]):
+            # downscale first, so the color conversion only touches the small image
+            frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        if self.conversion is not None:
+            frame = cv2.cvtColor(frame, self.conversion)
+        return frame
+
+
+def get_record_options(capture_size, roi=None, grayscale=False, step=1):
+    """Return (FrameConsumer options, output (w, h), is_color) of a recording format."""
+    """roi is (x0, y0, x1, y1) as fractions of the frame; the crop is aligned so the output has even dimensions."""
+    width, height = capture_size
+    align = 2 * step
+    x0, y0, x1, y1 = roi if roi is not None else (0.0, 0.0, 1.0, 1.0)
+    x, y = int(x0 * width), int(y0 * height)
+    crop_width = max(align, min(int((x1 - x0) * width), width - x) // align * align)
+    crop_height = max(align, min(int((y1 - y0) * height), height - y) // align * align)
+    crop = (x, y, crop_width, crop_height) if (crop_width, crop_height) != (width, height) else None
+    options = {'crop': crop, 'step': step, 'conversion': cv2.COLOR_BGR2GRAY if grayscale else None}
+    return options, (crop_width // step, crop_height // step), not grayscale
+
+
+class LatestFrame:
+    """A one-slot mailbox holding the newest frame of a consumer for the GUI thread."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.frame = None
+        self.timestamp = None
+
+    def put(self, frame, timestamp):
+        with self.lock:
+            self.frame, self.timestamp = frame, timestamp
+
+    def take(self):
+        """Return (frame, timestamp) of the newest frame not taken yet, or (None, None)."""
+        with self.lock:
+            frame, timestamp = self.frame, self.timestamp
+            self.frame = self.timestamp = None
+        return frame, timestamp
+
+
+class CaptureFanout:
+    """Read one camera on its own thread and fan each frame out to the consumers that want it."""
+    """A frame nobody is due for is only grabbed, never decoded with retrieve()."""
+
+    def __init__(self, cap, name="camera"):
+        """Initialize the fan-out of an opened cv2.VideoCapture."""
+        self.cap = cap
+        self.name = name
+        self.consumers = {}
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.capture_thread = None
+        self.frames_grabbed = 0
+        self.frames_decoded = 0
+
+    def set_consumer(self, name, consumer):
+        """Add or replace a named consumer."""
+        with self.lock:
+            self.consumers[name] = consumer
+
+    def remove_consumer(self, name):
+        """Remove a named consumer, if present."""
+        with self.lock:
+            self.consumers.pop(name, None)
+
+    def has_consumer(self, name):
+        return name in self.consumers
+
+    def start(self):
+        """Start the capture thread."""
+        self.stop_event.clear()
+        self.capture_thread = threading.Thread(target=self._capture_loop, daemon=True)
+        self.capture_thread.start()
+
+    def stop(self):
+        """Stop the capture thread; the caller releases the capture afterwards."""
+        self.stop_event.set()
+        if self.capture_thread is not None:
+            self.capture_thread.join()
+            self.capture_thread = None
+
+    def _capture_loop(self):
+        """Grab every frame, decode it only if a consumer is due, then deliver it."""
+        while not self.stop_event.is_set():
+            tracer.profile_checkpoint()
+            with tracer.span("frame capture"):
+                is_grabbed = self.cap.grab() # blocks until the next frame, pacing the loop
+            if not is_grabbed:
+                time.sleep(0.01)
+                continue
+            timestamp = time.perf_counter()
+            self.frames_grabbed += 1
+            # consumers are delivered under the lock, so once remove_consumer returns none is in flight
+            with self.lock:
+                due = [consumer for consumer in self.consumers.values() if consumer.is_due(timestamp)]
+                if not due:
+                    continue
+                with tracer.span("frame decode"):
+                    is_retrieved, frame = self.cap.retrieve()
+                if not is_retrieved:
+                    continue
+                self.frames_decoded += 1
+                for consumer in due:
+                    with tracer.span("frame convert"):
+                        consumer.deliver(frame, timestamp)
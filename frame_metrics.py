@@ -0,0 +1,100 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+
+from trace_profiler import tracer
+
+
+# channels of the activity signals, after the serial channels of any number of devices
+ACTIVITY_CHANNEL_BASE = 100
+METRICS = ('difference', 'brightness')
+
+
+class FrameActivity:
+    """Per-frame activity metrics of the camera streams, measured on a thread pool instead of the capture threads."""
+    """Each camera yields two signals on the serial timeline: the mean absolute difference to its previous frame and the mean brightness of its region of interest, both from 0 to 1."""
+
+    def __init__(self, workers=2, max_pending=32):
+        """Initialize the pool; frames beyond max_pending queued measurements are dropped, never waited for."""
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="frame-metrics")
+        self.max_pending = max_pending
+        self.lock = threading.Lock()
+        self.previous_frames = {} # {cam_id: thumbnail}
+        self.rois = {} # {cam_id: (x0, y0, x1, y1) fractions}
+        self.time_origin = None # a perf_counter value, None while not measuring
+        self.results = [] # [(time, channel, value)]
+        self.pending = 0
+        self.dropped_frames = 0
+
+    @staticmethod
+    def get_channels(cam_id):
+        """Return the {channel: label} of a camera's activity signals."""
+        first = ACTIVITY_CHANNEL_BASE + len(METRICS) * cam_id + 1
+        return {first + i: f"CAM{cam_id+1} {metric}" for i, metric in enumerate(METRICS)}
+
+    def set_roi(self, cam_id, roi):
+        """Measure the brightness of the region (x0, y0, x1, y1), in fractions of the frame (None for all)."""
+        self.rois[cam_id] = roi
+
+    def start(self, time_origin):
+        """Start measuring, with times counted from time_origin (the serial stream's perf_counter origin)."""
+        with self.lock:
+            self.results = []
+            self.time_origin = time_origin
+
+    def stop(self):
+        with self.lock:
+            self.time_origin = None
+            self.results = []
+
+    def close(self):
+        self.stop()
+        self.pool.shutdown(wait=False)
+
+    def feed(self, cam_id, thumbnail, timestamp):
+        """Queue the measurement of a grayscale thumbnail; called on the camera's capture thread."""
+        previous = self.previous_frames.get(cam_id)
+        self.previous_frames[cam_id] = thumbnail
+        if previous is None or previous.shape != thumbnail.shape:
+            return
+        with self.lock:
+            if self.time_origin is None:
+                return
+            if self.pending >= self.max_pending:
+                self.dropped_frames += 1
+                return
+            self.pending += 1
+            frame_time = timestamp - self.time_origin
+        self.pool.submit(self._measure, cam_id, previous, thumbnail, frame_time)
+
+    def _measure(self, cam_id, previous, thumbnail, frame_time):
+        """Compute the metrics of one frame; the cv2 calls release the GIL."""
+        try:
+            with tracer.span("frame metrics"):
+                difference = cv2.mean(cv2.absdiff(thumbnail, previous))[0] / 255.0
+                roi = self.rois.get(cam_id)
+                region = thumbnail
+                if roi is not None:
+                    height, width = thumbnail.shape[:2]
+                    x0, y0, x1, y1 = int(roi[0] * width), int(roi[1] * height), int(roi[2] * width), int(roi[3] * height)
+                    region = thumbnail[y0:max(y1, y0 + 1), x0:max(x1, x0 + 1)]
+                brightness = cv2.mean(region)[0] / 255.0
+            difference_channel, brightness_channel = self.get_channels(cam_id)
+            with self.lock:
+                if self.time_origin is not None:
+                    self.results.append((frame_time, difference_channel, difference))
+                    self.results.append((frame_time, brightness_channel, brightness))
+        finally:
+            with self.lock:
+                self.pending -= 1
+
+    def take(self):
+        """Return the (times, channels, values) arrays measured since the last call, in time order."""
+        with self.lock:
+            results, self.results = self.results, []
+        if not results:
+            return np.empty(0), np.empty(0, dtype=np.int64), np.empty(0)
+        results.sort() # measurements of different frames may finish out of order
+        times, channels, values = zip(*results)
+        return np.array(times), np.array(channels, dtype=np.int64), np.array(values)
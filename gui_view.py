@@ -5,6 +5,8 @@ from tkinter import ttk
 class CameraControlPanel:
     """A control panel for a single camera in the GUI."""
 
+    SCALES = ("1/1", "1/2", "1/4") # recording downscale, every n-th pixel
+
     def __init__(self, parent, controller, camera_id):
         self.frame = ttk.Frame(parent)
         self.camera_id = camera_id
@@ -20,14 +22,77 @@ class CameraControlPanel:
         self.resolution_menu = ttk.OptionMenu(self.frame, self.selected_resolution_var, "Choose Camera First")
         self.resolution_menu.pack(side=tk.LEFT, padx=5)
         self.resolution_menu.config(state="disabled")
+        # recording format, the region of interest is dragged on the preview canvas
+        self.grayscale_var = tk.BooleanVar(value=False)
+        self.scale_var = tk.StringVar(value=self.SCALES[0])
+        ttk.Label(self.frame, text="Record:").pack(side=tk.LEFT, padx=(10, 5))
+        ttk.Checkbutton(self.frame, text="Gray", variable=self.grayscale_var, command=self._apply_format).pack(side=tk.LEFT, padx=5)
+        ttk.OptionMenu(self.frame, self.scale_var, self.SCALES[0], *self.SCALES, command=lambda _: self._apply_format()).pack(side=tk.LEFT, padx=5)
+
+    def _apply_format(self):
+        step = int(self.scale_var.get().split('/')[1])
+        self.controller.set_recording_format(self.camera_id, self.grayscale_var.get(), step)
 
     def grid(self, **kwargs):
         self.frame.grid(**kwargs)
 
 
+class TriggerSettingsDialog:
+    """A dialog to edit the per-channel trigger conditions and the pre-trigger and hold times."""
+
+    def __init__(self, root, controller):
+        self.controller = controller
+        self.window = tk.Toplevel(root)
+        self.window.title("Trigger Settings")
+        self.window.resizable(False, False)
+        frame = ttk.Frame(self.window, padding="10")
+        frame.pack(fill=tk.BOTH, expand=True)
+        for column, heading in enumerate(("Channel", "Condition", "Direction", "Level")):
+            ttk.Label(frame, text=heading).grid(row=0, column=column, sticky='w', padx=5)
+        # one row per channel, filled from the controller's current settings
+        self.channel_vars = {}
+        for row, ch in enumerate((1, 2), start=1):
+            kind, level, direction = controller.trigger_specs.get(ch, ("Off", 1.0, "rising"))
+            kind_var, direction_var, level_var = tk.StringVar(value=kind), tk.StringVar(value=direction), tk.StringVar(value=str(level))
+            ttk.Label(frame, text=f"CH {ch}").grid(row=row, column=0, sticky='w', padx=5)
+            ttk.Combobox(frame, textvariable=kind_var, values=("Off", "threshold", "slope", "rms"), state="readonly", width=10).grid(row=row, column=1, padx=5, pady=2)
+            ttk.Combobox(frame, textvariable=direction_var, values=("rising", "falling"), state="readonly", width=8).grid(row=row, column=2, padx=5, pady=2)
+            ttk.Entry(frame, textvariable=level_var, width=8).grid(row=row, column=3, padx=5, pady=2)
+            self.channel_vars[ch] = (kind_var, direction_var, level_var)
+        self.pre_seconds_var = tk.StringVar(value=str(controller.trigger_pre_seconds))
+        self.hold_seconds_var = tk.StringVar(value=str(controller.trigger_hold_seconds))
+        ttk.Label(frame, text="Pre-trigger (s)").grid(row=3, column=0, columnspan=2, sticky='w', padx=5, pady=(10, 2))
+        ttk.Entry(frame, textvariable=self.pre_seconds_var, width=8).grid(row=3, column=3, padx=5, pady=(10, 2))
+        ttk.Label(frame, text="Hold after last trigger (s)").grid(row=4, column=0, columnspan=2, sticky='w', padx=5)
+        ttk.Entry(frame, textvariable=self.hold_seconds_var, width=8).grid(row=4, column=3, padx=5, pady=2)
+        self.state_label = ttk.Label(frame, text="Levels: V for threshold and RMS, V/s for slope.")
+        self.state_label.grid(row=5, column=0, columnspan=4, sticky='w', padx=5, pady=(10, 0))
+        ttk.Button(frame, text="Apply", command=self.apply).grid(row=6, column=3, sticky='e', padx=5, pady=(10, 0))
+
+    def apply(self):
+        """Validate the fields and pass the settings to the controller."""
+        try:
+            trigger_specs = {}
+            for ch, (kind_var, direction_var, level_var) in self.channel_vars.items():
+                if kind_var.get() != "Off":
+                    trigger_specs[ch] = (kind_var.get(), float(level_var.get()), direction_var.get())
+            pre_seconds = float(self.pre_seconds_var.get())
+            hold_seconds = float(self.hold_seconds_var.get())
+        except ValueError:
+            self.state_label.config(text="Levels and times must be numbers.", foreground="red")
+            return
+        if pre_seconds < 0 or hold_seconds < 0:
+            self.state_label.config(text="Times cannot be negative.", foreground="red")
+            return
+        self.controller.set_trigger_settings(trigger_specs, pre_seconds, hold_seconds)
+        self.state_label.config(text="Applied, takes effect at the next receive.", foreground="black")
+
+
 class AppGUI:
     """Main GUI class for the application."""
 
+    MIN_ROI_PIXELS = 8 # a smaller drag is a click
+
     def __init__(self, root, controller):
         """Initialize the GUI"""
         self.root = root
@@ -35,8 +100,138 @@ class AppGUI:
         self.root.title("Advanced Controller APP")
         self.camera_panels = []
         self.camera_canvases = []
+        self.roi_fractions = {} # {camera_id: (x0, y0, x1, y1)} shown on the preview
+        self.roi_start = (0, 0)
+        self._create_menu()
         self._create_widgets()
 
+    def _create_menu(self):
+        """Create the menu bar with the tool entries."""
+        self.menubar = tk.Menu(self.root)
+        self.root.config(menu=self.menubar)
+        # === Tools Menu ===
+        self.tools_menu = tk.Menu(self.menubar, tearoff=0)
+        self.menubar.add_cascade(label="Tools", menu=self.tools_menu)
+        self.tools_menu.add_command(label="Review Signal Log...", command=self.controller.open_session_viewer)
+        self.tools_menu.add_command(label="Play Back Session...", command=self.controller.open_session_playback)
+        self.tools_menu.add_command(label="Batch Export Sessions", command=self.controller.start_batch_export)
+        self.tools_menu.add_separator()
+        self.tools_menu.add_command(label="Start Tracing", command=self.controller.toggle_tracing)
+        self.tracing_menu_index = self.tools_menu.index("end")
+        self.tools_menu.add_command(label="Profile for 10 s", command=self.controller.start_profile_window)
+        self.profiling_menu_index = self.tools_menu.index("end")
+        self.spectrum_var = tk.BooleanVar(value=False)
+        self.tools_menu.add_checkbutton(label="Live Spectrum", variable=self.spectrum_var,
+                                        command=lambda: self.controller.set_spectrum_visible(self.spectrum_var.get()))
+        self.spectrum_menu_index = self.tools_menu.index("end")
+        self.tools_menu.add_command(label="Trigger Settings...", command=self.open_trigger_settings)
+        self.trigger_settings_menu_index = self.tools_menu.index("end")
+        self.trigger_armed_var = tk.BooleanVar(value=False)
+        self.tools_menu.add_checkbutton(label="Arm Trigger", variable=self.trigger_armed_var,
+                                        command=lambda: self.controller.set_trigger_armed(self.trigger_armed_var.get()))
+        self.trigger_armed_menu_index = self.tools_menu.index("end")
+        self.live_publishing_var = tk.BooleanVar(value=False)
+        self.tools_menu.add_checkbutton(label="Publish Live Data", variable=self.live_publishing_var,
+                                        command=lambda: self.controller.set_live_publishing(self.live_publishing_var.get()))
+        self.camera_activity_var = tk.BooleanVar(value=False)
+        self.tools_menu.add_checkbutton(label="Log Camera Activity", variable=self.camera_activity_var,
+                                        command=lambda: self.controller.set_camera_activity(self.camera_activity_var.get()))
+        self.camera_activity_menu_index = self.tools_menu.index("end")
+        self.serial_capture_var = tk.BooleanVar(value=False)
+        self.tools_menu.add_checkbutton(label="Capture Raw Serial Bytes", variable=self.serial_capture_var,
+                                        command=lambda: self.controller.set_serial_capture(self.serial_capture_var.get()))
+        self.tools_menu.add_command(label="Replay Serial Capture...", command=self.controller.open_serial_replay)
+        self.tools_menu.add_command(label="Replay Serial Capture (Fast)...", command=lambda: self.controller.open_serial_replay(is_fast=True))
+        # filled with the found ports by update_serial_port_menu
+        self.additional_ports_menu = tk.Menu(self.tools_menu, tearoff=0)
+        self.additional_port_vars = {}
+        self.tools_menu.add_cascade(label="Additional Serial Ports", menu=self.additional_ports_menu)
+        self.load_shedding_var = tk.BooleanVar(value=True)
+        self.tools_menu.add_checkbutton(label="Shed Load When Overloaded", variable=self.load_shedding_var,
+                                        command=lambda: self.controller.set_load_shedding(self.load_shedding_var.get()))
+        self.refuse_slow_disk_var = tk.BooleanVar(value=True)
+        self.tools_menu.add_checkbutton(label="Refuse Recording on a Slow Disk", variable=self.refuse_slow_disk_var,
+                                        command=lambda: self.controller.set_slow_disk_refusal(self.refuse_slow_disk_var.get()))
+        self.acquisition_process_var = tk.BooleanVar(value=False)
+        self.tools_menu.add_checkbutton(label="Acquire in Separate Process", variable=self.acquisition_process_var,
+                                        command=lambda: self.controller.set_acquisition_process(self.acquisition_process_var.get()))
+        self.tools_menu.add_separator()
+        self.memory_budget_var = tk.IntVar(value=512)
+        memory_menu = tk.Menu(self.tools_menu, tearoff=0)
+        for budget_mb in (256, 512, 1024, 2048):
+            memory_menu.add_radiobutton(label=f"{budget_mb} MB", value=budget_mb, variable=self.memory_budget_var,
+                                        command=lambda: self.controller.set_memory_budget(self.memory_budget_var.get()))
+        self.tools_menu.add_cascade(label="Memory Budget", menu=memory_menu)
+        self.video_segment_var = tk.StringVar(value="Off")
+        segment_menu = tk.Menu(self.tools_menu, tearoff=0)
+        segment_options = {
+            "Off": (None, None),
+            "Every 5 min": (5 * 60, None),
+            "Every 15 min": (15 * 60, None),
+            "Every 60 min": (60 * 60, None),
+            "Every 1 GB": (None, 1024 ** 3),
+            "Every 4 GB": (None, 4 * 1024 ** 3),
+        }
+        for label, (duration, max_bytes) in segment_options.items():
+            segment_menu.add_radiobutton(label=label, value=label, variable=self.video_segment_var,
+                                         command=lambda d=duration, b=max_bytes: self.controller.set_video_segmentation(d, b))
+        self.tools_menu.add_cascade(label="Video Segments", menu=segment_menu)
+        self.log_compression_var = tk.StringVar(value="Off")
+        compression_menu = tk.Menu(self.tools_menu, tearoff=0)
+        compression_options = {
+            "Off": (None, 6),
+            "gzip (fast)": ('gzip', 1),
+            "gzip": ('gzip', 6),
+            "zlib": ('zlib', 6),
+            "lzma (small)": ('lzma', 6),
+            "lzma (smallest)": ('lzma', 9),
+        }
+        for label, (compression, level) in compression_options.items():
+            compression_menu.add_radiobutton(label=label, value=label, variable=self.log_compression_var,
+                                             command=lambda c=compression, l=level: self.controller.set_log_compression(c, l))
+        self.tools_menu.add_cascade(label="Log Compression", menu=compression_menu)
+        self.log_chunk_var = tk.StringVar(value="Off")
+        chunk_menu = tk.Menu(self.tools_menu, tearoff=0)
+        chunk_options = {
+            "Off": None,
+            "Every 10 min": 10 * 60,
+            "Every 60 min": 60 * 60,
+        }
+        for label, duration in chunk_options.items():
+            chunk_menu.add_radiobutton(label=label, value=label, variable=self.log_chunk_var,
+                                       command=lambda d=duration: self.controller.set_log_chunking(d))
+        self.tools_menu.add_cascade(label="Log Chunks", menu=chunk_menu)
+        filter_menu = tk.Menu(self.tools_menu, tearoff=0)
+        self.dsp_stage_options = {
+            "High-pass 0.5 Hz": ('highpass', 0.5),
+            "Notch 50 Hz": ('notch', 50.0),
+            "Notch 60 Hz": ('notch', 60.0),
+            "Low-pass 40 Hz": ('lowpass', 40.0),
+            "Moving Average (8)": ('moving_average', 8),
+            "Downsample x4": ('downsample', 4),
+        }
+        self.dsp_stage_vars = {}
+        for ch in (1, 2):
+            channel_menu = tk.Menu(filter_menu, tearoff=0)
+            self.dsp_stage_vars[ch] = {label: tk.BooleanVar(value=False) for label in self.dsp_stage_options}
+            for label in self.dsp_stage_options:
+                channel_menu.add_checkbutton(label=label, variable=self.dsp_stage_vars[ch][label],
+                                             command=lambda c=ch: self.controller.set_dsp_stages(c, self.get_dsp_stages(c)))
+            filter_menu.add_cascade(label=f"CH {ch}", menu=channel_menu)
+        filter_menu.add_separator()
+        self.log_raw_signal_var = tk.BooleanVar(value=False)
+        filter_menu.add_checkbutton(label="Also Log Raw Signal", variable=self.log_raw_signal_var,
+                                    command=lambda: self.controller.set_log_raw_signal(self.log_raw_signal_var.get()))
+        self.tools_menu.add_cascade(label="Signal Filters", menu=filter_menu)
+
+    def open_trigger_settings(self):
+        """Open the trigger settings dialog."""
+        TriggerSettingsDialog(self.root, self.controller)
+
+    def get_dsp_stages(self, channel):
+        """Return the (kind, parameter) specs of the DSP stages checked for a channel."""
+        return [spec for label, spec in self.dsp_stage_options.items() if self.dsp_stage_vars[channel][label].get()]
+
     def _create_widgets(self):
         """Create and layout all GUI components."""
         main_frame = ttk.Frame(self.root, padding="10")
@@ -66,6 +261,11 @@ class AppGUI:
         canvas2 = tk.Canvas(camera_canvas_frame, bg="black")
         canvas2.grid(row=0, column=1, sticky="nsew", padx=(5, 0))
         self.camera_canvases.append(canvas2)
+        # drag a rectangle to record only that region, click to record the whole frame again
+        for cam_id, canvas in enumerate(self.camera_canvases):
+            canvas.bind("<ButtonPress-1>", lambda event, cam_id=cam_id: self._start_roi(cam_id, event))
+            canvas.bind("<B1-Motion>", lambda event, cam_id=cam_id: self._drag_roi(cam_id, event))
+            canvas.bind("<ButtonRelease-1>", lambda event, cam_id=cam_id: self._finish_roi(cam_id, event))
         
         # === Global Camera Controls ===
         global_camera_control_frame = ttk.Frame(main_frame)
@@ -139,9 +339,25 @@ class AppGUI:
         self.receive_data_state_label.pack(side=tk.RIGHT, padx=5)
         
         # === Serial Plot Frame ===
-        self.serial_plot_frame = ttk.Frame(main_frame)
-        self.serial_plot_frame.grid(row=8, column=0, sticky='nsew', pady=(5,0))
+        plot_row_frame = ttk.Frame(main_frame)
+        plot_row_frame.grid(row=8, column=0, sticky='nsew', pady=(5,0))
+        plot_row_frame.columnconfigure(0, weight=3)
+        plot_row_frame.columnconfigure(1, weight=1)
+        plot_row_frame.rowconfigure(0, weight=1)
         main_frame.rowconfigure(8, weight=1)
+        self.serial_plot_frame = ttk.Frame(plot_row_frame)
+        self.serial_plot_frame.grid(row=0, column=0, sticky='nsew')
+        # the plot itself is created by the controller when receiving first starts
+        self.plot_placeholder = ttk.Label(self.serial_plot_frame, text="The signal plot appears when receiving starts.", anchor=tk.CENTER)
+        self.plot_placeholder.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+        # the spectrum panel is created by the controller the first time it is shown
+        self.spectrum_frame = ttk.Frame(plot_row_frame)
+
+        # === Status Bar ===
+        self.memory_state_label = ttk.Label(main_frame, text="Memory: n/a")
+        self.memory_state_label.grid(row=9, column=0, sticky='w', pady=(5, 0))
+        self.export_state_label = ttk.Label(main_frame, text="")
+        self.export_state_label.grid(row=9, column=0, sticky='e', pady=(5, 0))
 
 
     # ============================================
@@ -168,6 +384,43 @@ class AppGUI:
             var.set("no options")
             menu.config(state="disabled")
     
+    def set_acquisition_process_state(self, is_separate):
+        """Disable the menu entries that need the samples and frames in this process while acquisition runs in its own."""
+        state = "disabled" if is_separate else "normal"
+        for index in (self.spectrum_menu_index, self.trigger_settings_menu_index, self.trigger_armed_menu_index,
+                      self.camera_activity_menu_index):
+            self.tools_menu.entryconfig(index, state=state)
+
+    def set_tracing_state(self, is_tracing):
+        """Update the tracing menu entry."""
+        label = "Stop Tracing & Export" if is_tracing else "Start Tracing"
+        self.tools_menu.entryconfig(self.tracing_menu_index, label=label)
+
+    def set_profiling_state(self, is_profiling):
+        """Update the profiling menu entry."""
+        if is_profiling:
+            self.tools_menu.entryconfig(self.profiling_menu_index, label="Profiling...", state="disabled")
+        else:
+            self.tools_menu.entryconfig(self.profiling_menu_index, label="Profile for 10 s", state="normal")
+
+    def set_spectrum_visible(self, is_visible):
+        """Show or hide the spectrum panel next to the signal plot."""
+        if is_visible:
+            self.spectrum_frame.grid(row=0, column=1, sticky='nsew', padx=(5, 0))
+        else:
+            self.spectrum_frame.grid_remove()
+
+    def update_memory_state(self, text, color="black"):
+        """Update the memory footprint label."""
+        self.memory_state_label.config(text=text, foreground=color)
+
+    def remove_plot_placeholder(self):
+        self.plot_placeholder.destroy()
+
+    def update_export_state(self, text, color="black"):
+        """Update the batch export progress label."""
+        self.export_state_label.config(text=text, foreground=color)
+
     def update_camera_state(self, text, color="black"):
         """Update the camera state label."""
         self.camera_state_label.config(text=text, foreground=color)
@@ -204,11 +457,46 @@ class AppGUI:
         self.update_dropdown_menu(panel.resolution_menu, panel.selected_resolution_var, res_list, default_res)
 
     def display_camera_image(self, camera_id, image):
-        """Display a camera image on the corresponding canvas."""
+        """Display a camera image on the corresponding canvas, below its region of interest."""
         canvas = self.get_camera_canvas(camera_id)
-        canvas.create_image(0, 0, image=image, anchor=tk.NW)
+        image_items = canvas.find_withtag("frame")
+        if image_items:
+            canvas.itemconfig(image_items[0], image=image)
+        else:
+            canvas.create_image(0, 0, image=image, anchor=tk.NW, tags="frame")
+            self._draw_roi(camera_id)
         canvas.image = image
 
+    def _start_roi(self, camera_id, event):
+        self.roi_start = (event.x, event.y)
+
+    def _drag_roi(self, camera_id, event):
+        canvas = self.get_camera_canvas(camera_id)
+        canvas.delete("roi")
+        canvas.create_rectangle(*self.roi_start, event.x, event.y, outline="yellow", dash=(4, 2), tags="roi")
+
+    def _finish_roi(self, camera_id, event):
+        """Hand the dragged region to the controller as fractions of the preview, or None after a click."""
+        canvas = self.get_camera_canvas(camera_id)
+        width, height = canvas.winfo_width(), canvas.winfo_height()
+        (x0, x1), (y0, y1) = sorted((self.roi_start[0], event.x)), sorted((self.roi_start[1], event.y))
+        if x1 - x0 < self.MIN_ROI_PIXELS or y1 - y0 < self.MIN_ROI_PIXELS or min(width, height) <= 1:
+            roi = None
+        else:
+            roi = (max(0.0, x0 / width), max(0.0, y0 / height), min(1.0, x1 / width), min(1.0, y1 / height))
+        self.roi_fractions[camera_id] = roi
+        self.controller.set_recording_roi(camera_id, roi)
+        self._draw_roi(camera_id)
+
+    def _draw_roi(self, camera_id):
+        canvas = self.get_camera_canvas(camera_id)
+        canvas.delete("roi")
+        roi = self.roi_fractions.get(camera_id)
+        if roi is not None:
+            width, height = canvas.winfo_width(), canvas.winfo_height()
+            canvas.create_rectangle(roi[0] * width, roi[1] * height, roi[2] * width, roi[3] * height,
+                                    outline="yellow", dash=(4, 2), tags="roi")
+
     def set_camera_preview_state(self, is_previewing):
         """Update the GUI based on the camera preview state."""
         if is_previewing:
@@ -253,12 +541,21 @@ class AppGUI:
     def update_serial_port_menu(self, port_list):
         """Update the serial port selection menu."""
         self.update_dropdown_menu(self.serial_port_menu, self.serial_port_var, port_list)
+        # keep the check of ports that are still there
+        self.additional_port_vars = {port: self.additional_port_vars.get(port) or tk.BooleanVar(value=False) for port in port_list}
+        self.additional_ports_menu.delete(0, "end")
+        for port, var in self.additional_port_vars.items():
+            self.additional_ports_menu.add_checkbutton(label=port, variable=var)
         # enable connect button only if ports are found
         if not port_list:
             self.serial_port_var.set("no ports")
         else:
             self.serial_connect_button.config(state="normal")
 
+    def get_additional_serial_ports(self):
+        """Return the ports checked in the Additional Serial Ports menu."""
+        return [port for port, var in self.additional_port_vars.items() if var.get()]
+
     def set_serial_controls_state(self, state):
         """Set the state of serial control widgets."""
         # led control widgets
@@ -0,0 +1,177 @@
+import collections
+import os
+import socket
+import struct
+import threading
+import numpy as np
+
+from trace_profiler import tracer
+
+
+# every message is a header (type, channel or camera id, payload length) followed by its payload
+HEADER = struct.Struct('<BBI')
+SAMPLES = 1 # payload: n float64 times, then n float32 values
+MARKER = 2 # payload: one float64 time
+FRAME = 3 # payload: a float64 timestamp, then a JPEG image
+
+
+class _Subscriber:
+    """One connected client, with a bounded queue drained by its own sender thread."""
+
+    def __init__(self, conn, address, max_queued_bytes):
+        self.conn = conn
+        self.address = address
+        self.max_queued_bytes = max_queued_bytes
+        self.messages = collections.deque()
+        self.queued_bytes = 0
+        self.dropped_messages = 0
+        self.is_closed = False
+        self.condition = threading.Condition()
+        self.send_thread = threading.Thread(target=self._send_loop, daemon=True)
+        self.send_thread.start()
+
+    def offer(self, message):
+        """Queue a message, or drop it if the client is too far behind."""
+        with self.condition:
+            if self.queued_bytes + len(message) > self.max_queued_bytes:
+                self.dropped_messages += 1
+                return
+            self.messages.append(message)
+            self.queued_bytes += len(message)
+            self.condition.notify()
+
+    def close(self):
+        with self.condition:
+            self.is_closed = True
+            self.condition.notify()
+        try:
+            self.conn.shutdown(socket.SHUT_RDWR) # unblocks a send to a stalled client
+        except OSError:
+            pass
+
+    def _send_loop(self):
+        """Send queued messages until the client goes away or the subscriber is closed."""
+        while True:
+            with self.condition:
+                while not self.messages and not self.is_closed:
+                    self.condition.wait()
+                if self.is_closed:
+                    break
+                # send everything queued in one call
+                batch = b''.join(self.messages)
+                self.messages.clear()
+                self.queued_bytes = 0
+            try:
+                self.conn.sendall(batch)
+            except OSError:
+                break
+        self.is_closed = True
+        self.conn.close()
+
+
+class LivePublisher:
+    """A local endpoint broadcasting live sample blocks, markers and preview frames to any number of subscribers."""
+    """Publishing only queues a message per subscriber; a client that falls behind loses messages, it never slows acquisition."""
+
+    MAX_QUEUED_BYTES = 4 * 1024 * 1024 # per subscriber
+
+    def __init__(self, address=('127.0.0.1', 50007)):
+        """Initialize the publisher on a (host, port) TCP address, or a Unix socket path."""
+        self.address = address
+        self.subscribers = []
+        self.lock = threading.Lock()
+        self.server = None
+        self.accept_thread = None
+
+    def start(self):
+        """Start listening; raises OSError if the address is taken."""
+        if isinstance(self.address, str):
+            if os.path.exists(self.address):
+                os.remove(self.address) # a stale socket of an earlier run
+            self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(self.address)
+        self.server.listen()
+        self.accept_thread = threading.Thread(target=self._accept_loop, daemon=True)
+        self.accept_thread.start()
+
+    def stop(self):
+        """Stop listening and disconnect every subscriber."""
+        if self.server is None:
+            return
+        try:
+            self.server.shutdown(socket.SHUT_RDWR) # wakes the blocked accept on Linux
+        except OSError:
+            pass
+        self.server.close() # ends the accept loop
+        self.accept_thread.join()
+        self.server = None
+        with self.lock:
+            for subscriber in self.subscribers:
+                subscriber.close()
+            self.subscribers = []
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)
+
+    def _accept_loop(self):
+        while True:
+            try:
+                conn, address = self.server.accept()
+            except OSError:
+                break
+            if conn.family != socket.AF_UNIX:
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            with self.lock:
+                self.subscribers.append(_Subscriber(conn, address, self.MAX_QUEUED_BYTES))
+
+    def has_subscribers(self):
+        return bool(self.subscribers)
+
+    def get_footprint(self):
+        """Return the number of bytes queued for all subscribers."""
+        return sum(subscriber.queued_bytes for subscriber in self.subscribers)
+
+    def get_dropped_messages(self):
+        """Return the number of messages dropped for slow subscribers that are still connected."""
+        return sum(subscriber.dropped_messages for subscriber in self.subscribers)
+
+    def _broadcast(self, kind, channel, payload):
+        """Queue one message for every subscriber, forgetting those that disconnected."""
+        if not self.subscribers:
+            return
+        with tracer.span("publish"):
+            message = HEADER.pack(kind, channel, len(payload)) + payload
+            with self.lock:
+                self.subscribers = [subscriber for subscriber in self.subscribers if not subscriber.is_closed]
+                for subscriber in self.subscribers:
+                    subscriber.offer(message)
+
+    def publish_samples(self, channel, times, values):
+        """Publish a channel's block of (times, values) arrays."""
+        if len(times):
+            self._broadcast(SAMPLES, channel, np.asarray(times, dtype='<f8').tobytes() + np.asarray(values, dtype='<f4').tobytes())
+
+    def publish_marker(self, marker_time):
+        self._broadcast(MARKER, 0, struct.pack('<d', marker_time))
+
+    def publish_frame(self, cam_id, timestamp, jpeg_bytes):
+        """Publish a JPEG encoded preview frame of a camera."""
+        self._broadcast(FRAME, cam_id, struct.pack('<d', timestamp) + jpeg_bytes)
+
+
+def read_messages(sock):
+    """Yield (kind, channel, payload) from a subscriber socket, e.g. in a client script; ends when the socket closes."""
+    buffer = b''
+    while True:
+        data = sock.recv(65536)
+        if not data:
+            return
+        buffer += data
+        while len(buffer) >= HEADER.size:
+            kind, channel, length = HEADER.unpack_from(buffer)
+            if len(buffer) < HEADER.size + length:
+                break
+            yield kind, channel, buffer[HEADER.size:HEADER.size + length]
+            buffer = buffer[HEADER.size + length:]
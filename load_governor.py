@@ -0,0 +1,76 @@
+import time
+
+
+class LoadGovernor:
+    """Shed optional work in a fixed priority order while the application falls behind, and restore it once it has caught up."""
+    """Load probes report 1.0 at their limit; only the registered steps are ever shed, never recorded frames or logged samples."""
+
+    HIGH_LOAD = 1.0 # a probe at or above this sheds the next step
+    LOW_LOAD = 0.5 # all probes below this for RESTORE_SECONDS restore the last step shed
+    SHED_COOLDOWN = 2.0 # seconds a step is given to take effect before the next one is shed
+    RESTORE_SECONDS = 10.0
+
+    def __init__(self):
+        """Initialize the governor with no steps or probes."""
+        self.steps = [] # [(description, shed, restore)], in the order they are shed
+        self.probes = {} # {name: callback returning the load}
+        self.level = 0 # number of steps shed
+        self.last_change_time = None
+        self.calm_since = None
+
+    def add_step(self, description, shed, restore):
+        """Append a step to the shedding order; shed() and restore() are called on the thread calling check()."""
+        self.steps.append((description, shed, restore))
+
+    def register_probe(self, name, load_callback):
+        self.probes[name] = load_callback
+
+    def unregister_probe(self, name):
+        self.probes.pop(name, None)
+
+    def get_load(self):
+        """Return (load, probe name) of the most loaded probe."""
+        loads = [(callback(), name) for name, callback in list(self.probes.items())]
+        return max(loads, default=(0.0, None))
+
+    def check(self, now=None):
+        """Shed or restore at most one step according to the current load; returns the message logged, or None."""
+        now = time.monotonic() if now is None else now
+        load, probe = self.get_load()
+        is_cooling_down = self.last_change_time is not None and now - self.last_change_time < self.SHED_COOLDOWN
+        if load >= self.HIGH_LOAD:
+            self.calm_since = None
+            if self.level == len(self.steps) or is_cooling_down:
+                return None
+            description, shed, _ = self.steps[self.level]
+            shed()
+            self.level += 1
+            return self._log(now, f"shed {self.level}/{len(self.steps)}: {description} ({probe} at {load:.0%} of its limit)")
+        if load >= self.LOW_LOAD or self.level == 0:
+            self.calm_since = None
+            return None
+        if self.calm_since is None:
+            self.calm_since = now
+        if now - self.calm_since < self.RESTORE_SECONDS:
+            return None
+        self.level -= 1
+        description, _, restore = self.steps[self.level]
+        restore()
+        self.calm_since = now # wait as long again before restoring the next step
+        return self._log(now, f"restored {self.level + 1}/{len(self.steps)}: {description} ({probe or 'load'} at {load:.0%})")
+
+    def restore_all(self):
+        """Restore every step shed, e.g. when the governor is turned off."""
+        while self.level:
+            self.level -= 1
+            self.steps[self.level][2]()
+        self.calm_since = None
+
+    def _log(self, now, message):
+        self.last_change_time = now
+        print(f"load governor: {message}")
+        return message
+
+    def format_state(self):
+        """Return a short status of the shedding level for the status bar."""
+        return f"Load: {self.level}/{len(self.steps)} shed" if self.level else "Load: OK"
@@ -1,7 +1,9 @@
+import multiprocessing
 import tkinter as tk
 from app_controller import AppController
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support() # the acquisition process starts this executable again when frozen
     root = tk.Tk()
     app = AppController(root)
     root.mainloop()
@@ -0,0 +1,109 @@
+import ctypes
+import os
+import sys
+
+
+def get_process_rss():
+    """Return the resident set size of this process in bytes, or None if it cannot be read."""
+    if sys.platform.startswith('linux'):
+        try:
+            with open('/proc/self/statm') as f:
+                resident_pages = int(f.read().split()[1])
+            return resident_pages * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError, IndexError):
+            return None
+    if sys.platform == 'win32':
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [(name, ctypes.c_size_t) for name in (
+                'cb', 'PageFaultCount', 'PeakWorkingSetSize', 'WorkingSetSize',
+                'QuotaPeakPagedPoolUsage', 'QuotaPagedPoolUsage', 'QuotaPeakNonPagedPoolUsage',
+                'QuotaNonPagedPoolUsage', 'PagefileUsage', 'PeakPagefileUsage')]
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        handle = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(handle, ctypes.byref(counters), counters.cb):
+            return counters.WorkingSetSize
+        return None
+    try:
+        import resource # peak RSS (in bytes on macOS) is the best portable approximation elsewhere
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    except (ImportError, OSError):
+        return None
+
+
+def format_bytes(num_bytes):
+    """Format a byte count as a short human readable string."""
+    for unit in ("B", "KB", "MB"):
+        if abs(num_bytes) < 1024:
+            return f"{num_bytes:.0f} {unit}" if unit == "B" else f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024.0
+    return f"{num_bytes:.2f} GB"
+
+
+class MemoryBudget:
+    """A global memory budget shared out between the growing buffers of the application."""
+    """Each component asks for its share when it is created and reports its footprint back."""
+
+    # fraction of the budget given to each component
+    SHARES = {
+        'video frames': 0.70,
+        'plot samples': 0.25,
+        'log queues': 0.04,
+        'serial parser': 0.01,
+    }
+    # rough cost of one plotted (time, value) sample: deque slot, tuple and two floats
+    BYTES_PER_PLOT_SAMPLE = 8 + 56 + 2 * 24
+    # rough cost of one marker on the plot: its time and, when visible, its segment in the shared collection
+    BYTES_PER_MARKER = 8 + 32
+    MAX_MARKERS = 100000
+
+    def __init__(self, total_bytes=512 * 1024 * 1024):
+        """Initialize the budget with its total size in bytes."""
+        self.total_bytes = total_bytes
+        self.footprint_callbacks = {}
+
+    def get_share(self, component):
+        """Return the number of bytes the component may use."""
+        return int(self.total_bytes * self.SHARES[component])
+
+    def get_frame_buffer_bytes(self, num_recorders):
+        """Return the frame buffer size of each of the given number of recorders."""
+        return self.get_share('video frames') // max(1, num_recorders)
+
+    def get_plot_sample_cap(self, num_channels):
+        """Return the maximum number of buffered plot samples per channel."""
+        return max(1000, self.get_share('plot samples') // (self.BYTES_PER_PLOT_SAMPLE * max(1, num_channels)))
+
+    def get_log_queue_cap(self, num_loggers):
+        """Return the maximum bytes each of the given number of signal loggers may hold waiting for the disk."""
+        return max(1024 * 1024, self.get_share('log queues') // max(1, num_loggers))
+
+    def get_parser_buffer_cap(self):
+        """Return the maximum size of an unparsed serial buffer in bytes."""
+        return max(4096, self.get_share('serial parser'))
+
+    def register(self, name, footprint_callback):
+        """Register a callback returning the current footprint of a component in bytes."""
+        self.footprint_callbacks[name] = footprint_callback
+
+    def unregister(self, name):
+        """Remove a component from the report."""
+        self.footprint_callbacks.pop(name, None)
+
+    def get_report(self):
+        """Return a dict of component name to current footprint in bytes."""
+        report = {}
+        for name, callback in list(self.footprint_callbacks.items()):
+            try:
+                report[name] = callback()
+            except Exception: # a component being torn down must not break the report
+                continue
+        return report
+
+    def format_report(self):
+        """Return a one-line summary of the process RSS and every component's footprint."""
+        rss = get_process_rss()
+        parts = [f"RSS {format_bytes(rss) if rss is not None else 'n/a'} / budget {format_bytes(self.total_bytes)}"]
+        for name, footprint in self.get_report().items():
+            parts.append(f"{name} {format_bytes(footprint)}")
+        return "Memory: " + " | ".join(parts)
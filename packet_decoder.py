@@ -0,0 +1,214 @@
+import binascii
+import re
+import struct
+import numpy as np
+
+
+# binary frames: sync word, channel, flags, sequence number and sample count, then the samples and a CRC16
+BINARY_SYNC = b'\xa5\x5a'
+BINARY_HEADER = struct.Struct('<2sBBHH')
+BINARY_FLAG_SIGNED = 0x01 # int16 samples centered on 0, else uint16 centered on 32767
+BINARY_MAX_SAMPLES = 1024 # a larger count is a false sync
+MAX_SEQUENCE_GAP = 4096 # a larger jump of the sequence number is a device restart, not lost frames
+# two consecutive ASCII packets, e.g. 'H7F-FF-I'
+ASCII_PATTERN = re.compile(rb'[HI](?:[0-9A-Fa-f]{2}-){2,}[HI]')
+VOLTS_PER_COUNT = 3.6 / 1024
+
+
+def crc16(data):
+    """Return the CRC-16/CCITT-FALSE (polynomial 0x1021, initial value 0xFFFF) of data."""
+    return binascii.crc_hqx(data, 0xFFFF)
+
+
+def encode_binary_frame(channel, sequence, samples, signed=False):
+    """Return a binary frame carrying the integer samples of a channel, e.g. for a device simulator."""
+    payload = np.asarray(samples, dtype='<i2' if signed else '<u2').tobytes()
+    body = BINARY_HEADER.pack(BINARY_SYNC, channel, BINARY_FLAG_SIGNED if signed else 0, sequence & 0xFFFF, len(samples)) + payload
+    return body + struct.pack('<H', crc16(body[len(BINARY_SYNC):]))
+
+
+class PacketDecoder:
+    """Decode the packet stream of the device into (channel, value) samples."""
+    """ASCII packets start with 'H' (CH 1) or 'I' (CH 2) followed by hex byte pairs; binary frames carry 16-bit samples and a CRC16."""
+
+    BYTES_PER_SAMPLE = {'ascii': 6, 'binary': 2}
+
+    def __init__(self, max_buffer_bytes=1024 * 1024, protocol=None):
+        """Initialize the decoder with a hard cap on the size of the unparsed buffer; protocol None detects it."""
+        self.buffer = b''
+        self.max_buffer_bytes = max_buffer_bytes
+        self.protocol = protocol # 'ascii', 'binary' or None until detected
+        self.resync_count = 0
+        self.dropped_bytes = 0
+        self.crc_errors = 0
+        self.lost_frames = 0 # binary frames missing from the sequence numbers
+        self.last_sequences = {}
+
+    def reset(self):
+        """Discard any partially received packet; the detected framing is kept."""
+        self.buffer = b''
+        self.last_sequences = {}
+
+    def forget_protocol(self):
+        """Detect the framing again, e.g. when another device is connected."""
+        self.reset()
+        self.protocol = None
+
+    def get_footprint(self):
+        """Return the number of bytes held in the unparsed buffer."""
+        return len(self.buffer)
+
+    def get_bytes_per_sample(self):
+        """Return the wire bytes per sample of the detected framing (ASCII until one is detected)."""
+        return self.BYTES_PER_SAMPLE[self.protocol or 'ascii']
+
+    def _find_delimiter(self, start):
+        """Return (position, channel) of the first 'H' or 'I' at or after start, or (-1, 0)."""
+        h_pos = self.buffer.find(b'H', start)
+        i_pos = self.buffer.find(b'I', start)
+        if h_pos != -1 and (i_pos == -1 or h_pos < i_pos):
+            return h_pos, 1
+        if i_pos != -1:
+            return i_pos, 2
+        return -1, 0
+
+    def feed(self, data_bytes):
+        """Append raw bytes and return the (channels, values) arrays of all complete packets."""
+        self.buffer += data_bytes
+        if self.protocol is None:
+            self.protocol = self._detect_protocol()
+        if self.protocol == 'binary':
+            channels, values = self._feed_binary()
+        elif self.protocol == 'ascii':
+            channels, values = self._feed_ascii()
+        else:
+            channels, values = np.empty(0, dtype=np.int64), np.empty(0)
+        # resync if the delimiters went missing and the buffer outgrew its cap
+        if len(self.buffer) > self.max_buffer_bytes:
+            self._resync()
+        return channels, values
+
+    def _detect_protocol(self):
+        """Return the framing of the buffered stream, or None while it is not clear yet."""
+        start = self.buffer.find(BINARY_SYNC)
+        while start != -1:
+            if self._check_binary_frame(start):
+                return 'binary'
+            start = self.buffer.find(BINARY_SYNC, start + 1)
+        if ASCII_PATTERN.search(self.buffer):
+            return 'ascii'
+        return None
+
+    def _check_binary_frame(self, start):
+        """Return the end of the valid binary frame at start, 0 for an invalid one, or None if it is incomplete."""
+        if len(self.buffer) - start < BINARY_HEADER.size:
+            return None
+        count = BINARY_HEADER.unpack_from(self.buffer, start)[4]
+        if count > BINARY_MAX_SAMPLES:
+            return 0
+        end = start + BINARY_HEADER.size + 2 * count + 2
+        if len(self.buffer) < end:
+            return None
+        crc = int.from_bytes(self.buffer[end - 2:end], 'little')
+        return end if crc16(self.buffer[start + len(BINARY_SYNC):end - 2]) == crc else 0
+
+    def _feed_ascii(self):
+        """Decode the complete ASCII packets of the buffer."""
+        points = []
+        consumed = 0
+        start_pos, channel = self._find_delimiter(0)
+        while start_pos != -1:
+            # a packet ends where the next one starts
+            end_pos, next_channel = self._find_delimiter(start_pos + 1)
+            if end_pos == -1:
+                consumed = start_pos # keep the incomplete packet for the next batch
+                break
+            self._decode_payload(self.buffer[start_pos + 1 : end_pos], channel, points)
+            consumed = end_pos
+            start_pos, channel = end_pos, next_channel
+        if start_pos == -1:
+            consumed = len(self.buffer) # no delimiter left, nothing worth keeping
+        self.buffer = self.buffer[consumed:]
+        channels = np.fromiter((ch for ch, _ in points), dtype=np.int64, count=len(points))
+        values = np.fromiter((value for _, value in points), dtype=float, count=len(points))
+        return channels, values
+
+    def _feed_binary(self):
+        """Decode the complete binary frames of the buffer, reading each frame's samples with np.frombuffer."""
+        channel_blocks, value_blocks = [], []
+        position = 0
+        while True:
+            start = self.buffer.find(BINARY_SYNC, position)
+            if start == -1:
+                # keep a last byte that may be the first half of a sync word
+                keep_from = max(position, len(self.buffer) - 1)
+                self.dropped_bytes += keep_from - position
+                position = keep_from
+                break
+            self.dropped_bytes += start - position
+            end = self._check_binary_frame(start)
+            if end is None:
+                position = start # keep the incomplete frame for the next batch
+                break
+            if not end:
+                self.crc_errors += 1
+                position = start + 1
+                continue
+            _, channel, flags, sequence, count = BINARY_HEADER.unpack_from(self.buffer, start)
+            is_signed = flags & BINARY_FLAG_SIGNED
+            samples = np.frombuffer(self.buffer, dtype='<i2' if is_signed else '<u2', count=count, offset=start + BINARY_HEADER.size)
+            channel_blocks.append(np.full(count, channel, dtype=np.int64))
+            value_blocks.append((samples - (0.0 if is_signed else 32767.0)) * VOLTS_PER_COUNT)
+            self._count_lost_frames(channel, sequence)
+            position = end
+        self.buffer = self.buffer[position:]
+        if not channel_blocks:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        return np.concatenate(channel_blocks), np.concatenate(value_blocks)
+
+    def _count_lost_frames(self, channel, sequence):
+        """Count the frames skipped before this sequence number of a channel."""
+        """A repeated or slightly older number is a duplicate or reordered frame and counts nothing."""
+        last_sequence = self.last_sequences.get(channel)
+        step = (sequence - last_sequence) & 0xFFFF if last_sequence is not None else 1
+        if step == 0 or step > 0x10000 - MAX_SEQUENCE_GAP:
+            return # keep the newest number, so the frames after it are not counted twice
+        if step <= MAX_SEQUENCE_GAP:
+            self.lost_frames += step - 1
+        self.last_sequences[channel] = sequence
+
+    def _resync(self):
+        """Drop the oversized buffer up to the last delimiter so parsing can restart there."""
+        if self.protocol == 'binary':
+            last_pos = self.buffer.rfind(BINARY_SYNC)
+        else:
+            last_pos = max(self.buffer.rfind(b'H'), self.buffer.rfind(b'I'))
+        keep_from = last_pos if last_pos > 0 else len(self.buffer)
+        if len(self.buffer) - keep_from > self.max_buffer_bytes:
+            keep_from = len(self.buffer) # even the last packet is too long to be valid
+        self.dropped_bytes += keep_from
+        self.resync_count += 1
+        self.buffer = self.buffer[keep_from:]
+        print(f"warning: serial buffer exceeded {self.max_buffer_bytes} bytes, resynchronized")
+
+    @staticmethod
+    def _decode_payload(payload_bytes, channel, points):
+        """Decode one packet payload and append its samples to points."""
+        try:
+            payload_str = payload_bytes.decode('ascii')
+        except UnicodeDecodeError:
+            return
+        parts = payload_str.rstrip('-').split('-') # split by '-'
+        if not parts or (len(parts) == 1 and parts[0] == ''): # check if parts is empty
+            return
+        if len(parts) % 2 != 0: # if parts length is odd, skip this packet
+            return
+        # decode the hex values and calculate the processed value
+        for i in range(0, len(parts), 2):
+            hex_str = parts[i] + parts[i+1]
+            try:
+                value_raw = int(hex_str, 16)
+            except ValueError:
+                continue
+            value_processed = (value_raw - 32767) * 3.6 / 1024
+            points.append((channel, value_processed))
@@ -1,16 +1,119 @@
+import itertools
+import threading
+import time
 import tkinter as tk
+from matplotlib.collections import LineCollection
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import numpy as np
 from collections import deque
 
+from trace_profiler import tracer
+
+
+class TracedFigureCanvas(FigureCanvasTkAgg):
+    """A FigureCanvasTkAgg whose deferred draws are recorded as 'plot render' spans and timed."""
+
+    last_draw_seconds = 0.0
+
+    def draw(self):
+        start = time.perf_counter()
+        with tracer.span("plot render"):
+            super().draw()
+        self.last_draw_seconds = time.perf_counter() - start
+
+
+class WindowStats:
+    """Running statistics of one channel's plotted window, kept per appended block instead of per sample."""
+    """Append and trim are amortized O(1) per block: min and max come from monotonic deques of block extremes,
+    mean and RMS from running sums; a block leaves the window once its last sample does, so the statistics may
+    include the older part of the block straddling the window's start (a batch, i.e. a few milliseconds of samples)."""
+    """The reader thread appends and trims while the GUI thread reads, so both hold the lock; read with get_summary()."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.blocks = deque() # (sequence, last time, count, sum, sum of squares)
+        self.max_blocks = deque() # (sequence, maximum), maxima decreasing from the left
+        self.min_blocks = deque() # (sequence, minimum), minima increasing from the left
+        self.next_sequence = 0
+        self.count = 0
+        self.sum = 0.0
+        self.sum_squares = 0.0
+        self.latest_time = None
+
+    def append(self, times, values):
+        """Add a block of (times, values) arrays."""
+        if not len(values):
+            return
+        block_sum, block_squares = float(np.sum(values)), float(np.dot(values, values))
+        maximum, minimum = float(np.max(values)), float(np.min(values))
+        with self.lock:
+            self._append(float(times[-1]), len(values), block_sum, block_squares, maximum, minimum)
+
+    def _append(self, last_time, count, block_sum, block_squares, maximum, minimum):
+        sequence = self.next_sequence
+        self.next_sequence += 1
+        self.blocks.append((sequence, last_time, count, block_sum, block_squares))
+        self.count += count
+        self.sum += block_sum
+        self.sum_squares += block_squares
+        self.latest_time = last_time
+        while self.max_blocks and self.max_blocks[-1][1] <= maximum:
+            self.max_blocks.pop()
+        self.max_blocks.append((sequence, maximum))
+        while self.min_blocks and self.min_blocks[-1][1] >= minimum:
+            self.min_blocks.pop()
+        self.min_blocks.append((sequence, minimum))
+
+    def trim(self, oldest_time):
+        """Drop the blocks whose samples all lie before oldest_time, the time of the oldest plotted sample."""
+        with self.lock:
+            self._trim(oldest_time)
+
+    def _trim(self, oldest_time):
+        while self.blocks and self.blocks[0][1] < oldest_time:
+            sequence, _, count, block_sum, block_squares = self.blocks.popleft()
+            self.count -= count
+            self.sum -= block_sum
+            self.sum_squares -= block_squares
+            if self.max_blocks[0][0] == sequence:
+                self.max_blocks.popleft()
+            if self.min_blocks[0][0] == sequence:
+                self.min_blocks.popleft()
+        if not self.blocks:
+            self._clear() # also resets the rounding error of the running sums
+
+    def clear(self):
+        with self.lock:
+            self._clear()
+
+    def _clear(self):
+        self.blocks.clear()
+        self.max_blocks.clear()
+        self.min_blocks.clear()
+        self.count = 0
+        self.sum = 0.0
+        self.sum_squares = 0.0
+        self.latest_time = None
+
+    def get_summary(self):
+        """Return a consistent (count, latest time, min, max, mean, rms) of the window, or None while it is empty."""
+        with self.lock:
+            if not self.count:
+                return None
+            return (self.count, self.latest_time, self.min_blocks[0][1], self.max_blocks[0][1], self.sum / self.count,
+                    np.sqrt(max(self.sum_squares, 0.0) / self.count))
+
 
 class PlotManager:
     """Manage a Matplotlib plot embedded in a Tkinter frame."""
-    """Handle real-time data plotting for 2 channels. """
+    """Handle real-time data plotting for CH 1 and CH 2, and for the channels of additional devices as they appear. """
 
-    def __init__(self, parent_frame):
-        """Initialize the PlotManager."""
+    # line colors of CH 1, CH 2, ...; the channels of later devices reuse them
+    CHANNEL_COLORS = ('royalblue', 'orangered', 'seagreen', 'darkorchid', 'goldenrod', 'teal', 'saddlebrown', 'crimson')
+
+    def __init__(self, parent_frame, max_points=None, max_markers=None, show_readouts=False):
+        """Initialize the PlotManager; show_readouts adds a live line of each channel's window statistics below the plot."""
         self.fig = Figure(figsize=(8, 3), dpi=90)
         self.ax = self.fig.add_subplot()
         # --- Plot Aesthetics ---
@@ -20,100 +123,210 @@ class PlotManager:
         self.ax.set_facecolor('#f0f0f0')
         # --- Data Buffers ---
         self.max_time_span = 180.0
-        self.data_ch1 = deque()
-        self.data_ch2 = deque()
+        self.max_points = max_points # per channel, None for no sample cap
+        self.decimation = 1 # every n-th buffered sample is drawn
+        self.data = {1: deque(maxlen=max_points), 2: deque(maxlen=max_points)}
+        self.data_lock = threading.Lock() # the reader thread fills the buffers while the GUI thread draws and resizes them
+        self.stats = {channel: WindowStats() for channel in self.data} # autoscale and readouts, without a pass over the data
+        self.labels = {} # legend labels other than 'CH n'
         # --- Marker Management ---
-        self.markers = deque() # time stamps
-        self.marker_lines = deque() # line objects
+        # all markers are one artist: a sorted array of times, drawn as the segments inside the X-axis range
+        self.max_markers = max_markers
+        self.marker_times = np.empty(0)
+        self.marker_collection = LineCollection([], colors='r', linestyles='--', linewidths=1.5,
+                                                transform=self.ax.get_xaxis_transform()) # x in data, y in axes units
+        self.ax.add_collection(self.marker_collection, autolim=False)
+        self.visible_markers = (0, 0) # index range of the drawn segments
         # --- Plot Lines---
-        self.line1, = self.ax.plot([], [], 'royalblue', label="CH 1")
-        self.line2, = self.ax.plot([], [], 'orangered', label="CH 2")
-        self.ax.legend(loc='upper right')
+        self.lines = {}
+        for channel in self.data:
+            self._add_line(channel)
         # --- Axis Configuration ---
         self.ax.set_xlim(0, self.max_time_span)
         self.ax.set_ylim(-0.5, 3.5)
         # --- Embed Plot in Tkinter ---
-        self.canvas = FigureCanvasTkAgg(self.fig, master=parent_frame)
+        self.canvas = TracedFigureCanvas(self.fig, master=parent_frame)
         self.canvas_widget = self.canvas.get_tk_widget()
         self.canvas_widget.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+        self.readout_label = None
+        if show_readouts:
+            self.readout_label = tk.Label(parent_frame, text="", font=("Courier", 9), anchor=tk.W, justify=tk.LEFT)
+            self.readout_label.pack(side=tk.BOTTOM, fill=tk.X)
+        self.ax.callbacks.connect('xlim_changed', lambda ax: self._update_marker_segments())
         self.fig.tight_layout()
 
+    def _add_line(self, channel):
+        """Create the line of a channel and list it in the legend."""
+        color = self.CHANNEL_COLORS[(channel - 1) % len(self.CHANNEL_COLORS)]
+        self.lines[channel], = self.ax.plot([], [], color, label=self.labels.get(channel, f"CH {channel}"))
+        self.ax.legend(loc='upper right')
+
+    def set_channel_label(self, channel, label):
+        """Name a channel in the legend, e.g. a channel that is not a serial one."""
+        self.labels[channel] = label
+        if channel in self.lines:
+            self.lines[channel].set_label(label)
+            self.ax.legend(loc='upper right')
+
+    def _get_channel_data(self, channel):
+        """Return the buffer of a channel, adding the channel on first use; its line is created by the next update_plot."""
+        """This runs on the serial reader thread, so no Matplotlib artist may be created here; call it under data_lock."""
+        data = self.data.get(channel)
+        if data is None:
+            data = self.data[channel] = deque(maxlen=self.max_points)
+            self.stats[channel] = WindowStats()
+        return data
+
     def add_marker(self, time):
         """Add a visual marker (a vertical red line) at a specific time point."""
-        self.markers.append(time)
-        line = self.ax.axvline(x=time, color='r', linestyle='--', linewidth=1.5)
-        self.marker_lines.append(line)
+        self.marker_times = np.insert(self.marker_times, np.searchsorted(self.marker_times, time, side='right'), time)
+        # drop the oldest markers beyond the cap
+        if self.max_markers is not None and len(self.marker_times) > self.max_markers:
+            self.marker_times = self.marker_times[-self.max_markers:]
+        self._update_marker_segments(is_forced=True)
+
+    def set_markers(self, times):
+        """Replace all markers, e.g. with the markers of a recorded session."""
+        self.marker_times = np.sort(np.asarray(times, dtype=float))
+        if self.max_markers is not None:
+            self.marker_times = self.marker_times[-self.max_markers:]
+        self._update_marker_segments(is_forced=True)
+
+    def _update_marker_segments(self, is_forced=False):
+        """Draw the markers inside the X-axis range, found by bisection; nothing is rebuilt if that set is unchanged."""
+        x_min, x_max = self.ax.get_xlim()
+        visible = (int(np.searchsorted(self.marker_times, x_min, side='left')),
+                   int(np.searchsorted(self.marker_times, x_max, side='right')))
+        if visible == self.visible_markers and not is_forced:
+            return
+        self.visible_markers = visible
+        times = self.marker_times[visible[0]:visible[1]]
+        segments = np.empty((len(times), 2, 2))
+        segments[:, :, 0] = times[:, None]
+        segments[:, 0, 1], segments[:, 1, 1] = 0.0, 1.0
+        self.marker_collection.set_segments(segments)
+
+    def set_max_points(self, max_points):
+        """Change the per-channel sample cap, keeping the most recent samples."""
+        with self.data_lock:
+            self.max_points = max_points
+            self.data = {channel: deque(data, maxlen=max_points) for channel, data in self.data.items()}
+            for channel, data in self.data.items():
+                if data:
+                    self.stats[channel].trim(data[0][0])
+
+    def set_decimation(self, step):
+        """Draw only every step-th sample of the live buffers; the statistics and axis limits still use them all."""
+        self.decimation = max(1, int(step))
+
+    def set_channel_data(self, channel, times, values):
+        """Show a fixed set of samples on a channel's line, bypassing the live buffers."""
+        with self.data_lock:
+            self._get_channel_data(channel)
+        if channel not in self.lines:
+            self._add_line(channel)
+        self.lines[channel].set_data(times, values)
+
+    def get_num_samples(self):
+        """Return the number of buffered samples of all channels."""
+        with self.data_lock:
+            return sum(len(data) for data in self.data.values())
+
+    def get_num_markers(self):
+        """Return the number of markers kept."""
+        return len(self.marker_times)
 
     def add_data_point(self, channel, time, value):
         """Add a new (time, value) data point to the appropriate channel's deque."""
-        if channel == 1:
-            self.data_ch1.append((time, value))
-            # remove old data points if they exceed the max time span
-            while self.data_ch1[-1][0] - self.data_ch1[0][0] > self.max_time_span:
-                self.data_ch1.popleft()
-        elif channel == 2:
-            self.data_ch2.append((time, value))
-            while self.data_ch2[-1][0] - self.data_ch2[0][0] > self.max_time_span:
-                self.data_ch2.popleft()
+        self.add_data_points(channel, np.array([time]), np.array([value]))
+
+    def add_data_points(self, channel, times, values):
+        """Add a batch of (time, value) data points to the appropriate channel's deque."""
+        if not len(times):
+            return
+        rows = list(zip(times.tolist(), values.tolist()))
+        with self.data_lock:
+            data = self._get_channel_data(channel)
+            data.extend(rows)
+            while data[-1][0] - data[0][0] > self.max_time_span:
+                data.popleft()
+            stats = self.stats[channel]
+            stats.append(times, values)
+            stats.trim(data[0][0])
 
     def update_plot(self):
         """Redraw the plot, updating both data and axis limits dynamically."""
-        # 1. Update the data lines
-        if self.data_ch1:
-            t1, v1 = zip(*self.data_ch1)
-            self.line1.set_data(t1, v1)
-        else:
-            self.line1.set_data([], [])
-
-        if self.data_ch2:
-            t2, v2 = zip(*self.data_ch2)
-            self.line2.set_data(t2, v2)
-        else:
-            self.line2.set_data([], [])
-        # 2. Update the X-axis limits
-        all_times = [item[0] for item in self.data_ch1] + [item[0] for item in self.data_ch2]
-        if all_times:
-            latest_time = max(all_times)
-            if latest_time <= self.max_time_span:
-                # static phase: keep the X-axis fixed
-                if self.ax.get_xlim() != (0, self.max_time_span):
-                    self.ax.set_xlim(0, self.max_time_span)
-            else:
-                # dynamic phase: adjust the X-axis to show the latest data
-                self.ax.set_xlim(latest_time - self.max_time_span, latest_time)
-        # 3. Clean up old markers
-        x_min, _ = self.ax.get_xlim()
-        while self.markers and self.markers[0] < x_min:
-            self.markers.popleft()
-            line_to_remove = self.marker_lines.popleft()
-            line_to_remove.remove()    
-        # 4. Update the Y-axis limits dynamically
-        all_values = [item[1] for item in self.data_ch1] + [item[1] for item in self.data_ch2]
-        if len(all_values) > 1: # at least two points to calculate range
-            min_val = min(all_values)
-            max_val = max(all_values)
-            # calculate the range of the data
-            data_range = max_val - min_val
-            if data_range < 1e-9:
-                margin = 0.2 # if the range is too small, use a fixed margin
-            else:
-                margin = data_range * 0.1 # use 10% of the range as margin
-            # calculate and set new limits
-            new_min = min_val - margin
-            new_max = max_val + margin
-            self.ax.set_ylim(new_min, new_max)
-        self.canvas.draw_idle()
+        with tracer.span("plot update"):
+            # 1. Update the data lines, from a copy taken under the lock so the reader thread is held up only briefly
+            with self.data_lock:
+                snapshots = {channel: list(data if self.decimation == 1 else itertools.islice(data, 0, None, self.decimation))
+                             for channel, data in self.data.items()}
+            for channel, rows in snapshots.items():
+                if channel not in self.lines: # a channel added by the reader thread since the last update
+                    self._add_line(channel)
+                if rows:
+                    times, values = zip(*rows)
+                    self.lines[channel].set_data(times, values)
+                else:
+                    self.lines[channel].set_data([], [])
+            # 2. Update the X-axis limits
+            summaries = [summary for summary in (stats.get_summary() for stats in list(self.stats.values())) if summary]
+            if summaries:
+                latest_time = max(summary[1] for summary in summaries)
+                if latest_time <= self.max_time_span:
+                    # static phase: keep the X-axis fixed
+                    if self.ax.get_xlim() != (0, self.max_time_span):
+                        self.ax.set_xlim(0, self.max_time_span)
+                else:
+                    # dynamic phase: adjust the X-axis to show the latest data
+                    self.ax.set_xlim(latest_time - self.max_time_span, latest_time)
+            # 3. Clean up the markers that scrolled out of the window
+            x_min, _ = self.ax.get_xlim()
+            num_old = int(np.searchsorted(self.marker_times, x_min, side='left'))
+            if num_old:
+                self.marker_times = self.marker_times[num_old:]
+                self._update_marker_segments(is_forced=True)
+            # 4. Update the Y-axis limits dynamically
+            if sum(summary[0] for summary in summaries) > 1: # at least two points to calculate range
+                min_val = min(summary[2] for summary in summaries)
+                max_val = max(summary[3] for summary in summaries)
+                # calculate the range of the data
+                data_range = max_val - min_val
+                if data_range < 1e-9:
+                    margin = 0.2 # if the range is too small, use a fixed margin
+                else:
+                    margin = data_range * 0.1 # use 10% of the range as margin
+                # calculate and set new limits
+                new_min = min_val - margin
+                new_max = max_val + margin
+                self.ax.set_ylim(new_min, new_max)
+            if self.readout_label is not None:
+                self._update_readouts()
+            self.canvas.draw_idle()
+
+    def _update_readouts(self):
+        """Show the mean, RMS, peak-to-peak, min and max of every channel's window."""
+        readouts = []
+        for channel, stats in list(self.stats.items()):
+            summary = stats.get_summary()
+            if summary:
+                _, _, minimum, maximum, mean, rms = summary
+                label = self.labels.get(channel, f"CH {channel}")
+                readouts.append(f"{label}: mean {mean:.3f}  rms {rms:.3f}  p-p {maximum - minimum:.3f}  "
+                                f"min {minimum:.3f}  max {maximum:.3f}")
+        self.readout_label.config(text="\n".join(readouts))
 
     def clear_plot(self):
         """Reset the plot to its initial state."""
-        self.data_ch1.clear()
-        self.data_ch2.clear()
-        for line in self.marker_lines:
-            line.remove()
-        self.markers.clear()
-        self.marker_lines.clear()
-        self.line1.set_data([], [])
-        self.line2.set_data([], [])
+        with self.data_lock:
+            for data in self.data.values():
+                data.clear()
+            for stats in self.stats.values():
+                stats.clear()
+        self.marker_times = np.empty(0)
+        self._update_marker_segments(is_forced=True)
+        for line in self.lines.values():
+            line.set_data([], [])
         self.ax.set_xlim(0, self.max_time_span)
         self.ax.set_ylim(-1, 1)
         self.update_plot()
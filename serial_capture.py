@@ -0,0 +1,200 @@
+import datetime
+import json
+import queue
+import struct
+import sys
+import threading
+import time
+import numpy as np
+
+
+# a text header line, then per chunk: arrival time (s since the capture's time origin), device index, length, bytes
+CAPTURE_MAGIC = b'SERIALCAP1'
+CHUNK_HEADER = struct.Struct('<dBI')
+WRITE_BUFFER_BYTES = 1024 * 1024
+
+
+class SerialCapture:
+    """The raw byte stream of the serial devices teed into a compact capture file, with the arrival time of every read."""
+    """The reader threads only queue their reads; a writer thread of its own does the disk writes, as in SignalLogger."""
+
+    MAX_PENDING_BYTES = 16 * 1024 * 1024
+
+    def __init__(self, filename, time_origin, ports=(), baudrate=None):
+        """Create the capture and start its writer thread; arrival times are stored relative to time_origin (a perf_counter value). Raises OSError."""
+        self.filename = filename
+        self.time_origin = time_origin
+        self.chunk_queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.pending_bytes = 0 # under lock
+        self.dropped_chunks = 0
+        self.is_closed = False
+        self.num_chunks = 0
+        self.num_bytes = 0
+        self.file = open(filename, "wb", buffering=WRITE_BUFFER_BYTES)
+        header = {'started': datetime.datetime.now().isoformat(), 'ports': list(ports), 'baudrate': baudrate}
+        self.file.write(CAPTURE_MAGIC + json.dumps(header).encode('utf-8') + b'\n')
+        self.writer_thread = threading.Thread(target=self._writer_loop, daemon=True)
+        self.writer_thread.start()
+
+    def write(self, device_index, arrival_time, data_bytes):
+        """Queue the bytes of one read of a device, received at arrival_time (a perf_counter value); never blocks."""
+        with self.lock:
+            if self.is_closed:
+                return
+            if self.pending_bytes + len(data_bytes) > self.MAX_PENDING_BYTES:
+                if not self.dropped_chunks:
+                    print(f"warning: the disk cannot keep up with the serial capture {self.filename}, reads are dropped")
+                self.dropped_chunks += 1
+                return
+            self.pending_bytes += len(data_bytes)
+        self.chunk_queue.put((device_index, arrival_time, data_bytes))
+
+    def close(self):
+        """Write everything still queued, close the file and wait for the writer thread."""
+        with self.lock:
+            if self.is_closed:
+                return
+            self.is_closed = True
+        self.chunk_queue.put(None)
+        self.writer_thread.join()
+        if self.dropped_chunks:
+            print(f"warning: {self.dropped_chunks} reads are missing from the serial capture {self.filename}")
+
+    def _writer_loop(self):
+        """Consumer: write the queued reads, each with its chunk header."""
+        while True:
+            item = self.chunk_queue.get()
+            if item is None:
+                break
+            device_index, arrival_time, data_bytes = item
+            with self.lock:
+                self.pending_bytes -= len(data_bytes)
+            if self.file is None:
+                continue # stopped by a write error, drain the queue
+            try:
+                self.file.write(CHUNK_HEADER.pack(arrival_time - self.time_origin, device_index, len(data_bytes)))
+                self.file.write(data_bytes)
+            except OSError as e:
+                print(f"warning: serial capture stopped, cannot write {self.filename}: {e}")
+                self.file.close()
+                self.file = None
+                continue
+            self.num_chunks += 1
+            self.num_bytes += len(data_bytes)
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def _read_header(f):
+    """Return the header dict of a capture file opened for binary reading; raises ValueError if it is not one."""
+    line = f.readline()
+    if not line.startswith(CAPTURE_MAGIC):
+        raise ValueError(f"not a serial capture: {f.name}")
+    return json.loads(line[len(CAPTURE_MAGIC):])
+
+
+def load_capture_header(filename):
+    """Return the header of a capture: {'started', 'ports', 'baudrate'}. Raises OSError or ValueError."""
+    with open(filename, "rb") as f:
+        return _read_header(f)
+
+
+def iter_capture(filename):
+    """Yield the (device index, arrival time, bytes) chunks of a capture in the order they were read."""
+    with open(filename, "rb") as f:
+        _read_header(f)
+        while True:
+            chunk_header = f.read(CHUNK_HEADER.size)
+            if len(chunk_header) < CHUNK_HEADER.size:
+                return # the end, or a capture cut short
+            arrival_time, device_index, length = CHUNK_HEADER.unpack(chunk_header)
+            data_bytes = f.read(length)
+            if len(data_bytes) < length:
+                return
+            yield device_index, arrival_time, data_bytes
+
+
+class SerialReplay:
+    """Feed a capture back to the devices' data callbacks on a thread, in real time (or scaled) or as fast as possible."""
+    """Every chunk carries its recorded arrival time, so the decoded sample times are the same at any speed."""
+
+    def __init__(self, filename, speed=1.0):
+        """Open the capture; speed None replays as fast as possible. Raises OSError or ValueError."""
+        self.filename = filename
+        self.header = load_capture_header(filename)
+        self.speed = speed
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.num_bytes = 0
+        self.seconds = 0.0 # wall time of the last replay
+
+    def get_num_devices(self):
+        """Return the number of devices in the capture."""
+        num_devices = len(self.header.get('ports') or [])
+        if not num_devices:
+            num_devices = 1 + max((device_index for device_index, _, _ in iter_capture(self.filename)), default=0)
+        return num_devices
+
+    def is_playing(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def play(self, callbacks, time_origin):
+        """Start feeding the capture from its beginning; callbacks {device index: callback(bytes, arrival time)}."""
+        self.stop()
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._replay, args=(callbacks, time_origin), daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.thread = None
+
+    def _replay(self, callbacks, time_origin):
+        """Feed every chunk, waiting for its arrival time unless replaying as fast as possible."""
+        start = time.perf_counter()
+        self.num_bytes = 0
+        for device_index, arrival_time, data_bytes in iter_capture(self.filename):
+            if self.stop_event.is_set():
+                break
+            if self.speed is not None:
+                delay = start + arrival_time / self.speed - time.perf_counter()
+                if delay > 0 and self.stop_event.wait(delay):
+                    break
+            callback = callbacks.get(device_index)
+            if callback:
+                callback(data_bytes, time_origin + arrival_time)
+            self.num_bytes += len(data_bytes)
+        self.seconds = time.perf_counter() - start
+
+
+def replay_samples(filename):
+    """Decode a capture as fast as possible; returns the merged (times, channels, values) arrays exactly as a receive would."""
+    from serial_manager import SerialDeviceGroup
+    blocks = []
+    devices = SerialDeviceGroup(samples_received_callback=lambda *block: blocks.append(block))
+    if not devices.connect_replay(filename, speed=None):
+        return np.empty(0), np.empty(0, dtype=np.int64), np.empty(0)
+    devices.start_stream()
+    devices.replay.thread.join()
+    devices.stop_stream()
+    devices.disconnect()
+    if not blocks:
+        return np.empty(0), np.empty(0, dtype=np.int64), np.empty(0)
+    return tuple(np.concatenate(parts) for parts in zip(*blocks))
+
+
+if __name__ == '__main__':
+    # benchmark the decoder and merger on a recorded capture
+    capture_filename = sys.argv[1]
+    replay_start = time.perf_counter()
+    times, channels, values = replay_samples(capture_filename)
+    seconds = time.perf_counter() - replay_start
+    num_bytes = sum(len(data_bytes) for _, _, data_bytes in iter_capture(capture_filename))
+    print(f"{num_bytes / 1e6:.1f} MB, {len(times)} samples in {seconds:.2f} s "
+          f"({num_bytes / 1e6 / max(seconds, 1e-6):.1f} MB/s, {len(times) / max(seconds, 1e-6):.0f} samples/s)")
+    for ch in np.unique(channels):
+        print(f"CH {ch}: {np.count_nonzero(channels == ch)} samples, {times[channels == ch][-1]:.3f} s")
@@ -2,19 +2,29 @@ import serial
 import serial.tools.list_ports
 import threading
 import time
+import numpy as np
+
+from packet_decoder import PacketDecoder
+from serial_capture import SerialCapture, SerialReplay
+from trace_profiler import tracer
 
 
 class SerialManager:
     """Manages serial port communication."""
     """Including finding ports, connecting, and handling reading/writing in a separate thread."""
 
-    def __init__(self, data_received_callback=None):
-        """Initialize the SerialManager."""
+    READ_TIMEOUT = 0.05 # seconds a read waits for the first byte
+
+    def __init__(self, data_received_callback=None, connection_lost_callback=None):
+        """Initialize the SerialManager; connection_lost_callback(error) is called on the reader thread if the port fails."""
         self.serial_port = None
         self.is_connected = False
         self.read_thread = None
         self.stop_thread_event = threading.Event()
         self.data_received_callback = data_received_callback
+        self.connection_lost_callback = connection_lost_callback
+        self.capture = None # a SerialCapture the raw bytes are teed into
+        self.capture_index = 0 # the device index written with them
 
     @staticmethod
     def find_serial_ports():
@@ -27,7 +37,7 @@ class SerialManager:
         if self.is_connected:
             return True
         try:
-            self.serial_port = serial.Serial(port, baudrate, timeout=1)
+            self.serial_port = serial.Serial(port, baudrate, timeout=self.READ_TIMEOUT)
             self.is_connected = True
             # start the reading thread
             self.stop_thread_event.clear()
@@ -43,7 +53,7 @@ class SerialManager:
         if not self.is_connected:
             return
         self.stop_thread_event.set()
-        if self.read_thread:
+        if self.read_thread and self.read_thread is not threading.current_thread():
             self.read_thread.join() # wait for the thread to terminate
         if self.serial_port and self.serial_port.is_open:
             self.serial_port.close()
@@ -53,20 +63,333 @@ class SerialManager:
     def _read_from_port(self):
         """Private method that runs in a thread to continuously read data from the serial port."""
         while not self.stop_thread_event.is_set():
+            tracer.profile_checkpoint()
             try:
-                if self.serial_port and self.serial_port.in_waiting > 0:
-                    # Read all available bytes in the buffer
-                    data_bytes = self.serial_port.read(self.serial_port.in_waiting)
-                    if data_bytes and self.data_received_callback:
-                        # Pass raw bytes to the callback for processing
-                        self.data_received_callback(data_bytes)
-            except serial.SerialException:
+                # block until a byte arrives (or the timeout), then take everything buffered, without polling
+                data_bytes = self.serial_port.read(1)
+                if not data_bytes:
+                    continue
+                with tracer.span("serial read"):
+                    data_bytes += self.serial_port.read(self.serial_port.in_waiting)
+                capture = self.capture
+                if capture is not None:
+                    capture.write(self.capture_index, time.perf_counter(), data_bytes)
+                if self.data_received_callback:
+                    # Pass raw bytes to the callback for processing
+                    self.data_received_callback(data_bytes)
+            except serial.SerialException as e:
                 self.disconnect()
+                if self.connection_lost_callback:
+                    self.connection_lost_callback(e)
                 break
-            time.sleep(0.01)
 
     def send_data(self, data):
         """Send data to the connected serial port."""
         if self.is_connected and self.serial_port:
             self.serial_port.write(data.encode('utf-8'))
 
+
+
+class SerialDevice:
+    """One connected serial device: its reader thread, its packet decoder and the time stamps of its samples."""
+    """Its channels are numbered in the device's namespace: local channel c of device d is global channel 2 * d + c."""
+
+    CHANNELS_PER_DEVICE = 2
+
+    def __init__(self, index, merger, max_buffer_bytes, connection_lost_callback=None):
+        """Initialize the device with its 0-based index and the merger its samples go to."""
+        """connection_lost_callback(index, error) is called on the reader thread if its port fails."""
+        self.index = index
+        self.merger = merger
+        self.connection_lost_callback = connection_lost_callback
+        self.serial_manager = SerialManager(data_received_callback=self.on_data_received, connection_lost_callback=self.on_connection_lost)
+        self.packet_decoder = PacketDecoder(max_buffer_bytes=max_buffer_bytes)
+        self.is_streaming = False
+        self.time_origin = None
+        self.last_receive_time = None
+        self.foreign_samples = 0 # samples of a channel other than CH 1 and CH 2, dropped
+
+    def start_stream(self, time_origin):
+        """Start decoding, with sample times counted from time_origin (a perf_counter value)."""
+        self.packet_decoder.reset()
+        self.time_origin = time_origin
+        self.last_receive_time = time_origin
+        self.foreign_samples = 0
+        self.is_streaming = True
+
+    def on_data_received(self, data_bytes, arrival_time=None):
+        """Decode a batch on the reader thread and hand its time stamped samples to the merger."""
+        """A replayed batch brings its recorded arrival_time (a perf_counter value on the stream's timeline)."""
+        if not self.is_streaming:
+            return
+        current_time = arrival_time if arrival_time is not None else time.perf_counter()
+        with tracer.span("decode"):
+            channels, values = self.packet_decoder.feed(data_bytes)
+        is_local = (channels >= 1) & (channels <= self.CHANNELS_PER_DEVICE)
+        if not is_local.all():
+            # a binary frame can name any channel byte; mapped, it would land in the next device's namespace
+            if not self.foreign_samples:
+                print(f"warning: device {self.index + 1} sends channels other than CH 1 and CH 2, their samples are dropped")
+            self.foreign_samples += int(np.count_nonzero(~is_local))
+            channels, values = channels[is_local], values[is_local]
+        if len(channels):
+            # spread the samples evenly since the previous batch
+            time_step = (current_time - self.last_receive_time) / len(channels)
+            first_time = self.last_receive_time - self.time_origin
+            times = first_time + (np.arange(len(channels)) + 1) * time_step
+            self.merger.push(self.index, times, channels + self.CHANNELS_PER_DEVICE * self.index, values, current_time - self.time_origin)
+        self.last_receive_time = current_time
+
+    def on_connection_lost(self, error):
+        """Stop streaming a device whose port failed, so the merger no longer waits for it."""
+        self.is_streaming = False
+        self.merger.remove_device(self.index)
+        if self.connection_lost_callback:
+            self.connection_lost_callback(self.index, error)
+
+
+class SampleMerger:
+    """Merge the sample blocks of several devices into one time-ordered stream."""
+    """Samples are held until every device has reported past them, or for at most MAX_DELAY seconds when one goes quiet."""
+    """A quiet device's late samples, older than what was passed on meanwhile, are moved up to it to keep the order."""
+
+    MAX_DELAY = 0.25
+
+    def __init__(self, callback):
+        """Initialize the merger; callback(times, channels, values) receives the ordered samples, one call at a time."""
+        self.callback = callback
+        self.lock = threading.Lock()
+        self.pending = []
+        self.last_times = {}
+        self.released_time = 0.0 # no sample at or before it can be passed on any more
+        self.late_samples = 0 # samples moved up to released_time
+
+    def reset(self, device_indices):
+        with self.lock:
+            self.pending = []
+            self.last_times = dict.fromkeys(device_indices, 0.0)
+            self.released_time = 0.0
+            self.late_samples = 0
+
+    def push(self, device_index, times, channels, values, now):
+        """Add a device's block and pass on every sample no device can still precede."""
+        with self.lock:
+            if times[0] < self.released_time:
+                num_late = int(np.searchsorted(times, self.released_time, side='left'))
+                if not self.late_samples:
+                    print(f"warning: device {device_index + 1} reported late, its samples older than the merged stream are moved up")
+                self.late_samples += num_late
+                times = np.maximum(times, self.released_time)
+            self.pending.append((times, channels, values))
+            self.last_times[device_index] = times[-1]
+            if len(self.last_times) == 1: # a single device is already in order
+                blocks, self.pending = self.pending, []
+            else:
+                watermark = max(min(self.last_times.values()), now - self.MAX_DELAY)
+                blocks = self._take_until(watermark)
+                self.released_time = max(self.released_time, watermark)
+            self._pass_on(blocks)
+
+    def remove_device(self, device_index):
+        """Stop waiting for a device, e.g. one whose port failed, and pass on what the others have reported."""
+        with self.lock:
+            if self.last_times.pop(device_index, None) is None:
+                return
+            if self.last_times:
+                watermark = min(self.last_times.values())
+                blocks = self._take_until(watermark)
+                self.released_time = max(self.released_time, watermark)
+            else:
+                blocks, self.pending = self.pending, []
+            self._pass_on(blocks)
+
+    def flush(self):
+        """Pass on every sample still held, e.g. the last blocks once the stream has stopped."""
+        with self.lock:
+            blocks, self.pending = self.pending, []
+            self._pass_on(blocks)
+
+    def _pass_on(self, blocks):
+        """Merge blocks in time order and hand them to the callback; called under the lock."""
+        if not blocks:
+            return
+        times = np.concatenate([block[0] for block in blocks])
+        channels = np.concatenate([block[1] for block in blocks])
+        values = np.concatenate([block[2] for block in blocks])
+        order = np.argsort(times, kind='stable')
+        self.released_time = max(self.released_time, float(times[order[-1]]))
+        # the callback runs under the lock, so the stream reaches it in order
+        self.callback(times[order], channels[order], values[order])
+
+    def _take_until(self, watermark):
+        """Remove and return the pending blocks, split at watermark."""
+        ready, held = [], []
+        for times, channels, values in self.pending:
+            cut = np.searchsorted(times, watermark, side='right')
+            if cut:
+                ready.append((times[:cut], channels[:cut], values[:cut]))
+            if cut < len(times):
+                held.append((times[cut:], channels[cut:], values[cut:]))
+        self.pending = held
+        return ready
+
+
+class SerialDeviceGroup:
+    """Any number of serial devices acquired together into one merged sample stream."""
+    """It has the SerialManager interface; commands are sent to every device, in its own channel namespace."""
+
+    def __init__(self, samples_received_callback=None, max_buffer_bytes=1024 * 1024, connection_lost_callback=None):
+        """Initialize the group; samples_received_callback(times, channels, values) receives the merged stream."""
+        """connection_lost_callback(port, error, is_connected) is called on a reader thread when a port fails;
+        is_connected is False once no device is left."""
+        self.merger = SampleMerger(samples_received_callback)
+        self.connection_lost_callback = connection_lost_callback
+        self.max_buffer_bytes = max_buffer_bytes
+        self.devices = []
+        self.is_connected = False
+        self.baudrate = None
+        self.ports = []
+        self.replay = None # a SerialReplay standing in for the ports
+        self.capture = None
+
+    @staticmethod
+    def find_serial_ports():
+        return SerialManager.find_serial_ports()
+
+    def connect(self, ports, baudrate=9600):
+        """Connect to every port in ports; on any failure none stays connected."""
+        if self.is_connected:
+            return True
+        for index, port in enumerate(ports):
+            device = SerialDevice(index, self.merger, self.max_buffer_bytes, self._on_device_lost)
+            if not device.serial_manager.connect(port, baudrate=baudrate):
+                self.disconnect()
+                return False
+            self.devices.append(device)
+        self.is_connected = bool(self.devices)
+        self.baudrate = baudrate
+        self.ports = list(ports)
+        return self.is_connected
+
+    def connect_replay(self, filename, speed=1.0):
+        """Stand a serial capture in for the ports, with a device per captured port; it plays from the start at each stream."""
+        if self.is_connected:
+            return True
+        try:
+            self.replay = SerialReplay(filename, speed=speed)
+            num_devices = self.replay.get_num_devices()
+        except (OSError, ValueError) as e:
+            print(f"warning: cannot replay {filename}: {e}")
+            self.replay = None
+            return False
+        # the devices' ports stay closed, so commands sent to them are dropped
+        self.devices = [SerialDevice(index, self.merger, self.max_buffer_bytes) for index in range(num_devices)]
+        self.is_connected = True
+        self.baudrate = self.replay.header.get('baudrate')
+        self.ports = [filename]
+        return True
+
+    def _on_device_lost(self, index, error):
+        """A device's port failed on its reader thread: the group stays connected while another device is left."""
+        port = self.ports[index] if index < len(self.ports) else f"device {index + 1}"
+        print(f"warning: the serial port {port} failed: {error}")
+        self.is_connected = any(device.serial_manager.is_connected for device in self.devices)
+        if self.connection_lost_callback:
+            self.connection_lost_callback(port, error, self.is_connected)
+
+    def disconnect(self):
+        self.stop_capture()
+        if self.replay is not None:
+            self.replay.stop()
+            self.replay = None
+        for device in self.devices:
+            device.serial_manager.disconnect()
+        self.devices = []
+        self.is_connected = False
+
+    def send_data(self, data):
+        """Send a command to every device."""
+        for device in self.devices:
+            device.serial_manager.send_data(data)
+
+    def get_channels(self, local_channels):
+        """Return the global channels of the given local channels on every device."""
+        return [SerialDevice.CHANNELS_PER_DEVICE * device.index + ch for device in self.devices for ch in local_channels]
+
+    def start_stream(self):
+        """Start decoding on every device, with one time origin for all; returns the origin (a perf_counter value)."""
+        self.merger.reset([device.index for device in self.devices])
+        time_origin = time.perf_counter()
+        for device in self.devices:
+            device.start_stream(time_origin)
+        if self.replay is not None:
+            self.replay.play({device.index: device.on_data_received for device in self.devices}, time_origin)
+        return time_origin
+
+    def stop_stream(self):
+        """Stop decoding on every device and pass on the samples the merger still holds."""
+        if self.replay is not None:
+            self.replay.stop()
+        for device in self.devices:
+            device.is_streaming = False
+        self.merger.flush()
+
+    def start_capture(self, filename, time_origin):
+        """Tee the raw bytes of every device into a capture file, with arrival times from time_origin. Raises OSError."""
+        self.stop_capture()
+        self.capture = SerialCapture(filename, time_origin, ports=self.ports, baudrate=self.baudrate)
+        for device in self.devices:
+            device.serial_manager.capture_index = device.index
+            device.serial_manager.capture = self.capture
+
+    def stop_capture(self):
+        """Stop teeing and close the capture file; returns its (chunks, bytes), or None if none was open."""
+        if self.capture is None:
+            return None
+        for device in self.devices:
+            device.serial_manager.capture = None
+        self.capture.close()
+        counts, self.capture = (self.capture.num_chunks, self.capture.num_bytes), None
+        return counts
+
+    def get_bytes_per_sample(self):
+        """Return the smallest wire bytes per sample of the devices' detected framings."""
+        return min((device.packet_decoder.get_bytes_per_sample() for device in self.devices), default=PacketDecoder.BYTES_PER_SAMPLE['ascii'])
+
+    def get_footprint(self):
+        """Return the bytes held in the decoders' unparsed buffers."""
+        return sum(device.packet_decoder.get_footprint() for device in self.devices)
+
+    def set_max_buffer_bytes(self, max_buffer_bytes):
+        self.max_buffer_bytes = max_buffer_bytes
+        for device in self.devices:
+            device.packet_decoder.max_buffer_bytes = max_buffer_bytes
+
+    def get_decoder_errors(self):
+        """Return the (lost frames, CRC errors) of all devices."""
+        return (sum(device.packet_decoder.lost_frames for device in self.devices),
+                sum(device.packet_decoder.crc_errors for device in self.devices))
+
+
+def check_merge_order():
+    """Replay a quiet device through the merger; returns the largest backward step of the merged times (0.0 when ordered)."""
+    """Device 1 sends a frame every 10 ms, device 2 one at 0 s and the next at 1 s, after the merger stopped waiting for it."""
+    from packet_decoder import encode_binary_frame
+    blocks = []
+    devices = SerialDeviceGroup(samples_received_callback=lambda *block: blocks.append(block))
+    devices.devices = [SerialDevice(index, devices.merger, devices.max_buffer_bytes) for index in range(2)]
+    time_origin = devices.start_stream()
+    arrivals = [(0.01 * step, 0) for step in range(1, 121)] + [(0.0, 1), (1.0, 1)]
+    for sequence, (arrival_time, index) in enumerate(sorted(arrivals)):
+        frame = encode_binary_frame(1, sequence, np.arange(10))
+        devices.devices[index].on_data_received(frame, time_origin + arrival_time)
+    devices.stop_stream()
+    times = np.concatenate([block[0] for block in blocks])
+    return max(0.0, -float(np.min(np.diff(times))))
+
+
+if __name__ == '__main__':
+    # a regression check of the merge order, no serial port needed
+    backward_step = check_merge_order()
+    print(f"largest backward step of the merged times: {backward_step:.3f} s")
+    print("OK" if backward_step == 0.0 else "FAILED")
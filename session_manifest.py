@@ -0,0 +1,176 @@
+import bisect
+import datetime
+import json
+import os
+import time
+
+
+SESSION_FILENAME = "session.json"
+
+
+class SessionManifest:
+    """The manifest of a record-and-receive session, written as session.json in the session's own directory."""
+    """It lists the devices, settings and files, anchors the videos to the signal timeline and holds the seek index."""
+
+    def __init__(self, folder):
+        """Initialize the manifest of the session stored in folder."""
+        self.folder = folder
+        self.started = datetime.datetime.now()
+        self.started_unix = time.time()
+        self.started_perf_counter = time.perf_counter()
+        self.time_origin = None # perf_counter value of signal time 0
+        self.devices = {}
+        self.settings = {}
+        self.recorders = {} # {cam_id: [VideoRecorder]}, several for a triggered session
+        self.loggers = {} # {channel: [(SignalLogger, time_offset)]}
+
+    def get_filename(self):
+        return os.path.join(self.folder, SESSION_FILENAME)
+
+    def set_time_origin(self, time_origin):
+        """Set the perf_counter value at which the signal timeline starts."""
+        self.time_origin = time_origin
+
+    def add_video(self, cam_id, recorder):
+        self.recorders.setdefault(cam_id, []).append(recorder)
+
+    def add_log(self, channel, logger, time_offset=0.0):
+        """Add a signal log whose times are session times minus time_offset (the start of a triggered log)."""
+        self.loggers.setdefault(channel, []).append((logger, time_offset))
+
+    def write(self, is_complete=False):
+        """Write the manifest atomically; call it when the session starts and again, complete, once every file is closed."""
+        manifest = self._build(is_complete)
+        filename = self.get_filename()
+        try:
+            with open(filename + ".tmp", "w") as f:
+                json.dump(manifest, f, indent=2)
+            os.replace(filename + ".tmp", filename)
+        except OSError as e:
+            print(f"warning: cannot write the session manifest {filename}: {e}")
+
+    def _build(self, is_complete):
+        """Return the manifest as a JSON-ready dict."""
+        time_origin = self.time_origin if self.time_origin is not None else self.started_perf_counter
+        videos = {}
+        for cam_id, recorders in sorted(self.recorders.items()):
+            videos[str(cam_id + 1)] = [{
+                'fps': recorder.target_fps,
+                'resolution': [recorder.width, recorder.height],
+                'is_color': recorder.is_color,
+                # signal time of frame 0; frame n follows n / fps later
+                'start_time': recorder.first_frame_time - time_origin if recorder.first_frame_time is not None else None,
+                'segments': [{'file': segment['file'], 'first_frame': segment['first_frame'], 'num_frames': segment['num_frames']}
+                             for segment in recorder.segments]
+            } for recorder in recorders]
+        logs = {}
+        markers = []
+        for channel, loggers in sorted(self.loggers.items()):
+            logs[str(channel)] = []
+            for logger, time_offset in loggers:
+                logs[str(channel)].append({
+                    'header': logger.header.strip(),
+                    'compression': logger.compression,
+                    'time_offset': time_offset,
+                    'chunks': [{'file': chunk['file'], 'first_time': chunk['first_time'], 'last_time': chunk['last_time'],
+                                'rows': chunk['rows'], 'bytes': chunk['bytes']} for chunk in logger.chunks],
+                    # [log time, chunk, byte offset into the uncompressed chunk text]
+                    'seek': list(logger.seek_points)
+                })
+                log_index = len(logs[str(channel)]) - 1
+                for log_time, chunk, offset in logger.marker_points:
+                    markers.append({'time': log_time + time_offset, 'channel': channel, 'log': log_index, 'chunk': chunk, 'offset': offset})
+        markers.sort(key=lambda marker: marker['time'])
+        for marker_id, marker in enumerate(markers, start=1):
+            marker['id'] = marker_id
+            marker['frames'] = {cam: _frame_at(recordings, marker['time']) for cam, recordings in videos.items()}
+        return {
+            'version': 1,
+            'complete': is_complete,
+            'clock': {
+                'started': self.started.isoformat(),
+                'started_unix': self.started_unix,
+                # perf_counter values are only comparable within the recording process
+                'time_origin_unix': self.started_unix + (time_origin - self.started_perf_counter)
+            },
+            'devices': self.devices,
+            'settings': self.settings,
+            'videos': videos,
+            'logs': logs,
+            'markers': markers
+        }
+
+
+def _frame_at(recordings, t):
+    """Return [recording, frame number] of session time t in a camera's recordings, or None if none covers it."""
+    for index, recording in enumerate(recordings):
+        if recording['start_time'] is None:
+            continue
+        frame_no = int((t - recording['start_time']) * recording['fps'] + 1e-6)
+        num_frames = sum(segment['num_frames'] for segment in recording['segments'])
+        if 0 <= frame_no < num_frames:
+            return [index, frame_no]
+    return None
+
+
+class SessionIndex:
+    """Random access into a recorded session through its manifest, without scanning any file."""
+
+    def __init__(self, filename):
+        """Load the manifest session.json (or the session directory holding it); raises OSError or ValueError."""
+        if os.path.isdir(filename):
+            filename = os.path.join(filename, SESSION_FILENAME)
+        self.folder = os.path.dirname(filename)
+        with open(filename) as f:
+            self.manifest = json.load(f)
+        # the seek times of every log, for bisection
+        self.seek_times = {(channel, log_index): [point[0] for point in log['seek']]
+                           for channel, logs in self.manifest['logs'].items() for log_index, log in enumerate(logs)}
+
+    def get_videos(self):
+        """Return {camera number: [segment paths]} of each camera's first recording."""
+        return {int(cam): [os.path.join(self.folder, segment['file']) for segment in recordings[0]['segments']]
+                for cam, recordings in self.manifest['videos'].items() if recordings}
+
+    def get_logs(self):
+        """Return {channel: [chunk paths]} of each channel's first log."""
+        return {int(channel): [os.path.join(self.folder, chunk['file']) for chunk in logs[0]['chunks']]
+                for channel, logs in self.manifest['logs'].items() if logs}
+
+    def get_video_offsets(self):
+        """Return {camera number: signal time of the first frame} of each camera's first recording."""
+        """The cameras start one after another, so each has its own; a camera without a start time is left out."""
+        return {int(cam): recordings[0]['start_time'] for cam, recordings in self.manifest['videos'].items()
+                if recordings and recordings[0]['start_time'] is not None}
+
+    def locate_sample(self, channel, t):
+        """Return (chunk path, byte offset) of a row at or shortly before session time t in a channel's logs, or None."""
+        """The offset is into the uncompressed text; the rows from there on reach t within one seek interval."""
+        logs = self.manifest['logs'].get(str(channel), [])
+        for log_index in range(len(logs) - 1, -1, -1):
+            log = logs[log_index]
+            seek_times = self.seek_times[(str(channel), log_index)]
+            position = bisect.bisect_right(seek_times, t - log['time_offset']) - 1
+            if position >= 0:
+                _, chunk, offset = log['seek'][position]
+                return os.path.join(self.folder, log['chunks'][chunk]['file']), offset
+        return None
+
+    def locate_frame(self, cam, t):
+        """Return (segment path, frame number within the segment) of camera cam at session time t, or None."""
+        recordings = self.manifest['videos'].get(str(cam), [])
+        found = _frame_at(recordings, t)
+        if found is None:
+            return None
+        recording_index, frame_no = found
+        segments = recordings[recording_index]['segments']
+        position = bisect.bisect_right([segment['first_frame'] for segment in segments], frame_no) - 1
+        segment = segments[position]
+        return os.path.join(self.folder, segment['file']), frame_no - segment['first_frame']
+
+    def get_marker(self, marker_id):
+        """Return the manifest entry of marker marker_id (numbered from 1), with its log offset and frames."""
+        markers = self.manifest['markers']
+        if not 1 <= marker_id <= len(markers):
+            raise KeyError(f"no marker {marker_id}")
+        return markers[marker_id - 1]
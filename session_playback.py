@@ -0,0 +1,527 @@
+import datetime
+import json
+import os
+import re
+import struct
+import threading
+import time
+import tkinter as tk
+from tkinter import ttk
+from collections import OrderedDict
+import cv2
+import numpy as np
+from PIL import Image, ImageTk
+
+from plot_manager import PlotManager
+from session_viewer import load_pyramids_async
+from signal_logger import LOG_NAME_PATTERN, get_log_chunks
+
+
+# ============================================
+# ------------ Session Discovery -------------
+# ============================================
+def _parse_file_timestamp(name):
+    """Return the datetime encoded in a CAM/CH file name, or None."""
+    match = re.search(r'_(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})', name)
+    if not match:
+        return None
+    return datetime.datetime.strptime(match.group(1), '%Y-%m-%d_%H-%M-%S')
+
+
+def find_session_files(filename, video_folder, signal_folder, tolerance=2.0):
+    """Return ({camera number: [avi paths]}, {channel: [log chunk paths]}) recorded in the same session as filename."""
+    # recording and receiving take their timestamps separately, so they may differ by a second
+    session_time = _parse_file_timestamp(os.path.basename(filename))
+    videos, logs = {}, {}
+    if session_time is None:
+        return videos, logs
+    for folder, pattern, found in ((video_folder, re.compile(r'CAM(\d+)_.*\.avi$'), videos), (signal_folder, LOG_NAME_PATTERN, logs)):
+        if not os.path.isdir(folder):
+            continue
+        for name in sorted(os.listdir(folder)):
+            match = pattern.match(name)
+            file_time = _parse_file_timestamp(name)
+            if match and file_time and abs((file_time - session_time).total_seconds()) <= tolerance:
+                found.setdefault(int(match.group(1)), os.path.join(folder, name))
+    # segmented recordings and chunked logs list their parts in order in a manifest / index
+    for cam in list(videos):
+        videos[cam] = _get_video_segments(videos[cam])
+    for ch in list(logs):
+        logs[ch] = get_log_chunks(logs[ch])
+    return videos, logs
+
+
+def get_video_offsets(videos, logs):
+    """Return {camera number: signal time of its first frame} of session files without a manifest."""
+    """Taken from the start timestamps in the file names, so it is good to a second; {} without logs."""
+    log_times = [_parse_file_timestamp(os.path.basename(chunks[0])) for chunks in logs.values() if chunks]
+    log_times = [log_time for log_time in log_times if log_time is not None]
+    if not log_times:
+        return {}
+    log_start = min(log_times)
+    offsets = {}
+    for cam, segments in videos.items():
+        video_time = _parse_file_timestamp(os.path.basename(segments[0])) if segments else None
+        if video_time is not None:
+            offsets[cam] = (video_time - log_start).total_seconds()
+    return offsets
+
+
+def _get_video_segments(filename):
+    """Return the ordered segment files of the recording that filename belongs to."""
+    root = re.sub(r'_part\d+$', '', os.path.splitext(filename)[0])
+    try:
+        with open(root + ".json") as f:
+            manifest = json.load(f)
+        folder = os.path.dirname(filename)
+        segments = [os.path.join(folder, segment['file']) for segment in manifest['segments']]
+        return [path for path in segments if os.path.exists(path)]
+    except (OSError, ValueError, KeyError):
+        return [filename]
+
+
+# ============================================
+# -------------- AVI Frame Index -------------
+# ============================================
+class AviFrameIndex:
+    """Frame count, frame rate and keyframe positions of an AVI file, read from its RIFF indexes."""
+    """Built once by walking the chunk headers (no decoding) and cached next to the video."""
+
+    AVIIF_KEYFRAME = 0x10
+    CACHE_VERSION = 1
+
+    def __init__(self, filename):
+        """Load the index from its cache, building it if needed."""
+        self.filename = filename
+        self.cache_filename = filename + ".frameidx.npz"
+        self.fps = 30.0
+        self.num_frames = 0
+        self.keyframes = np.zeros(1, dtype=np.int64)
+        if not self._load_cache():
+            self._build()
+            self._save_cache()
+
+    def _get_source_signature(self):
+        """Return the size and modification time that the cache must match."""
+        stat = os.stat(self.filename)
+        return np.array([stat.st_size, stat.st_mtime_ns, self.CACHE_VERSION], dtype=np.int64)
+
+    def _load_cache(self):
+        """Load the cached index; returns False if it is missing or stale."""
+        try:
+            with np.load(self.cache_filename) as cache:
+                if not np.array_equal(cache['signature'], self._get_source_signature()):
+                    return False
+                self.fps = float(cache['fps'])
+                self.num_frames = int(cache['num_frames'])
+                self.keyframes = cache['keyframes']
+        except (OSError, KeyError, ValueError):
+            return False
+        return True
+
+    def _save_cache(self):
+        """Write the index next to the video; a read-only folder simply means no cache."""
+        try:
+            with open(self.cache_filename, "wb") as f:
+                np.savez(f, signature=self._get_source_signature(), fps=np.float64(self.fps),
+                         num_frames=np.int64(self.num_frames), keyframes=self.keyframes)
+        except OSError as e:
+            print(f"warning: cannot cache the frame index of {self.filename}: {e}")
+
+    def _build(self):
+        """Walk the RIFF structure, collecting video chunk positions and keyframe flags."""
+        frame_offsets = [] # file position of every video chunk header, in frame order
+        idx1_flags = [] # legacy index: flags of the video entries, in frame order
+        keyframe_offsets = set() # OpenDML standard indexes: positions of keyframe chunks
+        non_keyframe_offsets = set()
+        file_size = os.path.getsize(self.filename)
+        with open(self.filename, "rb") as f:
+            def walk(start, end):
+                position = start
+                while position + 8 <= end:
+                    f.seek(position)
+                    header = f.read(8)
+                    if len(header) < 8:
+                        return
+                    chunk_id, chunk_size = header[:4], struct.unpack('<I', header[4:])[0]
+                    data_start = position + 8
+                    if chunk_id in (b'RIFF', b'LIST'):
+                        f.read(4) # the form or list type, e.g. 'AVI ', 'hdrl', 'movi'
+                        walk(data_start + 4, min(data_start + chunk_size, end))
+                    elif chunk_id[2:] in (b'dc', b'db') and chunk_id[:2].isdigit():
+                        frame_offsets.append(position)
+                    elif chunk_id == b'strh':
+                        self._parse_stream_header(f.read(min(chunk_size, 56)))
+                    elif chunk_id == b'idx1':
+                        entries = np.frombuffer(f.read(chunk_size // 16 * 16), dtype='<u4').reshape(-1, 4)
+                        ids = entries[:, 0].view('S4') if len(entries) else []
+                        for entry_id, flags in zip(ids, entries[:, 1]):
+                            if entry_id[2:] in (b'dc', b'db'):
+                                idx1_flags.append(bool(flags & self.AVIIF_KEYFRAME))
+                    elif chunk_id[:2] == b'ix':
+                        self._parse_standard_index(f.read(chunk_size), keyframe_offsets, non_keyframe_offsets)
+                    position = data_start + chunk_size + (chunk_size & 1) # chunks are word aligned
+            walk(0, file_size)
+        self.num_frames = len(frame_offsets)
+        is_keyframe = np.zeros(self.num_frames, dtype=bool)
+        if self.num_frames:
+            is_keyframe[0] = True
+        is_keyframe[:len(idx1_flags)] |= np.array(idx1_flags[:self.num_frames], dtype=bool)
+        for frame_no, offset in enumerate(frame_offsets):
+            if offset in keyframe_offsets:
+                is_keyframe[frame_no] = True
+            elif offset in non_keyframe_offsets:
+                is_keyframe[frame_no] = False
+        self.keyframes = np.flatnonzero(is_keyframe).astype(np.int64)
+        if not len(self.keyframes):
+            self.keyframes = np.zeros(1, dtype=np.int64)
+
+    def _parse_stream_header(self, data):
+        """Take the frame rate from the video stream header."""
+        if len(data) < 28 or data[:4] != b'vids':
+            return
+        scale, rate = struct.unpack('<II', data[20:28])
+        if scale and rate:
+            self.fps = rate / scale
+
+    @staticmethod
+    def _parse_standard_index(data, keyframe_offsets, non_keyframe_offsets):
+        """Collect chunk positions from an OpenDML 'ix##' standard index (bit 31 of the size marks delta frames)."""
+        if len(data) < 24:
+            return
+        longs_per_entry, sub_type, index_type, num_entries = struct.unpack('<HBBI', data[:8])
+        base_offset = struct.unpack('<Q', data[12:20])[0]
+        if index_type != 1 or longs_per_entry != 2: # AVI_INDEX_OF_CHUNKS
+            return
+        entries = np.frombuffer(data[24:24 + num_entries * 8], dtype='<u4').reshape(-1, 2)
+        for offset, size in entries:
+            # index offsets point at the chunk data, 8 bytes after its header
+            position = base_offset + int(offset) - 8
+            if size & 0x80000000:
+                non_keyframe_offsets.add(position)
+            else:
+                keyframe_offsets.add(position)
+
+    def get_keyframe_before(self, frame_no):
+        """Return the last keyframe at or before frame_no."""
+        index = int(np.searchsorted(self.keyframes, frame_no, side='right')) - 1
+        return int(self.keyframes[max(0, index)])
+
+
+# ============================================
+# ------------ Read-ahead Decoding -----------
+# ============================================
+class PrefetchingVideoReader:
+    """Decodes frames ahead of the playback position in a background thread."""
+    """Seeks use the frame index: jump to the preceding keyframe, then grab forward without decoding."""
+    """A segmented recording is read as one video, frame numbers run on across its segment files."""
+    """A frame that cannot be decoded, e.g. in a file cut off by a crash, ends its segment's readable frames."""
+
+    LOOKAHEAD_FRAMES = 30
+    MAX_READ_FAILURES = 3
+
+    def __init__(self, filenames):
+        """Index the video segments and start the decoding thread."""
+        self.filenames = filenames
+        self.indexes = [AviFrameIndex(filename) for filename in filenames]
+        self.fps = self.indexes[0].fps
+        # global frame number of the first frame of every segment
+        self.segment_starts = np.cumsum([0] + [index.num_frames for index in self.indexes])
+        self.num_frames = int(self.segment_starts[-1])
+        self.readable_ends = [int(end) for end in self.segment_starts[1:]] # global frame number each segment is readable up to
+        self.frames = OrderedDict() # frame number -> decoded frame
+        self.target_frame = 0
+        self.condition = threading.Condition()
+        self.stop_event = threading.Event()
+        self.decode_thread = threading.Thread(target=self._decode_loop, daemon=True)
+        self.decode_thread.start()
+
+    def request(self, frame_no):
+        """Move the read-ahead window to start at frame_no."""
+        with self.condition:
+            self.target_frame = max(0, min(frame_no, self.num_frames - 1))
+            # forget frames behind the new position
+            for cached_no in [n for n in self.frames if n < self.target_frame]:
+                del self.frames[cached_no]
+            self.condition.notify()
+
+    def get(self, frame_no):
+        """Return the decoded frame if it is ready, otherwise None."""
+        with self.condition:
+            return self.frames.get(frame_no)
+
+    def is_available(self, frame_no):
+        """Return False if frame_no cannot be decoded, so waiting for it is pointless."""
+        if not 0 <= frame_no < self.num_frames:
+            return False
+        segment, _ = self._locate(frame_no)
+        return frame_no < self.readable_ends[segment]
+
+    def _locate(self, frame_no):
+        """Return (segment number, frame number within the segment) of a global frame number."""
+        segment = int(np.searchsorted(self.segment_starts, frame_no, side='right')) - 1
+        segment = max(0, min(segment, len(self.indexes) - 1))
+        return segment, frame_no - int(self.segment_starts[segment])
+
+    def _decode_loop(self):
+        """Keep the frames [target, target + LOOKAHEAD_FRAMES) decoded."""
+        cap = None
+        open_segment = -1
+        position = 0 # the frame number within the open segment that the next cap.read() returns
+        failures = 0 # failed reads of the wanted frame in a row
+        while not self.stop_event.is_set():
+            with self.condition:
+                target = self.target_frame
+                wanted = next((n for n in range(target, min(target + self.LOOKAHEAD_FRAMES, self.num_frames))
+                               if n not in self.frames and self.is_available(n)), None)
+                if wanted is None:
+                    self.condition.wait(timeout=0.1)
+                    continue
+            segment, local_frame = self._locate(wanted)
+            index = self.indexes[segment]
+            if segment != open_segment:
+                if cap is not None:
+                    cap.release()
+                cap = cv2.VideoCapture(self.filenames[segment])
+                open_segment, position = segment, 0
+            if not (index.get_keyframe_before(local_frame) <= position <= local_frame):
+                # seeking backwards or far ahead: restart decoding at the preceding keyframe
+                position = index.get_keyframe_before(local_frame)
+                cap.set(cv2.CAP_PROP_POS_FRAMES, position)
+            while position < local_frame and cap.grab():
+                position += 1
+            ret, frame = cap.read()
+            if not ret:
+                failures += 1
+                if failures >= self.MAX_READ_FAILURES:
+                    # a truncated or damaged segment: nothing from this frame on is read again
+                    print(f"warning: cannot decode frame {local_frame} of {self.filenames[segment]}, the rest of it is skipped")
+                    self.readable_ends[segment] = wanted
+                    failures = 0
+                    continue
+                position = -1 # seek again on the next try
+                with self.condition:
+                    self.condition.wait(timeout=0.1)
+                continue
+            failures = 0
+            position += 1
+            with self.condition:
+                if wanted >= self.target_frame:
+                    self.frames[wanted] = frame
+        if cap is not None:
+            cap.release()
+
+    def close(self):
+        """Stop the decoding thread and release the video."""
+        self.stop_event.set()
+        with self.condition:
+            self.condition.notify()
+        self.decode_thread.join()
+
+
+# ============================================
+# ------------- Playback Window --------------
+# ============================================
+class SessionPlayback:
+    """A playback window showing the session's camera videos and signal plot with a shared cursor."""
+    """Both follow the frame currently on screen, so video and signal stay within one frame of each other."""
+
+    TICK_MS = 10
+    PLOT_SPAN = 20.0 # seconds of signal shown around the cursor
+    MAX_VIEW_POINTS = 4000
+
+    def __init__(self, root, videos, logs, video_offsets=None):
+        """Open the videos ({camera: [segment paths]}) and logs; video_offsets is {camera: signal time of its first frame}."""
+        """A camera without an offset starts at signal time 0."""
+        self.window = tk.Toplevel(root)
+        self.window.title("Session Playback")
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+        self.readers = {cam: PrefetchingVideoReader(paths) for cam, paths in sorted(videos.items())}
+        self.pyramids = {} # loaded on a worker thread, see _on_pyramids_loaded
+        self.video_offsets = {cam: (video_offsets or {}).get(cam, 0.0) for cam in self.readers}
+        self.is_playing = False
+        self.current_time = 0.0
+        self.play_wall_start = 0.0
+        self.play_media_start = 0.0
+        self.shown_frames = {}
+        self.plot_window = None
+        self.tick_job = None
+        # --- Session Time Range and Markers ---
+        self.fps = min((reader.fps for reader in self.readers.values()), default=30.0)
+        self.duration = max((reader.num_frames / reader.fps + self.video_offsets[cam] for cam, reader in self.readers.items()), default=0.0)
+        self.marker_times = np.empty(0)
+        self._create_widgets()
+        self.seek(0.0)
+        self._update_cursor()
+        self._tick()
+        load_pyramids_async(self.window, logs, self._on_pyramids_loaded)
+
+    def _on_pyramids_loaded(self, pyramids, error):
+        """Add the signals, their markers and their time range once the pyramids are loaded."""
+        if error is not None:
+            print(f"warning: cannot read the signal logs of the session: {error}")
+            return
+        self.pyramids = pyramids
+        self.duration = max([self.duration] + [pyramid.time_range[1] for pyramid in self.pyramids.values()])
+        self.time_scale.config(to=max(self.duration, 1e-3))
+        all_markers = [pyramid.marker_times for pyramid in self.pyramids.values()]
+        self.marker_times = np.unique(np.round(np.concatenate(all_markers), 4)) if all_markers else np.empty(0)
+        self.plot_manager.set_markers(self.marker_times)
+        self.plot_window = None # reload the visible signal
+        self._update_cursor()
+
+    def _create_widgets(self):
+        """Create the video canvases, the plot and the transport controls."""
+        video_frame = ttk.Frame(self.window)
+        video_frame.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+        self.canvases = {}
+        for column, cam in enumerate(self.readers):
+            video_frame.columnconfigure(column, weight=1)
+            canvas = tk.Canvas(video_frame, bg="black", width=400, height=300)
+            canvas.grid(row=0, column=column, sticky="nsew", padx=2)
+            self.canvases[cam] = canvas
+        video_frame.rowconfigure(0, weight=1)
+        control_frame = ttk.Frame(self.window, padding="5")
+        control_frame.pack(side=tk.TOP, fill=tk.X)
+        self.play_button = ttk.Button(control_frame, text="Play", command=self.toggle_play)
+        self.play_button.pack(side=tk.LEFT)
+        ttk.Button(control_frame, text="< Marker", command=self.previous_marker).pack(side=tk.LEFT, padx=5)
+        ttk.Button(control_frame, text="Marker >", command=self.next_marker).pack(side=tk.LEFT)
+        ttk.Label(control_frame, text="Go to (s):").pack(side=tk.LEFT, padx=(10, 5))
+        self.seek_entry = ttk.Entry(control_frame, width=10)
+        self.seek_entry.pack(side=tk.LEFT)
+        self.seek_entry.bind("<Return>", self._on_seek_entry)
+        self.time_label = ttk.Label(control_frame, text="")
+        self.time_label.pack(side=tk.RIGHT, padx=5)
+        self.time_scale = ttk.Scale(self.window, from_=0.0, to=max(self.duration, 1e-3), orient=tk.HORIZONTAL,
+                                    command=self._on_scale_moved)
+        self.time_scale.pack(side=tk.TOP, fill=tk.X, padx=5)
+        plot_frame = ttk.Frame(self.window)
+        plot_frame.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+        self.plot_manager = PlotManager(plot_frame)
+        self.cursor_line = self.plot_manager.ax.axvline(x=0.0, color='k', linewidth=1.0)
+
+    # ============================================
+    # ---------- Seeking and Transport -----------
+    # ============================================
+    def _frame_of(self, cam, t):
+        """Return the frame number of camera cam shown at session time t."""
+        reader = self.readers[cam]
+        return max(0, min(int((t - self.video_offsets[cam]) * reader.fps + 1e-6), reader.num_frames - 1))
+
+    def seek(self, t):
+        """Jump to session time t; the frame index makes this independent of the distance."""
+        self.current_time = max(0.0, min(t, self.duration))
+        self.play_wall_start = time.perf_counter()
+        self.play_media_start = self.current_time
+        for cam, reader in self.readers.items():
+            reader.request(self._frame_of(cam, self.current_time))
+
+    def toggle_play(self):
+        """Start or pause playback from the current position."""
+        self.is_playing = not self.is_playing
+        self.play_button.config(text="Pause" if self.is_playing else "Play")
+        self.seek(self.current_time)
+
+    def next_marker(self):
+        """Seek to the first marker after the cursor."""
+        index = int(np.searchsorted(self.marker_times, self.current_time + 1e-3, side='right'))
+        if index < len(self.marker_times):
+            self.seek(float(self.marker_times[index]))
+
+    def previous_marker(self):
+        """Seek to the last marker before the cursor."""
+        index = int(np.searchsorted(self.marker_times, self.current_time - 1e-3, side='left')) - 1
+        if index >= 0:
+            self.seek(float(self.marker_times[index]))
+
+    def _on_seek_entry(self, event=None):
+        """Seek to the time typed into the entry."""
+        try:
+            self.seek(float(self.seek_entry.get()))
+        except ValueError:
+            pass
+
+    def _on_scale_moved(self, value):
+        """Seek when the user drags the time slider (but not when the tick moves it)."""
+        t = float(value)
+        if abs(t - self.current_time) > 1.0 / self.fps:
+            self.seek(t)
+
+    # ============================================
+    # ------------- Playback Loop ----------------
+    # ============================================
+    def _tick(self):
+        """Advance the clock, show the frames for it and move the signal cursor to the shown frame."""
+        if self.is_playing:
+            wanted_time = self.play_media_start + (time.perf_counter() - self.play_wall_start)
+            if wanted_time >= self.duration:
+                wanted_time = self.duration
+                self.toggle_play()
+        else:
+            wanted_time = self.current_time
+        # only move on when every video has decoded its frame for the wanted time
+        frames_to_show = {}
+        for cam, reader in self.readers.items():
+            frame_no = self._frame_of(cam, wanted_time)
+            if self.shown_frames.get(cam) == frame_no:
+                continue
+            if reader.is_available(frame_no):
+                frames_to_show[cam] = (frame_no, reader.get(frame_no))
+            else:
+                # an empty or damaged video keeps its last frame rather than holding the others
+                self.shown_frames[cam] = frame_no
+                reader.request(frame_no)
+        if any(frame is None for _, frame in frames_to_show.values()):
+            if self.is_playing:
+                # the decoder is behind: hold the clock at the shown frames instead of drifting apart
+                self.play_wall_start = time.perf_counter()
+                self.play_media_start = self.current_time
+        else:
+            for cam, (frame_no, frame) in frames_to_show.items():
+                self._display_frame(cam, frame)
+                self.shown_frames[cam] = frame_no
+                self.readers[cam].request(frame_no)
+            if wanted_time != self.current_time or frames_to_show:
+                self.current_time = wanted_time
+                self._update_cursor()
+        self.tick_job = self.window.after(self.TICK_MS, self._tick)
+
+    def _display_frame(self, cam, frame):
+        """Resize a decoded frame to its canvas and show it."""
+        canvas = self.canvases[cam]
+        width, height = canvas.winfo_width(), canvas.winfo_height()
+        if width <= 1 or height <= 1:
+            return
+        image = cv2.cvtColor(cv2.resize(frame, (width, height)), cv2.COLOR_BGR2RGB)
+        photo = ImageTk.PhotoImage(image=Image.fromarray(image))
+        canvas.create_image(0, 0, image=photo, anchor=tk.NW)
+        canvas.image = photo
+
+    def _update_cursor(self):
+        """Move the cursor line, reloading the visible signal when the cursor leaves the middle of the plot."""
+        t = self.current_time
+        self.cursor_line.set_xdata([t, t])
+        self.time_scale.set(t)
+        self.time_label.config(text=f"{t:8.3f} s / {self.duration:.3f} s")
+        if self.plot_window is None or not (self.plot_window[0] + self.PLOT_SPAN / 4 <= t <= self.plot_window[1] - self.PLOT_SPAN / 4):
+            self.plot_window = (t - self.PLOT_SPAN / 2, t + self.PLOT_SPAN / 2)
+            y_min, y_max = np.inf, -np.inf
+            for ch, pyramid in self.pyramids.items():
+                times, values, _ = pyramid.get_view(*self.plot_window, self.MAX_VIEW_POINTS)
+                self.plot_manager.set_channel_data(ch, times, values)
+                if len(values):
+                    y_min, y_max = min(y_min, values.min()), max(y_max, values.max())
+            self.plot_manager.ax.set_xlim(*self.plot_window)
+            if np.isfinite(y_min):
+                margin = max((y_max - y_min) * 0.1, 0.2)
+                self.plot_manager.ax.set_ylim(y_min - margin, y_max + margin)
+        self.plot_manager.canvas.draw_idle()
+
+    def close(self):
+        """Stop the decoding threads and close the window."""
+        if self.tick_job is not None:
+            self.window.after_cancel(self.tick_job)
+        for reader in self.readers.values():
+            reader.close()
+        self.window.destroy()
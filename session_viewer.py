@@ -0,0 +1,357 @@
+import io
+import os
+import re
+import threading
+import tkinter as tk
+from tkinter import ttk
+import numpy as np
+from matplotlib.backends.backend_tkagg import NavigationToolbar2Tk
+
+from plot_manager import PlotManager
+from signal_logger import open_log_chunk, find_session_logs
+
+
+# ============================================
+# ----------- Signal Log Reading -------------
+# ============================================
+def parse_log_header(header_line):
+    """Return the (time, value, marker) column indices of a signal log header line."""
+    columns = header_line.strip().split(',')
+    time_col = next((i for i, name in enumerate(columns) if name.startswith('Time')), 0)
+    value_col = next((i for i, name in enumerate(columns) if re.match(r'CH\d+_Data', name)), 1)
+    marker_col = next((i for i, name in enumerate(columns) if name == 'Marker'), None)
+    return time_col, value_col, marker_col
+
+
+def parse_log_rows(block, num_columns):
+    """Parse a block of complete CSV lines into a 2D float array (one row per line)."""
+    if not block.strip():
+        return np.empty((0, num_columns))
+    return np.loadtxt(io.BytesIO(block), delimiter=',', ndmin=2)
+
+
+class SignalPyramid:
+    """A multi-resolution min/max overview of one signal log, cached on disk next to the log."""
+    """Level 0 summarizes BUCKET_SIZE samples per bucket, each higher level LEVEL_FACTOR buckets of the one below."""
+
+    BUCKET_SIZE = 64
+    LEVEL_FACTOR = 4
+    BLOCK_ROWS = 4096 # a byte offset is indexed every BLOCK_ROWS rows for random access
+    READ_CHUNK_BYTES = 8 * 1024 * 1024
+    CACHE_VERSION = 2
+
+    def __init__(self, filenames):
+        """Load the pyramid of a signal log (its ordered chunk files) from its cache, building it if needed."""
+        self.filenames = filenames
+        root = re.sub(r'(_part\d+)?\.csv(\.gz|\.zlib|\.xz)?$', '', filenames[0])
+        self.cache_filename = root + ".pyramid.npz"
+        self.num_samples = 0
+        self.time_range = (0.0, 0.0)
+        self.levels = [] # list of (times, mins, maxs) arrays, finest first
+        self.block_times = np.empty(0)
+        self.block_offsets = np.empty(0, dtype=np.int64) # uncompressed offset within the chunk
+        self.block_chunks = np.empty(0, dtype=np.int64) # chunk number of each indexed block
+        self.marker_times = np.empty(0)
+        self.columns = (0, 1, None)
+        self.num_columns = 3
+        if not self._load_cache():
+            self._build()
+            self._save_cache()
+
+    # ============================================
+    # ---------------- Caching -------------------
+    # ============================================
+    def _get_source_signature(self):
+        """Return the sizes and modification times of all chunks that the cache must match."""
+        signature = [self.CACHE_VERSION]
+        for filename in self.filenames:
+            stat = os.stat(filename)
+            signature += [stat.st_size, stat.st_mtime_ns]
+        return np.array(signature, dtype=np.int64)
+
+    def _load_cache(self):
+        """Load the cached pyramid; returns False if it is missing or stale."""
+        try:
+            with np.load(self.cache_filename) as cache:
+                if not np.array_equal(cache['signature'], self._get_source_signature()):
+                    return False
+                self.num_samples = int(cache['num_samples'])
+                self.time_range = tuple(float(t) for t in cache['time_range'])
+                self.block_times = cache['block_times']
+                self.block_offsets = cache['block_offsets']
+                self.block_chunks = cache['block_chunks']
+                self.marker_times = cache['marker_times']
+                header = cache['header']
+                num_levels = int(cache['num_levels'])
+                self.levels = [(cache[f'times_{i}'], cache[f'mins_{i}'], cache[f'maxs_{i}']) for i in range(num_levels)]
+        except (OSError, KeyError, ValueError):
+            return False
+        self.columns = tuple(None if c < 0 else int(c) for c in header[:3])
+        self.num_columns = int(header[3])
+        return True
+
+    def _save_cache(self):
+        """Write the pyramid next to the log; a read-only folder simply means no cache."""
+        arrays = {
+            'signature': self._get_source_signature(),
+            'num_samples': np.int64(self.num_samples),
+            'time_range': np.array(self.time_range),
+            'block_times': self.block_times,
+            'block_offsets': self.block_offsets,
+            'block_chunks': self.block_chunks,
+            'marker_times': self.marker_times,
+            'header': np.array([-1 if c is None else c for c in self.columns] + [self.num_columns]),
+            'num_levels': np.int64(len(self.levels)),
+        }
+        for i, (times, mins, maxs) in enumerate(self.levels):
+            arrays[f'times_{i}'], arrays[f'mins_{i}'], arrays[f'maxs_{i}'] = times, mins, maxs
+        try:
+            with open(self.cache_filename, "wb") as f:
+                np.savez(f, **arrays)
+        except OSError as e:
+            print(f"warning: cannot cache the overview of {self.filenames[0]}: {e}")
+
+    # ============================================
+    # ---------------- Building ------------------
+    # ============================================
+    def _build(self):
+        """Stream every chunk of the log once, collecting level 0 buckets, block offsets and markers."""
+        time_col, value_col, marker_col = self.columns
+        bucket_times, bucket_mins, bucket_maxs = [], [], []
+        block_times, block_offsets, block_chunks, marker_times = [], [], [], []
+        carry_times, carry_values = np.empty(0), np.empty(0)
+        for chunk_number, filename in enumerate(self.filenames):
+            with open_log_chunk(filename) as f:
+                header_line = f.readline().decode('ascii', errors='replace')
+                self.columns = time_col, value_col, marker_col = parse_log_header(header_line)
+                self.num_columns = len(header_line.strip().split(','))
+                offset = f.tell() # offsets are into the uncompressed stream of the chunk
+                pending = b''
+                while True:
+                    chunk = f.read(self.READ_CHUNK_BYTES)
+                    data = pending + chunk
+                    # only parse complete lines, the rest is kept for the next chunk
+                    end = data.rfind(b'\n') + 1 if chunk else len(data)
+                    block, pending = data[:end], data[end:]
+                    if block:
+                        rows = parse_log_rows(block, self.num_columns)
+                        # byte offset of every row start, used for the random access index
+                        newlines = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == ord('\n'))
+                        row_offsets = offset + np.concatenate(([0], newlines + 1))[:len(rows)]
+                        first_row = self.num_samples
+                        indexed = np.arange((-first_row) % self.BLOCK_ROWS, len(rows), self.BLOCK_ROWS)
+                        # every chunk starts with an indexed block, so a read never crosses a chunk
+                        if offset == len(header_line) and len(rows) and (not len(indexed) or indexed[0]):
+                            indexed = np.concatenate(([0], indexed))
+                        block_times.append(rows[indexed, time_col])
+                        block_offsets.append(row_offsets[indexed])
+                        block_chunks.append(np.full(len(indexed), chunk_number))
+                        if marker_col is not None:
+                            marker_times.append(rows[rows[:, marker_col] != 0, time_col])
+                        if len(rows):
+                            first_time = rows[0, time_col] if not self.num_samples else self.time_range[0]
+                            self.time_range = (float(first_time), float(rows[-1, time_col]))
+                        self.num_samples += len(rows)
+                        offset += len(block)
+                        # fold the samples into level 0 buckets, carrying the incomplete tail
+                        times = np.concatenate((carry_times, rows[:, time_col]))
+                        values = np.concatenate((carry_values, rows[:, value_col]))
+                        num_full = len(values) // self.BUCKET_SIZE * self.BUCKET_SIZE
+                        if num_full:
+                            buckets = values[:num_full].reshape(-1, self.BUCKET_SIZE)
+                            bucket_times.append(times[:num_full:self.BUCKET_SIZE])
+                            bucket_mins.append(buckets.min(axis=1))
+                            bucket_maxs.append(buckets.max(axis=1))
+                        carry_times, carry_values = times[num_full:], values[num_full:]
+                    if not chunk:
+                        break
+        if len(carry_values):
+            bucket_times.append(carry_times[:1])
+            bucket_mins.append(carry_values.min(keepdims=True))
+            bucket_maxs.append(carry_values.max(keepdims=True))
+        level = tuple(np.concatenate(parts) if parts else np.empty(0) for parts in (bucket_times, bucket_mins, bucket_maxs))
+        self.block_times = np.concatenate(block_times) if block_times else np.empty(0)
+        self.block_offsets = np.concatenate(block_offsets).astype(np.int64) if block_offsets else np.empty(0, dtype=np.int64)
+        self.block_chunks = np.concatenate(block_chunks).astype(np.int64) if block_chunks else np.empty(0, dtype=np.int64)
+        self.marker_times = np.concatenate(marker_times) if marker_times else np.empty(0)
+        # reduce each level by LEVEL_FACTOR until it fits on screen at a glance
+        self.levels = [level]
+        while len(level[0]) > 2048:
+            times, mins, maxs = level
+            num_full = len(times) // self.LEVEL_FACTOR * self.LEVEL_FACTOR
+            level = (times[:num_full:self.LEVEL_FACTOR],
+                     mins[:num_full].reshape(-1, self.LEVEL_FACTOR).min(axis=1),
+                     maxs[:num_full].reshape(-1, self.LEVEL_FACTOR).max(axis=1))
+            self.levels.append(level)
+
+    # ============================================
+    # ---------------- Querying ------------------
+    # ============================================
+    def read_raw(self, t_start, t_end):
+        """Read the full resolution samples between two times, touching only the indexed blocks covering them."""
+        if not len(self.block_offsets):
+            return np.empty(0), np.empty(0)
+        first_block = max(0, int(np.searchsorted(self.block_times, t_start, side='right')) - 1)
+        last_block = int(np.searchsorted(self.block_times, t_end, side='right'))
+        end_block = max(last_block, first_block + 1)
+        data = []
+        block = first_block
+        while block < end_block:
+            # read the run of blocks that lies in the same chunk in one go
+            chunk_number = self.block_chunks[block]
+            run_end = block + 1
+            while run_end < end_block and self.block_chunks[run_end] == chunk_number:
+                run_end += 1
+            start_offset = int(self.block_offsets[block])
+            with open_log_chunk(self.filenames[chunk_number]) as f:
+                f.seek(start_offset)
+                if run_end < len(self.block_offsets) and self.block_chunks[run_end] == chunk_number:
+                    chunk_data = f.read(int(self.block_offsets[run_end]) - start_offset)
+                else:
+                    chunk_data = f.read()
+            data.append(chunk_data[:chunk_data.rfind(b'\n') + 1])
+            block = run_end
+        rows = parse_log_rows(b''.join(data), self.num_columns)
+        time_col, value_col, _ = self.columns
+        times, values = rows[:, time_col], rows[:, value_col]
+        in_range = (times >= t_start) & (times <= t_end)
+        return times[in_range], values[in_range]
+
+    def get_view(self, t_start, t_end, max_points):
+        """Return (times, values, samples per point) for plotting a time range with about max_points points."""
+        # full resolution samples when they fit, otherwise a min/max envelope of the finest level that fits
+        if not self.num_samples:
+            return np.empty(0), np.empty(0), 1
+        samples_per_bucket = self.BUCKET_SIZE
+        for times, mins, maxs in self.levels:
+            i0 = max(0, int(np.searchsorted(times, t_start)) - 1)
+            i1 = int(np.searchsorted(times, t_end)) + 1
+            if samples_per_bucket == self.BUCKET_SIZE and (i1 - i0) * samples_per_bucket <= max_points:
+                return self.read_raw(t_start, t_end) + (1,)
+            if (i1 - i0) * 2 <= max_points or (times is self.levels[-1][0]):
+                # interleave min and max so one line draws the envelope
+                view_times = np.repeat(times[i0:i1], 2)
+                view_values = np.column_stack((mins[i0:i1], maxs[i0:i1])).ravel()
+                return view_times, view_values, samples_per_bucket
+            samples_per_bucket *= self.LEVEL_FACTOR
+        return np.empty(0), np.empty(0), 1
+
+
+def load_pyramids_async(window, logs, callback):
+    """Load or build the pyramids of logs ({channel: [chunk paths]}) on a worker thread, so a long log never freezes the GUI."""
+    """callback(pyramids, error) runs on the GUI thread through window.after; error is None or the OSError/ValueError raised."""
+    def load():
+        try:
+            pyramids, error = {ch: SignalPyramid(chunks) for ch, chunks in sorted(logs.items()) if chunks}, None
+        except (OSError, ValueError) as e:
+            pyramids, error = {}, e
+        try:
+            window.after(0, callback, pyramids, error)
+        except (tk.TclError, RuntimeError):
+            pass # the window was closed meanwhile
+    threading.Thread(target=load, daemon=True).start()
+
+
+class SessionViewer:
+    """A review window for a recorded signal log (and its sibling channels), reusing the PlotManager embedding."""
+
+    MAX_VIEW_POINTS = 4000
+    RELOAD_DELAY_MS = 50
+
+    def __init__(self, root, filename):
+        """Open the window at once and show the whole session once the overview pyramids are loaded or built."""
+        self.window = tk.Toplevel(root)
+        self.window.title(f"Review - {os.path.basename(filename)}")
+        self.filename = filename
+        self.pyramids = {}
+        self.reload_job = None
+        self.marker_times = np.empty(0)
+        self.t_min, self.t_max = 0.0, 1.0
+        self._create_widgets()
+        self.plot_manager.ax.callbacks.connect('xlim_changed', self._on_xlim_changed)
+        self.state_label.config(text="Loading the overview...")
+        load_pyramids_async(self.window, find_session_logs(filename), self._on_pyramids_loaded)
+
+    def _on_pyramids_loaded(self, pyramids, error):
+        """Index the markers and the time range of the loaded pyramids and show the whole session."""
+        if error is not None:
+            print(f"warning: cannot open {self.filename}: {error}")
+            self.state_label.config(text=f"Cannot read the log: {error}")
+            return
+        self.pyramids = pyramids
+        # --- Marker Index ---
+        all_markers = [pyramid.marker_times for pyramid in self.pyramids.values()]
+        self.marker_times = np.unique(np.round(np.concatenate(all_markers), 4)) if all_markers else np.empty(0)
+        # --- Session Time Range ---
+        ranges = [pyramid.time_range for pyramid in self.pyramids.values() if pyramid.num_samples]
+        self.t_min = min((r[0] for r in ranges), default=0.0)
+        self.t_max = max((r[1] for r in ranges), default=1.0)
+        if self.t_max <= self.t_min:
+            self.t_max = self.t_min + 1.0
+        self.plot_manager.set_markers(self.marker_times)
+        self.show_all()
+
+    def _create_widgets(self):
+        """Create the navigation controls and the embedded plot."""
+        control_frame = ttk.Frame(self.window, padding="5")
+        control_frame.pack(side=tk.TOP, fill=tk.X)
+        ttk.Button(control_frame, text="Whole Session", command=self.show_all).pack(side=tk.LEFT)
+        ttk.Button(control_frame, text="< Marker", command=self.previous_marker).pack(side=tk.LEFT, padx=5)
+        ttk.Button(control_frame, text="Marker >", command=self.next_marker).pack(side=tk.LEFT)
+        self.state_label = ttk.Label(control_frame, text="")
+        self.state_label.pack(side=tk.RIGHT, padx=5)
+        plot_frame = ttk.Frame(self.window)
+        plot_frame.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+        self.plot_manager = PlotManager(plot_frame)
+        self.toolbar = NavigationToolbar2Tk(self.plot_manager.canvas, plot_frame)
+        self.toolbar.update()
+
+    def show_all(self):
+        """Zoom out to the whole session."""
+        self.plot_manager.ax.set_xlim(self.t_min, self.t_max)
+        self._reload_view()
+
+    def _jump_to_marker(self, marker_time):
+        """Center the current view on a marker, keeping the zoom level."""
+        x_min, x_max = self.plot_manager.ax.get_xlim()
+        half_width = (x_max - x_min) / 2
+        self.plot_manager.ax.set_xlim(marker_time - half_width, marker_time + half_width)
+
+    def next_marker(self):
+        """Center the view on the first marker after the current center."""
+        x_min, x_max = self.plot_manager.ax.get_xlim()
+        index = int(np.searchsorted(self.marker_times, (x_min + x_max) / 2 + 1e-3, side='right'))
+        if index < len(self.marker_times):
+            self._jump_to_marker(self.marker_times[index])
+
+    def previous_marker(self):
+        """Center the view on the last marker before the current center."""
+        x_min, x_max = self.plot_manager.ax.get_xlim()
+        index = int(np.searchsorted(self.marker_times, (x_min + x_max) / 2 - 1e-3, side='left')) - 1
+        if index >= 0:
+            self._jump_to_marker(self.marker_times[index])
+
+    def _on_xlim_changed(self, ax):
+        """Debounce zooming and panning before loading the visible range."""
+        if self.reload_job is not None:
+            self.window.after_cancel(self.reload_job)
+        self.reload_job = self.window.after(self.RELOAD_DELAY_MS, self._reload_view)
+
+    def _reload_view(self):
+        """Load only the visible range of each channel, at full resolution when it fits on screen."""
+        self.reload_job = None
+        x_min, x_max = self.plot_manager.ax.get_xlim()
+        y_min, y_max = np.inf, -np.inf
+        coarsest = 1
+        for ch, pyramid in self.pyramids.items():
+            times, values, samples_per_point = pyramid.get_view(x_min, x_max, self.MAX_VIEW_POINTS)
+            self.plot_manager.set_channel_data(ch, times, values)
+            coarsest = max(coarsest, samples_per_point)
+            if len(values):
+                y_min, y_max = min(y_min, values.min()), max(y_max, values.max())
+        if np.isfinite(y_min):
+            margin = max((y_max - y_min) * 0.1, 0.2)
+            self.plot_manager.ax.set_ylim(y_min - margin, y_max + margin)
+        resolution = "full resolution" if coarsest == 1 else f"overview, {coarsest} samples/point"
+        self.state_label.config(text=f"{x_max - x_min:.2f} s shown ({resolution}), {len(self.marker_times)} markers")
+        self.plot_manager.canvas.draw_idle()
@@ -0,0 +1,372 @@
+import bisect
+import gzip
+import json
+import lzma
+import os
+import queue
+import re
+import threading
+import zlib
+import numpy as np
+
+from disk_preflight import FilePreallocator, LOG_EXTENT_BYTES
+from trace_profiler import tracer
+
+
+# file extension of each compression, appended after '.csv'
+COMPRESSION_EXTENSIONS = {None: "", 'gzip': ".gz", 'zlib': ".zlib", 'lzma': ".xz"}
+LOG_NAME_PATTERN = re.compile(r'CH(\d+)_(.+?)(?:_part(\d+))?\.csv(\.gz|\.zlib|\.xz)?$')
+INDEX_NAME_PATTERN = re.compile(r'CH(\d+)_(.+)\.index\.json$')
+
+
+def _create_compressor(compression, level):
+    """Return a streaming compressor object with compress() and flush(), or None."""
+    if compression == 'gzip':
+        return zlib.compressobj(level, zlib.DEFLATED, 31) # wbits 31 writes a gzip header and trailer
+    if compression == 'zlib':
+        return zlib.compressobj(level)
+    if compression == 'lzma':
+        return lzma.LZMACompressor(preset=level)
+    return None
+
+
+def format_log_rows(times, values, marked_rows=()):
+    """Return a channel's batch as CSV rows with the given row indices marked, and the (time, byte offset) of each marked row."""
+    rows = [f"{t:.4f},{v:.6f},0\n" for t, v in zip(times.tolist(), values.tolist())]
+    markers = []
+    if len(marked_rows):
+        offsets = np.cumsum([0] + [len(row) for row in rows])
+        for row in marked_rows:
+            rows[row] = rows[row][:-2] + "1\n"
+            markers.append((float(times[row]), int(offsets[row])))
+    return "".join(rows), markers
+
+
+class MarkerQueue:
+    """Markers waiting to be logged, each at the sample nearest its time on the samples' clock."""
+    """Samples arrive in batches after the marker is set; a marker is placed by the first batch that reaches its time."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.times = [] # in time order
+
+    def add(self, marker_time):
+        with self.lock:
+            self.times.append(marker_time)
+            self.times.sort()
+
+    def clear(self):
+        with self.lock:
+            self.times = []
+
+    def discard_before(self, start_time):
+        """Drop the markers before start_time, e.g. the start of a log that cannot hold them."""
+        with self.lock:
+            self.times = self.times[bisect.bisect_left(self.times, start_time):]
+
+    def take_rows(self, times):
+        """Return the indices of the samples in a time-ordered batch nearest the markers it reaches, removing those markers."""
+        """A marker that fell before the batch (between two batches) goes to its first sample."""
+        with self.lock:
+            if not self.times or not len(times) or self.times[0] > times[-1]:
+                return np.empty(0, dtype=np.int64)
+            num_due = int(np.searchsorted(self.times, times[-1], side='right'))
+            marker_times, self.times = np.array(self.times[:num_due]), self.times[num_due:]
+        rows = np.searchsorted(times, marker_times)
+        # the sample before is nearer when the marker is less than halfway to the next one
+        is_before = (rows > 0) & ((rows == len(times)) | (marker_times - times[np.maximum(rows - 1, 0)] <= times[np.minimum(rows, len(times) - 1)] - marker_times))
+        rows[is_before] -= 1
+        return np.unique(rows)
+
+
+class SignalLogger:
+    """Write one channel's signal log on a background thread so the serial path never blocks on disk."""
+    """Rows can be compressed as they stream (gzip, zlib or lzma) and rotated into numbered chunks."""
+    """A sparse seek index maps times and markers to byte offsets into the uncompressed text of each chunk."""
+
+    SEEK_INTERVAL = 1.0 # seconds between two seek points
+    MAX_PENDING_BYTES = 32 * 1024 * 1024
+
+    def __init__(self, filename, header, compression=None, level=6, chunk_duration=None, max_pending_bytes=MAX_PENDING_BYTES):
+        """Initialize the logger; filename is the plain log name, e.g. 'CH1_<timestamp>.csv'."""
+        """At most max_pending_bytes of rows wait for the disk; further blocks are dropped with a warning, so a slow disk cannot grow memory without limit."""
+        if compression not in COMPRESSION_EXTENSIONS:
+            raise ValueError(f"unknown compression: {compression}")
+        self.filename = filename
+        self.header = header
+        self.compression = compression
+        self.level = level
+        self.chunk_duration = chunk_duration
+        self.is_chunked = chunk_duration is not None
+        self.row_queue = queue.Queue()
+        self.max_pending_bytes = max_pending_bytes
+        self.pending_bytes = 0 # updated by the producers and the writer thread, under pending_lock
+        self.pending_lock = threading.Lock()
+        self.dropped_rows = 0
+        self.is_dropping = False
+        self.chunks = [] # index entries of the finished and current chunks
+        self.seek_points = [] # [time, chunk, byte offset] of a row start every SEEK_INTERVAL
+        self.marker_points = [] # [time, chunk, byte offset] of every marked row
+        self.file_handle = None
+        self.preallocator = None # reserves the current chunk's file ahead of its end
+        self.compressor = None
+        self.writer_thread = None
+
+    # ============================================
+    # ------------------ Names -------------------
+    # ============================================
+    def get_chunk_filename(self, index):
+        """Return the file name of a chunk (the single log file when not chunked)."""
+        root, _ = os.path.splitext(self.filename)
+        part = f"_part{index + 1:03d}" if self.is_chunked else ""
+        return f"{root}{part}.csv{COMPRESSION_EXTENSIONS[self.compression]}"
+
+    def get_index_filename(self):
+        """Return the file name of the chunk index."""
+        return os.path.splitext(self.filename)[0] + ".index.json"
+
+    def get_footprint(self):
+        """Return the number of bytes queued but not yet written."""
+        return self.pending_bytes
+
+    # ============================================
+    # ---------------- Producer ------------------
+    # ============================================
+    def start(self):
+        """Open the first chunk and start the writer thread."""
+        self._open_chunk(None) # raises OSError here, where the caller can still report it
+        self.writer_thread = threading.Thread(target=self._writer_loop, daemon=True)
+        self.writer_thread.start()
+
+    def write_rows(self, first_time, last_time, text, markers=()):
+        """Queue a block of complete CSV rows covering the time range [first_time, last_time], with the (time, byte offset) of its marked rows."""
+        """Never blocks: while the backlog is full the block is dropped instead."""
+        with self.pending_lock:
+            if self.pending_bytes + len(text) > self.max_pending_bytes:
+                self.dropped_rows += text.count("\n")
+                if not self.is_dropping:
+                    self.is_dropping = True
+                    print(f"warning: the disk cannot keep up with {self.filename}, rows are dropped until it catches up")
+                return
+            self.is_dropping = False
+            self.pending_bytes += len(text)
+        self.row_queue.put((first_time, last_time, text, markers))
+
+    def close(self):
+        """Write everything still queued, close the last chunk and wait for the writer thread."""
+        if self.writer_thread is None:
+            return
+        self.row_queue.put(None)
+        self.writer_thread.join()
+        self.writer_thread = None
+        if self.dropped_rows:
+            print(f"warning: {self.dropped_rows} rows are missing from {self.filename}, the disk could not keep up")
+
+    # ============================================
+    # ------------- Writer Thread ----------------
+    # ============================================
+    def _open_chunk(self, first_time):
+        """Open the next chunk file and write its header."""
+        filename = self.get_chunk_filename(len(self.chunks))
+        self.file_handle = open(filename, "wb")
+        self.preallocator = FilePreallocator(filename, LOG_EXTENT_BYTES)
+        self.compressor = _create_compressor(self.compression, self.level)
+        self.chunks.append({'file': os.path.basename(filename), 'first_time': first_time, 'last_time': first_time, 'rows': 0, 'bytes': 0})
+        self._write_bytes(self.header.encode('ascii'))
+        self.chunks[-1]['bytes'] = len(self.header)
+        if self.is_chunked:
+            self._write_index(is_complete=False)
+
+    def _close_chunk(self, is_complete=False):
+        """Flush the compressor, close the current chunk and rewrite the index."""
+        if self.compressor is not None:
+            self.file_handle.write(self.compressor.flush())
+        self.file_handle.close()
+        self.preallocator.close()
+        if self.is_chunked:
+            self._write_index(is_complete)
+
+    def _write_index(self, is_complete):
+        """Write the chunk index atomically, so an interrupted session still lists its finished chunks."""
+        index = {
+            'log': os.path.basename(self.filename),
+            'header': self.header.strip(),
+            'compression': self.compression,
+            'chunk_duration': self.chunk_duration,
+            'complete': is_complete,
+            'chunks': self.chunks
+        }
+        index_filename = self.get_index_filename()
+        try:
+            with open(index_filename + ".tmp", "w") as f:
+                json.dump(index, f, indent=2)
+            os.replace(index_filename + ".tmp", index_filename)
+        except OSError as e:
+            print(f"warning: cannot write the log index {index_filename}: {e}")
+
+    def _write_bytes(self, data):
+        """Write raw log bytes through the compressor (if any)."""
+        if self.compressor is not None:
+            data = self.compressor.compress(data)
+        if data:
+            self.file_handle.write(data)
+            self.preallocator.reserve(self.file_handle.tell())
+
+    def _writer_loop(self):
+        """Consumer: compress and write queued rows, rotating chunks at their time limit."""
+        while True:
+            tracer.profile_checkpoint()
+            try:
+                item = self.row_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if item is None:
+                break
+            first_time, last_time, text, markers = item
+            try:
+                with tracer.span("log write"):
+                    chunk = self.chunks[-1]
+                    if chunk['first_time'] is None:
+                        chunk['first_time'] = first_time
+                    elif self.is_chunked and first_time - chunk['first_time'] >= self.chunk_duration:
+                        self._close_chunk()
+                        self._open_chunk(first_time)
+                        chunk = self.chunks[-1]
+                    # the block starts on a row, so its offset is a valid seek target
+                    seek_point = [first_time, len(self.chunks) - 1, chunk['bytes']]
+                    if not self.seek_points or first_time >= self.seek_points[-1][0] + self.SEEK_INTERVAL or seek_point[1] != self.seek_points[-1][1]:
+                        self.seek_points.append(seek_point)
+                    for marker_time, offset in markers:
+                        self.marker_points.append([marker_time, seek_point[1], seek_point[2] + offset])
+                    self._write_bytes(text.encode('ascii'))
+                    chunk['last_time'] = last_time
+                    chunk['rows'] += text.count("\n")
+                    chunk['bytes'] += len(text)
+            except OSError as e:
+                print(f"warning: cannot write to {self.filename}: {e}")
+            with self.pending_lock:
+                self.pending_bytes -= len(text)
+        self._close_chunk(is_complete=True)
+
+
+# ============================================
+# ---------------- Log Reading ---------------
+# ============================================
+class ZlibReader:
+    """A minimal read-only file object over a zlib stream (the stdlib only has one for gzip and lzma)."""
+
+    READ_SIZE = 1024 * 1024
+
+    def __init__(self, filename):
+        self.file_handle = open(filename, "rb")
+        self.decompressor = zlib.decompressobj()
+        self.buffer = b''
+        self.position = 0
+
+    def read(self, size=-1):
+        """Read up to size decompressed bytes (everything if size is negative)."""
+        while (size < 0 or len(self.buffer) < size) and not self.decompressor.eof:
+            compressed = self.file_handle.read(self.READ_SIZE)
+            if not compressed:
+                break
+            self.buffer += self.decompressor.decompress(compressed)
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        self.position += len(data)
+        return data
+
+    def readline(self):
+        """Read one line, including its newline."""
+        while b'\n' not in self.buffer and not self.decompressor.eof:
+            compressed = self.file_handle.read(self.READ_SIZE)
+            if not compressed:
+                break
+            self.buffer += self.decompressor.decompress(compressed)
+        end = self.buffer.find(b'\n')
+        return self.read(end + 1 if end != -1 else len(self.buffer))
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset):
+        """Seek forward (or restart and seek) by decompressing up to offset."""
+        if offset < self.position:
+            self.file_handle.seek(0)
+            self.decompressor = zlib.decompressobj()
+            self.buffer = b''
+            self.position = 0
+        while self.position < offset:
+            if not self.read(min(self.READ_SIZE, offset - self.position)):
+                break
+        return self.position
+
+    def close(self):
+        self.file_handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+def open_log_chunk(filename):
+    """Open a log chunk for binary reading, decompressing it transparently."""
+    if filename.endswith(".gz"):
+        return gzip.open(filename, "rb")
+    if filename.endswith(".xz"):
+        return lzma.open(filename, "rb")
+    if filename.endswith(".zlib"):
+        return ZlibReader(filename)
+    return open(filename, "rb")
+
+
+def get_log_key(filename):
+    """Return (channel, session timestamp) of any file of a signal log, or None."""
+    basename = os.path.basename(filename)
+    match = LOG_NAME_PATTERN.match(basename) or INDEX_NAME_PATTERN.match(basename)
+    if not match:
+        return None
+    return int(match.group(1)), match.group(2)
+
+
+def get_log_chunks(filename):
+    """Return the ordered chunk files of the signal log that filename (a chunk or index) belongs to."""
+    key = get_log_key(filename)
+    if key is None:
+        return [filename]
+    folder = os.path.dirname(filename)
+    channel, timestamp = key
+    index_filename = os.path.join(folder, f"CH{channel}_{timestamp}.index.json")
+    try:
+        with open(index_filename) as f:
+            index = json.load(f)
+        chunks = [os.path.join(folder, chunk['file']) for chunk in index['chunks']]
+        return [path for path in chunks if os.path.exists(path)]
+    except (OSError, ValueError, KeyError):
+        pass
+    if INDEX_NAME_PATTERN.match(os.path.basename(filename)):
+        return []
+    # no index: collect the parts by name
+    parts = []
+    for name in sorted(os.listdir(folder or '.')):
+        match = LOG_NAME_PATTERN.match(name)
+        if match and (int(match.group(1)), match.group(2)) == key:
+            parts.append(os.path.join(folder, name))
+    return parts or [filename]
+
+
+def find_session_logs(filename):
+    """Return {channel: [chunk files]} of all signal logs recorded together with filename."""
+    key = get_log_key(filename)
+    if key is None:
+        return {1: [filename]}
+    folder = os.path.dirname(filename)
+    logs = {}
+    for name in sorted(os.listdir(folder or '.')):
+        other_key = get_log_key(name)
+        if other_key and other_key[1] == key[1] and other_key[0] not in logs:
+            logs[other_key[0]] = get_log_chunks(os.path.join(folder, name))
+    return logs
@@ -0,0 +1,195 @@
+import threading
+import time
+import tkinter as tk
+from tkinter import ttk
+from matplotlib.figure import Figure
+import numpy as np
+
+from plot_manager import TracedFigureCanvas
+from trace_profiler import tracer
+
+
+class SpectrumAnalyzer:
+    """An incremental Welch spectrum and spectrogram of one live channel."""
+    """Each overlapping segment is transformed once, when its last sample arrives; the Welch average is a running sum over the newest segments."""
+
+    def __init__(self, segment_length=256, overlap=0.5, num_averages=8, history=240):
+        """Initialize the analyzer; history is the number of spectrogram columns kept."""
+        self.segment_length = segment_length
+        self.hop = max(1, int(segment_length * (1 - overlap)))
+        self.num_averages = num_averages
+        self.history = history
+        self.window = np.hanning(segment_length)
+        self.window_power = np.sum(self.window ** 2)
+        self.num_bins = segment_length // 2 + 1
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget all samples and spectra."""
+        with self.lock:
+            self.pending = []
+            self.num_fed = 0
+            self.first_time = None
+            self.last_time = None
+        self.carry = np.empty(0)
+        # the newest num_averages periodograms, a ring with a running sum for the Welch average
+        self.periodograms = np.zeros((self.num_averages, self.num_bins))
+        self.periodogram_sum = np.zeros(self.num_bins)
+        self.num_segments = 0
+        self.skipped_segments = 0
+        # spectrogram columns (dB) are written twice, at i and i + history, so the newest
+        # history columns are always the contiguous slice ending at the last write
+        self.spectrogram = np.full((self.num_bins, 2 * self.history), -120.0)
+        self.column = 0
+
+    def feed(self, times, values):
+        """Queue a batch of samples; safe to call from the serial thread."""
+        if not len(values):
+            return
+        with self.lock:
+            self.pending.append(np.asarray(values, dtype=float))
+            self.num_fed += len(values)
+            if self.first_time is None:
+                self.first_time = times[0]
+            self.last_time = times[-1]
+
+    def get_sample_rate(self):
+        """Return the sample rate measured over all fed samples, or None."""
+        with self.lock:
+            if self.first_time is None or self.last_time <= self.first_time:
+                return None
+            return (self.num_fed - 1) / (self.last_time - self.first_time)
+
+    def update(self, max_segments=None):
+        """Transform the segments completed since the last update; returns the number transformed."""
+        """When more than max_segments are waiting, the oldest are skipped rather than falling behind."""
+        with self.lock:
+            pending, self.pending = self.pending, []
+        if not pending:
+            return 0
+        data = np.concatenate([self.carry] + pending)
+        num_new = (len(data) - self.segment_length) // self.hop + 1 if len(data) >= self.segment_length else 0
+        if not num_new:
+            self.carry = data
+            return 0
+        self.carry = data[num_new * self.hop:]
+        first = 0
+        if max_segments is not None and num_new > max_segments:
+            first = num_new - max_segments
+            self.skipped_segments += first
+        starts = np.arange(first, num_new) * self.hop
+        segments = data[starts[:, None] + np.arange(self.segment_length)]
+        segments = segments - segments.mean(axis=1, keepdims=True)
+        powers = np.abs(np.fft.rfft(segments * self.window, axis=1)) ** 2 / self.window_power
+        powers[:, 1:-1] *= 2 # one-sided spectrum
+        for power in powers:
+            ring_index = self.num_segments % self.num_averages
+            self.periodogram_sum += power - self.periodograms[ring_index]
+            self.periodograms[ring_index] = power
+            self.num_segments += 1
+        # the spectrogram only needs the newest history columns of this batch
+        decibels = 10 * np.log10(powers[-self.history:].T + 1e-12)
+        for column in decibels.T:
+            self.spectrogram[:, self.column] = column
+            self.spectrogram[:, self.column + self.history] = column
+            self.column = (self.column + 1) % self.history
+        return len(powers)
+
+    def get_spectrum(self):
+        """Return the Welch average power (V^2 per bin) of the newest segments."""
+        count = min(self.num_segments, self.num_averages)
+        return self.periodogram_sum / max(1, count)
+
+    def get_spectrogram(self):
+        """Return the spectrogram (bins x history, oldest column first) as a view, without copying."""
+        return self.spectrogram[:, self.column:self.column + self.history]
+
+
+class SpectrumPanel:
+    """A live spectrum and scrolling spectrogram of one channel, drawn next to the time plot."""
+    """Updates are paced by a CPU budget: when they cost too much the update rate drops, acquisition is never delayed."""
+
+    CPU_BUDGET = 0.1 # fraction of the GUI thread the panel may use
+    MIN_INTERVAL_MS = 200
+    MAX_INTERVAL_MS = 2000
+    MAX_SEGMENTS_PER_UPDATE = 64
+
+    def __init__(self, parent_frame, root):
+        """Create the panel inside parent_frame; root schedules the updates."""
+        self.root = root
+        self.analyzers = {1: SpectrumAnalyzer(), 2: SpectrumAnalyzer()}
+        self.channel_var = tk.IntVar(value=1)
+        self.interval_ms = self.MIN_INTERVAL_MS
+        self.update_job = None
+        self.sample_rate = None
+        # --- Controls ---
+        control_frame = ttk.Frame(parent_frame)
+        control_frame.pack(side=tk.TOP, fill=tk.X)
+        for ch in (1, 2):
+            ttk.Radiobutton(control_frame, text=f"CH {ch}", value=ch, variable=self.channel_var).pack(side=tk.LEFT)
+        self.state_label = ttk.Label(control_frame, text="")
+        self.state_label.pack(side=tk.RIGHT, padx=5)
+        # --- Plot ---
+        self.fig = Figure(figsize=(4, 3), dpi=90)
+        self.spectrum_ax = self.fig.add_subplot(2, 1, 1)
+        self.spectrum_ax.set_ylabel("Power (dB)")
+        self.spectrum_ax.grid(True)
+        self.spectrum_ax.set_ylim(-100, 0)
+        self.spectrum_line, = self.spectrum_ax.plot([], [], 'royalblue')
+        self.spectrogram_ax = self.fig.add_subplot(2, 1, 2)
+        self.spectrogram_ax.set_xlabel("Frequency (Hz)")
+        self.spectrogram_ax.set_yticks([])
+        analyzer = self.analyzers[1]
+        self.image = self.spectrogram_ax.imshow(analyzer.get_spectrogram().T, aspect='auto', origin='lower',
+                                                cmap='viridis', vmin=-100, vmax=0, interpolation='nearest')
+        self.canvas = TracedFigureCanvas(self.fig, master=parent_frame)
+        self.canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+        self.fig.tight_layout()
+
+    def feed(self, channel, times, values):
+        """Queue a batch of samples of a channel; safe to call from the serial thread."""
+        analyzer = self.analyzers.get(channel)
+        if analyzer is not None:
+            analyzer.feed(times, values)
+
+    def reset(self):
+        """Clear the spectra of both channels, e.g. when receiving restarts."""
+        for analyzer in self.analyzers.values():
+            analyzer.reset()
+        self.sample_rate = None
+
+    def start(self):
+        """Start the periodic updates."""
+        if self.update_job is None:
+            self.update_job = self.root.after(self.interval_ms, self._update)
+
+    def stop(self):
+        """Stop the periodic updates."""
+        if self.update_job is not None:
+            self.root.after_cancel(self.update_job)
+            self.update_job = None
+
+    def _update(self):
+        """Transform new segments of every channel and redraw the shown one, then pace the next update."""
+        start = time.perf_counter()
+        with tracer.span("spectrum update"):
+            for analyzer in self.analyzers.values():
+                analyzer.update(self.MAX_SEGMENTS_PER_UPDATE)
+            analyzer = self.analyzers[self.channel_var.get()]
+            sample_rate = analyzer.get_sample_rate()
+            if sample_rate:
+                if not self.sample_rate or abs(sample_rate - self.sample_rate) > 0.01 * self.sample_rate:
+                    self.sample_rate = sample_rate
+                    self.spectrum_ax.set_xlim(0, sample_rate / 2)
+                    self.image.set_extent((0, sample_rate / 2, 0, analyzer.history))
+                frequencies = np.fft.rfftfreq(analyzer.segment_length, 1 / sample_rate)
+                self.spectrum_line.set_data(frequencies, 10 * np.log10(analyzer.get_spectrum() + 1e-12))
+                self.image.set_data(analyzer.get_spectrogram().T)
+                self.canvas.draw_idle()
+        # the draw happens later in the idle loop, so count the last one against this update
+        cost = time.perf_counter() - start + self.canvas.last_draw_seconds
+        self.interval_ms = int(min(self.MAX_INTERVAL_MS, max(self.MIN_INTERVAL_MS, 1000 * cost / self.CPU_BUDGET)))
+        skipped = sum(a.skipped_segments for a in self.analyzers.values())
+        self.state_label.config(text=f"{1000 / self.interval_ms:.1f} updates/s" + (f", {skipped} segments skipped" if skipped else ""))
+        self.update_job = self.root.after(self.interval_ms, self._update)
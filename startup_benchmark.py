@@ -0,0 +1,75 @@
+import os
+import statistics
+import subprocess
+import sys
+
+
+# budgets on a typical laptop; the benchmark fails if the median exceeds them
+IMPORT_BUDGET_SECONDS = 0.5
+STARTUP_BUDGET_SECONDS = 1.5
+# none of these may be imported before the window is shown
+DEFERRED_MODULES = ('cv2', 'matplotlib', 'PIL')
+RUNS = 5
+
+IMPORT_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+import app_controller
+print(time.perf_counter() - start)
+print(','.join(name for name in {deferred!r} if name in sys.modules))
+"""
+
+# time from the interpreter start to the first idle mainloop with the window mapped
+STARTUP_SCRIPT = """
+import time
+start = time.perf_counter()
+import tkinter as tk
+try:
+    root = tk.Tk()
+except tk.TclError:
+    print('nan')
+    raise SystemExit
+from app_controller import AppController
+app = AppController(root)
+def report():
+    print(time.perf_counter() - start)
+    app.on_closing()
+root.after_idle(lambda: root.after(0, report))
+root.mainloop()
+"""
+
+
+def run_script(script):
+    """Run a script in a fresh interpreter from the project folder and return its output lines."""
+    folder = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run([sys.executable, "-c", script], cwd=folder, capture_output=True, text=True, check=True)
+    return result.stdout.strip().splitlines()
+
+
+def main():
+    import_times, startup_times = [], []
+    imported = set()
+    for _ in range(RUNS):
+        lines = run_script(IMPORT_SCRIPT.format(deferred=DEFERRED_MODULES))
+        import_times.append(float(lines[0]))
+        if len(lines) > 1 and lines[1]:
+            imported.update(lines[1].split(','))
+        startup_times.append(float(run_script(STARTUP_SCRIPT)[0]))
+    import_median = statistics.median(import_times)
+    print(f"import app_controller: {import_median * 1000:.0f} ms median of {RUNS} (budget {IMPORT_BUDGET_SECONDS * 1000:.0f} ms)")
+    is_ok = import_median <= IMPORT_BUDGET_SECONDS
+    if imported:
+        print(f"imported at startup but should be deferred: {', '.join(sorted(imported))}")
+        is_ok = False
+    if any(t == t for t in startup_times): # NaN without a display
+        startup_median = statistics.median(startup_times)
+        print(f"window interactive: {startup_median * 1000:.0f} ms median of {RUNS} (budget {STARTUP_BUDGET_SECONDS * 1000:.0f} ms)")
+        is_ok = is_ok and startup_median <= STARTUP_BUDGET_SECONDS
+    else:
+        print("window interactive: skipped, no display")
+    print("OK" if is_ok else "FAILED")
+    return 0 if is_ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,167 @@
+import cProfile
+import json
+import os
+import pstats
+import threading
+import time
+from collections import deque
+
+
+class _NullSpan:
+    """A do-nothing context manager returned while tracing is disabled."""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    """A context manager that records the duration of one hot-path stage."""
+    __slots__ = ('tracer', 'name', 'start_ns')
+
+    def __init__(self, tracer, name):
+        self.tracer = tracer
+        self.name = name
+        self.start_ns = 0
+
+    def __enter__(self):
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.tracer._record(self.name, self.start_ns, time.perf_counter_ns())
+        return False
+
+
+class TraceProfiler:
+    """Opt-in tracing of the hot-path stages, exported as Chrome trace-event JSON."""
+    """Also runs cProfile for a fixed window on every thread that calls profile_checkpoint()."""
+    """From Python 3.12 only one profiler can be active at a time, so only the first thread to reach a checkpoint is profiled."""
+
+    def __init__(self, max_events=1_000_000):
+        """Initialize the profiler in the disabled state."""
+        self.is_tracing = False
+        self.events = deque(maxlen=max_events) # (name, thread id, start ns, end ns)
+        self.thread_names = {}
+        self.origin_ns = time.perf_counter_ns()
+        # --- cProfile window state ---
+        self.profile_until = 0.0 # perf_counter deadline, 0 when no window is open
+        self.thread_profilers = {} # thread id -> cProfile.Profile
+        self.finished_profilers = []
+        self.skipped_threads = set() # thread ids whose profiler could not be enabled in this window
+        self.profile_lock = threading.Lock()
+
+    # ============================================
+    # ------------- Span Tracing -----------------
+    # ============================================
+    def span(self, name):
+        """Return a context manager timing the stage 'name' (a shared no-op when disabled)."""
+        if not self.is_tracing:
+            return _NULL_SPAN
+        return _Span(self, name)
+
+    def _record(self, name, start_ns, end_ns):
+        """Store one finished span; deque.append is atomic so no lock is needed."""
+        thread_id = threading.get_ident()
+        if thread_id not in self.thread_names:
+            self.thread_names[thread_id] = threading.current_thread().name
+        self.events.append((name, thread_id, start_ns, end_ns))
+
+    def start_tracing(self):
+        """Clear old spans and start recording new ones."""
+        self.events.clear()
+        self.thread_names = {}
+        self.origin_ns = time.perf_counter_ns()
+        self.is_tracing = True
+
+    def stop_tracing(self):
+        """Stop recording spans."""
+        self.is_tracing = False
+
+    def export_trace(self, filename):
+        """Write the recorded spans to a Chrome trace-event JSON file and return the event count."""
+        pid = os.getpid()
+        trace_events = []
+        for thread_id, thread_name in list(self.thread_names.items()):
+            trace_events.append({
+                'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': thread_id,
+                'args': {'name': thread_name}
+            })
+        spans = list(self.events)
+        for name, thread_id, start_ns, end_ns in spans:
+            trace_events.append({
+                'name': name, 'cat': 'hot-path', 'ph': 'X', 'pid': pid, 'tid': thread_id,
+                'ts': (start_ns - self.origin_ns) / 1000.0, 'dur': (end_ns - start_ns) / 1000.0
+            })
+        with open(filename, "w") as f:
+            json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms'}, f)
+        return len(spans)
+
+    # ============================================
+    # ------------- cProfile Window --------------
+    # ============================================
+    def start_profile_window(self, duration):
+        """Open a cProfile window of 'duration' seconds for all threads reaching a checkpoint."""
+        with self.profile_lock:
+            self.finished_profilers = []
+            self.skipped_threads = set()
+        self.profile_until = time.perf_counter() + duration
+        self.profile_checkpoint()
+
+    def profile_checkpoint(self):
+        """Called from thread loops: enable or retire this thread's profiler as the window dictates."""
+        if not self.profile_until and not self.thread_profilers:
+            return # fast path while no window is open
+        thread_id = threading.get_ident()
+        profiler = self.thread_profilers.get(thread_id)
+        window_open = time.perf_counter() < self.profile_until
+        if window_open and profiler is None:
+            if thread_id in self.skipped_threads:
+                return
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError: # Python 3.12+: another thread's profiler is already active
+                self.skipped_threads.add(thread_id)
+                return
+            self.thread_profilers[thread_id] = profiler
+        elif not window_open and profiler is not None:
+            profiler.disable()
+            with self.profile_lock:
+                del self.thread_profilers[thread_id]
+                self.finished_profilers.append(profiler)
+
+    def finish_profile_window(self, filename):
+        """Close the window and dump the merged statistics; returns False if nothing was sampled."""
+        # call this a little after the deadline so worker threads have retired their own profilers
+        self.profile_until = 0.0
+        self.profile_checkpoint() # retire the calling thread's profiler
+        with self.profile_lock:
+            # a cProfile.Profile can only be disabled by its own thread, so late ones are left out
+            profilers, self.finished_profilers = self.finished_profilers, []
+            num_skipped = len(self.skipped_threads)
+        if num_skipped:
+            print(f"warning: {num_skipped} threads were not profiled, this Python runs one profiler at a time")
+        stats = None
+        for profiler in profilers:
+            try:
+                if stats is None:
+                    stats = pstats.Stats(profiler)
+                else:
+                    stats.add(profiler)
+            except TypeError: # a profiler that never recorded a call
+                continue
+        if stats is None:
+            return False
+        stats.dump_stats(filename)
+        return True
+
+
+# a single shared instance used by all modules
+tracer = TraceProfiler()
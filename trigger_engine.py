@@ -0,0 +1,158 @@
+import collections
+import numpy as np
+
+
+class ChannelTrigger:
+    """A trigger condition on one channel, evaluated on whole sample blocks."""
+    """'threshold' compares the value, 'slope' the change per second and 'rms' the RMS over a sliding time window with level."""
+
+    KINDS = ('threshold', 'slope', 'rms')
+
+    def __init__(self, kind, level, direction='rising', window=0.1):
+        """Initialize the condition; direction 'rising' fires above level, 'falling' below it (below -level for slopes)."""
+        if kind not in self.KINDS:
+            raise ValueError(f"unknown trigger kind: {kind}")
+        self.kind = kind
+        self.level = level
+        self.direction = direction
+        self.window = window # seconds, for 'rms'
+        self.last_time = None
+        self.last_value = None
+        # samples inside the RMS window, carried into the next block
+        self.tail_times = np.empty(0)
+        self.tail_squares = np.empty(0)
+
+    def evaluate(self, times, values):
+        """Return a boolean mask of the samples at which the condition holds."""
+        if not len(values):
+            return np.zeros(0, dtype=bool)
+        if self.kind == 'threshold':
+            measure, level = values, self.level
+        elif self.kind == 'slope':
+            measure, level = self._get_slopes(times, values), self.level if self.direction == 'rising' else -self.level
+        else:
+            measure, level = self._get_window_rms(times, values), self.level
+        self.last_time, self.last_value = times[-1], values[-1]
+        return measure > level if self.direction == 'rising' else measure < level
+
+    def _get_slopes(self, times, values):
+        """Return the slope (V/s) into every sample from the one before it."""
+        if self.last_time is None:
+            previous_times, previous_values = times[:1], values[:1]
+        else:
+            previous_times, previous_values = [self.last_time], [self.last_value]
+        all_times = np.concatenate((previous_times, times))
+        all_values = np.concatenate((previous_values, values))
+        time_steps = np.diff(all_times)
+        return np.divide(np.diff(all_values), time_steps, out=np.zeros(len(values)), where=time_steps > 0)
+
+    def _get_window_rms(self, times, values):
+        """Return the RMS over the window ending at every sample, using a cumulative sum."""
+        all_times = np.concatenate((self.tail_times, times))
+        squares = np.concatenate((self.tail_squares, np.square(values)))
+        sums = np.concatenate(([0.0], np.cumsum(squares)))
+        ends = np.arange(len(self.tail_times), len(all_times)) + 1
+        starts = np.searchsorted(all_times, times - self.window, side='right')
+        rms = np.sqrt((sums[ends] - sums[starts]) / (ends - starts))
+        keep = all_times > times[-1] - self.window
+        self.tail_times, self.tail_squares = all_times[keep], squares[keep]
+        return rms
+
+
+class TriggerEngine:
+    """Turn the trigger conditions of all channels into start and stop events."""
+    """An event starts at the first sample where any condition holds and stops hold_seconds after the last one."""
+
+    def __init__(self, triggers, hold_seconds=2.0):
+        """Initialize the engine with {channel: ChannelTrigger}."""
+        self.triggers = triggers
+        self.hold_seconds = hold_seconds
+        self.is_triggered = False
+        self.last_active_time = None
+
+    def process(self, channel, times, values):
+        """Evaluate a block of a channel; returns ('start', time), ('stop', time) or None."""
+        trigger = self.triggers.get(channel)
+        if trigger is None or not len(times):
+            return None
+        active = trigger.evaluate(times, values)
+        if active.any():
+            if not self.is_triggered:
+                self.is_triggered = True
+                self.last_active_time = times[active][-1]
+                return ('start', times[np.argmax(active)])
+            self.last_active_time = max(self.last_active_time, times[active][-1])
+        elif self.is_triggered and times[-1] - self.last_active_time >= self.hold_seconds:
+            self.is_triggered = False
+            return ('stop', times[-1])
+        return None
+
+
+class SampleRingBuffer:
+    """The most recent seconds of one channel's (times, values) blocks, kept for pre-trigger logging."""
+
+    def __init__(self, seconds):
+        """Initialize the buffer with the time span it keeps."""
+        self.seconds = seconds
+        self.blocks = collections.deque()
+
+    def append(self, times, values):
+        """Add a block and drop the blocks that fell out of the time span."""
+        if not len(times):
+            return
+        self.blocks.append((times, values))
+        while self.blocks and self.blocks[0][0][-1] < times[-1] - self.seconds:
+            self.blocks.popleft()
+
+    def get_since(self, start_time):
+        """Return the buffered (times, values) from start_time on, and empty the buffer."""
+        if not self.blocks:
+            return np.empty(0), np.empty(0)
+        times = np.concatenate([block[0] for block in self.blocks])
+        values = np.concatenate([block[1] for block in self.blocks])
+        self.blocks.clear()
+        first = np.searchsorted(times, start_time)
+        return times[first:], values[first:]
+
+    def get_footprint(self):
+        """Return the number of bytes held by the buffered blocks."""
+        return sum(block[0].nbytes + block[1].nbytes for block in self.blocks)
+
+
+class FrameRingBuffer:
+    """The most recent seconds of one camera's frames, kept for pre-trigger recording."""
+    """Slots are reused with np.copyto once allocated; drained frames are handed over to the recorder."""
+
+    def __init__(self, max_frames):
+        """Initialize the buffer with its frame cap, from the pre-trigger time and the memory budget."""
+        self.max_frames = max(1, max_frames)
+        self.slots = [None] * self.max_frames
+        self.timestamps = [None] * self.max_frames
+        self.next_slot = 0
+        self.frame_bytes = 0
+
+    def push(self, frame, timestamp):
+        """Copy a frame into the oldest slot."""
+        slot = self.slots[self.next_slot]
+        if slot is None or slot.shape != frame.shape or slot.dtype != frame.dtype:
+            slot = self.slots[self.next_slot] = np.empty_like(frame)
+            self.frame_bytes = frame.nbytes
+        np.copyto(slot, frame)
+        self.timestamps[self.next_slot] = timestamp
+        self.next_slot = (self.next_slot + 1) % self.max_frames
+
+    def drain(self, start_time):
+        """Return the [(frame, timestamp)] captured from start_time on, oldest first, giving up all slots."""
+        frames = []
+        for i in range(self.max_frames):
+            slot_index = (self.next_slot + i) % self.max_frames
+            timestamp = self.timestamps[slot_index]
+            if self.slots[slot_index] is not None and timestamp is not None and timestamp >= start_time:
+                frames.append((self.slots[slot_index], timestamp))
+            self.slots[slot_index] = None # the recorder owns the frame now
+            self.timestamps[slot_index] = None
+        return frames
+
+    def get_footprint(self):
+        """Return the number of bytes held by the allocated slots."""
+        return sum(1 for slot in self.slots if slot is not None) * self.frame_bytes
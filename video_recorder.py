@@ -1,62 +1,279 @@
 import cv2
+import json
+import numpy as np
+import os
 import queue
 import threading
 import time
 
+from disk_preflight import FilePreallocator, VIDEO_EXTENT_BYTES
+from trace_profiler import tracer
+
 
 class VideoRecorder:
     """A video recorder that captures frames from a camera and writes them to a video file."""
     """It uses a separate thread to write frames to ensure smooth recording without blocking the main thread."""
+    """Optionally the recording is split into segments by duration or size, listed in a JSON manifest."""
 
-    def __init__(self, filename, resolution, target_fps):
+    def __init__(self, filename, resolution, target_fps, max_buffer_bytes=None, segment_duration=None, segment_max_bytes=None,
+                 preroll_frames=None, is_color=True):
         """Initialize the video recorder with a filename, resolution, and target FPS."""
+        """preroll_frames is a list of (frame, perf_counter timestamp) captured before the start, written first."""
+        """With is_color False the frames are single channel grayscale and encoded as such."""
         self.filename = filename
         self.width, self.height = resolution
         self.target_fps = target_fps
         self.frame_interval = 1.0 / self.target_fps
-        # the buffer size is set to hold enough frames for 5 seconds
-        self.frame_buffer = queue.Queue(maxsize=int(self.target_fps * 5))
+        self.is_color = is_color
+        # the buffer size is set to hold enough frames for 5 seconds, or less if the memory budget says so
+        self.frame_bytes = self.width * self.height * (3 if is_color else 1)
+        max_frames = int(self.target_fps * 5)
+        if max_buffer_bytes is not None:
+            # two extra pool slots: the frame being written and the last written frame
+            max_frames = max(2, min(max_frames, max_buffer_bytes // self.frame_bytes - 2))
+        self.frame_buffer = queue.Queue(maxsize=max_frames)
+        # --- Frame pool: buffers are allocated on demand, then reused for every frame ---
+        self.free_frames = queue.LifoQueue()
+        self.pool_size = max_frames + 2
+        self.allocated_frames = 0
         self.stop_event = threading.Event()
         self.recording_thread = None
         self.last_written_frame = None
+        self.preroll_frames = list(preroll_frames or [])
+        # --- Segment rotation ---
+        self.is_segmented = segment_duration is not None or segment_max_bytes is not None
+        self.segment_frames = int(segment_duration * self.target_fps) if segment_duration else None
+        self.segment_max_bytes = segment_max_bytes
+        self.segments = [] # manifest entries of the finished and current segments
+        self.video_writer = None
+        self.preallocator = None # reserves the current segment's file ahead of its end
+        self.next_writer = None
+        self.next_writer_thread = None
+        self.release_threads = []
+        self.frames_written = 0
+        self.first_frame_time = None # perf_counter time of frame 0, every later frame follows at 1 / target_fps
+        self.SIZE_CHECK_INTERVAL = 30 # frames between two checks of the segment file size
+
+    def get_footprint(self):
+        """Return the number of bytes held by the frame pool and the pre-roll frames not yet written."""
+        return (self.allocated_frames + len(self.preroll_frames)) * self.frame_bytes
 
-    def put_frame(self, frame):
+    def get_queue_fill(self):
+        """Return how full the frame queue is, from 0 to 1; frames are dropped when it is full."""
+        return self.frame_buffer.qsize() / self.frame_buffer.maxsize
+
+    def _get_pool_frame(self, frame):
+        """Return a free pool buffer shaped like frame, or None if the pool is exhausted."""
+        try:
+            pool_frame = self.free_frames.get_nowait()
+            if pool_frame.shape == frame.shape and pool_frame.dtype == frame.dtype:
+                return pool_frame
+            self.allocated_frames -= 1 # the frame size changed, drop the stale buffer
+        except queue.Empty:
+            pass
+        if self.allocated_frames >= self.pool_size:
+            return None
+        self.allocated_frames += 1
+        return np.empty_like(frame)
+
+    def put_frame(self, frame, timestamp=None):
         """Producer: put a frame into the frame buffer."""
-        timestamp = time.perf_counter() # get the timestamp of the frame
+        if timestamp is None:
+            timestamp = time.perf_counter() # get the timestamp of the frame
+        pool_frame = self._get_pool_frame(frame)
+        if pool_frame is None:
+            print("warning: frame pool is exhausted, dropping frame")
+            return
+        np.copyto(pool_frame, frame)
         try:
-            self.frame_buffer.put_nowait((frame.copy(), timestamp))
+            self.frame_buffer.put_nowait((pool_frame, timestamp))
         except queue.Full:
+            self.free_frames.put(pool_frame)
             print("warning: frame buffer is full, dropping frame")
 
+    # ============================================
+    # ------------- Segment Rotation -------------
+    # ============================================
+    def _get_segment_filename(self, index):
+        """Return the file name of a segment (the plain file name when not segmented)."""
+        if not self.is_segmented:
+            return self.filename
+        root, ext = os.path.splitext(self.filename)
+        return f"{root}_part{index + 1:03d}{ext}"
+
+    def get_manifest_filename(self):
+        """Return the file name of the segment manifest."""
+        return os.path.splitext(self.filename)[0] + ".json"
+
+    def _open_writer(self, filename):
+        """Create a video writer for one file."""
+        fourcc = cv2.VideoWriter_fourcc(*'XVID') # set the codec
+        return cv2.VideoWriter(filename, fourcc, self.target_fps, (self.width, self.height), self.is_color)
+
+    def _prepare_next_writer(self):
+        """Open the next segment's writer on a background thread, well before the switch."""
+        filename = self._get_segment_filename(len(self.segments))
+        def open_next_writer():
+            self.next_writer = self._open_writer(filename)
+        self.next_writer_thread = threading.Thread(target=open_next_writer, daemon=True)
+        self.next_writer_thread.start()
+
+    def _start_segment(self):
+        """Add the segment that starts with the next written frame to the manifest, and reserve its file."""
+        filename = self._get_segment_filename(len(self.segments))
+        self.preallocator = FilePreallocator(filename, VIDEO_EXTENT_BYTES)
+        self.segments.append({
+            'file': os.path.basename(filename),
+            'first_frame': self.frames_written,
+            'start_time': self.frames_written / self.target_fps,
+            'num_frames': 0,
+            'end_time': self.frames_written / self.target_fps
+        })
+
+    def _finish_segment(self, is_complete=False):
+        """Close the current segment's manifest entry and rewrite the manifest."""
+        segment = self.segments[-1]
+        segment['num_frames'] = self.frames_written - segment['first_frame']
+        segment['end_time'] = self.frames_written / self.target_fps
+        if self.is_segmented:
+            self._write_manifest(is_complete)
+
+    def _write_manifest(self, is_complete):
+        """Write the manifest atomically, so an interrupted session still lists its finished segments."""
+        manifest = {
+            'video': os.path.basename(self.filename),
+            'fps': self.target_fps,
+            'resolution': [self.width, self.height],
+            'segment_duration': self.segment_frames / self.target_fps if self.segment_frames else None,
+            'segment_max_bytes': self.segment_max_bytes,
+            'complete': is_complete,
+            'segments': self.segments
+        }
+        manifest_filename = self.get_manifest_filename()
+        try:
+            with open(manifest_filename + ".tmp", "w") as f:
+                json.dump(manifest, f, indent=2)
+            os.replace(manifest_filename + ".tmp", manifest_filename)
+        except OSError as e:
+            print(f"warning: cannot write the manifest {manifest_filename}: {e}")
+
+    def _is_segment_due(self):
+        """Start opening the next writer when the segment nears its limit; return True once it is reached."""
+        frames_in_segment = self.frames_written - self.segments[-1]['first_frame']
+        fullness = 0.0
+        if self.segment_frames:
+            fullness = frames_in_segment / self.segment_frames
+        if self.segment_max_bytes and frames_in_segment % self.SIZE_CHECK_INTERVAL == 0:
+            try:
+                size = os.path.getsize(self._get_segment_filename(len(self.segments) - 1))
+                fullness = max(fullness, size / self.segment_max_bytes)
+            except OSError:
+                pass
+        if fullness >= 0.9 and self.next_writer_thread is None:
+            self._prepare_next_writer()
+        return fullness >= 1.0
+
+    def _rotate_segment(self):
+        """Switch to the pre-opened writer between two frames, so no frame is dropped."""
+        if self.next_writer_thread is None:
+            self._prepare_next_writer()
+        self.next_writer_thread.join() # normally it finished opening long ago
+        finished_writer, finished_preallocator = self.video_writer, self.preallocator
+        self.video_writer, self.next_writer, self.next_writer_thread = self.next_writer, None, None
+        self._finish_segment()
+        self._start_segment()
+        # releasing finalizes the file index, which can take a while: keep it off the writer thread
+        release_thread = threading.Thread(target=self._release_writer, args=(finished_writer, finished_preallocator), daemon=True)
+        release_thread.start()
+        self.release_threads.append(release_thread)
+
+    @staticmethod
+    def _release_writer(video_writer, preallocator):
+        """Finalize a segment's file, then give back the space reserved past its end."""
+        video_writer.release()
+        preallocator.close()
+
+    @staticmethod
+    def _remove_file(filename):
+        """Remove an unused segment file, ignoring errors."""
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+
+    def _write(self, frame):
+        """Write one frame to the current segment, rotating segments as needed."""
+        self.video_writer.write(frame)
+        self.frames_written += 1
+        if self.frames_written % self.SIZE_CHECK_INTERVAL == 0:
+            self.preallocator.reserve()
+        if self.is_segmented and self._is_segment_due():
+            self._rotate_segment()
+
+    # ============================================
+    # --------------- Writer Thread --------------
+    # ============================================
     def _writer_thread(self):
         """Consumer: thread that writes frames to the video file."""
-        fourcc = cv2.VideoWriter_fourcc(*'XVID') # set the codec
-        video_writer = cv2.VideoWriter(self.filename, fourcc, self.target_fps, (self.width, self.height))
-        # initialize the metronome
-        next_frame_time = time.perf_counter()
+        self.video_writer = self._open_writer(self._get_segment_filename(0))
+        self._start_segment()
+        # initialize the metronome, at the first pre-roll frame if there is one
+        next_frame_time = self.preroll_frames[0][1] if self.preroll_frames else time.perf_counter()
+        self.first_frame_time = next_frame_time
+        previous_frame = None
+        while self.preroll_frames:
+            frame, frame_timestamp = self.preroll_frames.pop(0)
+            with tracer.span("frame encode"):
+                while previous_frame is not None and next_frame_time < frame_timestamp:
+                    self._write(previous_frame)
+                    next_frame_time += self.frame_interval
+                self._write(frame)
+                next_frame_time += self.frame_interval
+            previous_frame = frame
         # main loop to write frames
         while not self.stop_event.is_set():
+            tracer.profile_checkpoint()
             try:
                 current_frame, frame_timestamp = self.frame_buffer.get(timeout=0.1)
+                previous_frame = self.last_written_frame
                 self.last_written_frame = current_frame
-                # write frames at the target FPS
-                while next_frame_time < frame_timestamp:
-                    video_writer.write(self.last_written_frame)
+                with tracer.span("frame encode"):
+                    # write frames at the target FPS
+                    while next_frame_time < frame_timestamp:
+                        self._write(self.last_written_frame)
+                        next_frame_time += self.frame_interval
+                    self._write(current_frame)
                     next_frame_time += self.frame_interval
-                video_writer.write(current_frame)
-                next_frame_time += self.frame_interval
+                # the previous frame is no longer needed for padding, give it back to the pool
+                if previous_frame is not None:
+                    self.free_frames.put(previous_frame)
             except queue.Empty:
                 if self.stop_event.is_set():
                     break
                 if self.last_written_frame is not None and time.perf_counter() > next_frame_time:
-                     video_writer.write(self.last_written_frame) # copy the last frame if no new frame is available
+                     self._write(self.last_written_frame) # copy the last frame if no new frame is available
                      next_frame_time += self.frame_interval
         # clear the remaining frames in the buffer
         while not self.frame_buffer.empty():
             frame, _ = self.frame_buffer.get_nowait()
-            video_writer.write(frame)
-        video_writer.release()
-        print(f"The video is saved in {self.filename}")
+            self._write(frame)
+        self._release_writer(self.video_writer, self.preallocator)
+        if self.is_segmented and len(self.segments) > 1 and self.frames_written == self.segments[-1]['first_frame']:
+            # the recording stopped right after a switch: drop the empty last segment
+            self._remove_file(self._get_segment_filename(len(self.segments) - 1))
+            self.segments.pop()
+        self._finish_segment(is_complete=True)
+        if self.next_writer_thread is not None:
+            # a writer opened ahead of a switch that never came: remove its empty file
+            self.next_writer_thread.join()
+            self.next_writer.release()
+            self._remove_file(self._get_segment_filename(len(self.segments)))
+        for release_thread in self.release_threads:
+            release_thread.join()
+        if self.is_segmented:
+            print(f"The video is saved in {len(self.segments)} segments, listed in {self.get_manifest_filename()}")
+        else:
+            print(f"The video is saved in {self.filename}")
 
     def start(self):
         """Start the recording thread."""